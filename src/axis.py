@@ -6,6 +6,8 @@ class Axis:
 
    def __init__(self, *args):
       self.callbacks = []
+      # Incremented on each update, allows to detect changes of the axis parameters.
+      self.version = 0
       if len(args) == 1 and isinstance(args[0], dict):
          self.deserialize(args[0])
       elif len(args) > 0:
@@ -14,7 +16,11 @@ class Axis:
    def registerCallback(self, callback):
       self.callbacks.append(callback)
 
+   def isLogarithmic(self):
+      return False
+
    def onUpdate(self):
+      self.version += 1
       for callback in self.callbacks:
          callback()
 
@@ -38,6 +44,10 @@ class Time(Axis):
    def convertTo(self, x):
       return (x * self.total_time_ms)
 
+   # Convert from time in milliseconds to range [0,1].
+   def convertFrom(self, value):
+      return (value / self.total_time_ms)
+
 #===============================================================================
 class Frequency(Axis):
 
@@ -59,10 +69,17 @@ class Frequency(Axis):
    def getUnit(self):
       return '[Hz]'
 
+   def isLogarithmic(self):
+      return True
+
    # Convert from range [0,1] to frequency in Hz.
    def convertTo(self, y):
       return (10.0**((1.0 - y) * math.log10(self.min_freq_hz / self.max_freq_hz)) * self.max_freq_hz)
 
+   # Convert from frequency in Hz to range [0,1].
+   def convertFrom(self, value):
+      return (1.0 - math.log10(value / self.max_freq_hz) / math.log10(self.min_freq_hz / self.max_freq_hz))
+
 #===============================================================================
 class Amplitude(Axis):
 
@@ -83,6 +100,10 @@ class Amplitude(Axis):
    def convertTo(self, y):
       return ((y - 1.0) * self.amplitude_range_db)
 
+   # Convert from amplitude in dB to range [0,1].
+   def convertFrom(self, value):
+      return (value / self.amplitude_range_db + 1.0)
+
 #===============================================================================
 class Angle(Axis):
 
@@ -93,6 +114,10 @@ class Angle(Axis):
    def convertTo(self, x):
       return (x * 360.0)
 
+   # Convert from range [0,360] to [0,1].
+   def convertFrom(self, value):
+      return (value / 360.0)
+
 #===============================================================================
 class Unit(Axis):
 
@@ -102,3 +127,31 @@ class Unit(Axis):
    # Convert from range [0,1] to [-1,1].
    def convertTo(self, x):
       return (x * 2.0 - 1.0)
+
+   # Convert from range [-1,1] to [0,1].
+   def convertFrom(self, value):
+      return ((value + 1.0) / 2.0)
+
+#===============================================================================
+class Partial(Axis):
+
+   def set(self, partial_count):
+      self.partial_count = partial_count
+      self.onUpdate()
+
+   def serialize(self):
+      return {'Partials': self.partial_count}
+
+   def deserialize(self, input):
+      self.set(input['Partials'])
+
+   def getUnit(self):
+      return '[#]'
+
+   # Convert from range [0,1] to number of the partial, starting from 1 (the fundamental).
+   def convertTo(self, x):
+      return (1.0 + x * (self.partial_count - 1))
+
+   # Convert from number of the partial to range [0,1].
+   def convertFrom(self, value):
+      return ((value - 1.0) / max(self.partial_count - 1, 1))
@@ -0,0 +1,129 @@
+
+import collections, os, tempfile, threading
+
+#===============================================================================
+def getDefaultPath(program_name):
+   # Per-user cache directory.
+   root = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+   return os.path.join(root, program_name.replace(' ', '-').lower())
+
+#===============================================================================
+class DiskCache:
+
+   def __init__(self, path, max_bytes):
+      # Each entry is a file named by its key. Time of the last modification
+      # is updated on every read, so that the least recently used entries can be found.
+      self.path = path
+      self.max_bytes = max_bytes
+      os.makedirs(self.path, exist_ok = True)
+      self.size_bytes = sum(size for path,size,mtime in self.listEntries())
+      # Entries are files, only the size needs to be guarded when the cache is used by more threads.
+      self.lock = threading.Lock()
+
+   def listEntries(self):
+      entries = []
+      for entry in os.scandir(self.path):
+         if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+      return entries
+
+   def get(self, key):
+      # Returns a copy of the entry, or None if there is no such entry. File is neither kept open nor mapped,
+      # because such file cannot be replaced or deleted on Windows, so entries could not be updated or evicted.
+      path = os.path.join(self.path, key)
+      try:
+         with open(path, 'rb') as f:
+            data = bytearray(os.fstat(f.fileno()).st_size)
+            if f.readinto(data) != len(data):
+               return None
+         os.utime(path)
+      except OSError:
+         return None
+      return data
+
+   def put(self, key, data):
+      # Entry is written to a temporary file first, so that readers never see a partial entry.
+      try:
+         fd, tmp_path = tempfile.mkstemp(dir = self.path, suffix = '.tmp')
+      except OSError:
+         return
+      try:
+         with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+         os.replace(tmp_path, os.path.join(self.path, key))
+      except OSError:
+         # Entry may be just read by another process, the temporary file is not left behind.
+         try:
+            os.remove(tmp_path)
+         except OSError:
+            pass
+         return
+      with self.lock:
+         self.size_bytes += memoryview(data).nbytes
+         if self.size_bytes > self.max_bytes:
+            self.evict()
+
+   def evict(self):
+      # Least recently used entries are deleted until the cache fits into the limit.
+      # Must be called with the lock held.
+      entries = sorted(self.listEntries(), key = lambda entry: entry[2])
+      self.size_bytes = sum(size for path,size,mtime in entries)
+      for path,size,mtime in entries:
+         if self.size_bytes <= self.max_bytes:
+            break
+         try:
+            os.remove(path)
+            self.size_bytes -= size
+         except OSError:
+            # Entry may be just read by another process, older ones are deleted instead.
+            pass
+
+#===============================================================================
+class MemoryCache:
+
+   def __init__(self, max_bytes):
+      # Entries are kept in the order of use, the least recently used first.
+      self.max_bytes = max_bytes
+      self.entries = collections.OrderedDict()
+      self.size_bytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      # Cache can be shared by all threads of the process.
+      self.lock = threading.Lock()
+
+   def get(self, key):
+      with self.lock:
+         data = self.entries.get(key)
+         if data is None:
+            self.misses += 1
+         else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+         return data
+
+   def put(self, key, data):
+      size = memoryview(data).nbytes
+      with self.lock:
+         if key in self.entries:
+            self.size_bytes -= memoryview(self.entries.pop(key)).nbytes
+         # Entry larger than the whole cache would only evict everything else.
+         if size > self.max_bytes:
+            return
+         self.entries[key] = data
+         self.size_bytes += size
+         while self.size_bytes > self.max_bytes:
+            key,data = self.entries.popitem(last = False)
+            self.size_bytes -= memoryview(data).nbytes
+            self.evictions += 1
+
+   def getStats(self):
+      with self.lock:
+         return {
+            'Entries': len(self.entries),
+            'Size [B]': self.size_bytes,
+            'Max size [B]': self.max_bytes,
+            'Hits': self.hits,
+            'Misses': self.misses,
+            'Evictions': self.evictions}
@@ -0,0 +1,41 @@
+
+import cmath, math
+
+#===============================================================================
+class FFT:
+
+   def __init__(self, size):
+      # Size must be a power of 2.
+      self.size = size
+      bits = size.bit_length() - 1
+      self.bit_reversed = [int('{:0{}b}'.format(i, bits)[::-1], 2) if bits > 0 else 0 for i in range(size)]
+      self.twiddles = {}
+      half = 1
+      while half < size:
+         self.twiddles[half] = [cmath.exp(-1j * math.pi * k / half) for k in range(half)]
+         half *= 2
+
+   def transform(self, values):
+      x = [values[i] for i in self.bit_reversed]
+      n = self.size
+      half = 1
+      while half < n:
+         step = 2 * half
+         twiddles = self.twiddles[half]
+         # Butterflies of each stage are processed as whole slices, either per twiddle factor
+         # (strided over all blocks) or per block, whichever gives fewer and longer slices.
+         if half < (n // step):
+            for k in range(half):
+               w = twiddles[k]
+               even = x[k::step]
+               odd = [v * w for v in x[k+half::step]]
+               x[k::step] = [e + o for e,o in zip(even, odd)]
+               x[k+half::step] = [e - o for e,o in zip(even, odd)]
+         else:
+            for start in range(0, n, step):
+               even = x[start:start+half]
+               odd = [v * w for v,w in zip(x[start+half:start+step], twiddles)]
+               x[start:start+half] = [e + o for e,o in zip(even, odd)]
+               x[start+half:start+step] = [e - o for e,o in zip(even, odd)]
+         half = step
+      return x
@@ -0,0 +1,98 @@
+
+from src import fft
+
+import bisect, math
+
+# Upper limit of the number of partials of a harmonic bank.
+MAX_PARTIALS = 256
+# Sum of all partials is tabulated over one period of the fundamental at samples which are multiples of the interval,
+# and the tables are crossfaded between them. Table has this many points per partial, but at least the minimum.
+TABLE_INTERVAL     = 4096
+TABLE_OVERSAMPLING = 32
+MIN_TABLE_SIZE     = 256
+
+#===============================================================================
+class HarmonicBank:
+
+   def __init__(self, partial_count, start_curve, end_curve, sound_info, frequency_curve):
+      # Levels of partials are given by the spectrum curves at the start and at the end of the sound,
+      # with the first partial (the fundamental) at X = 0 and the last one at X = 1, and Y on the amplitude axis.
+      # Level of each partial changes linearly in dB between them, so that each partial has its own envelope.
+      # Levels are scaled so that the sum of all partials stays in range [-1,1] at any time.
+      self.sound_info = sound_info
+      self.frequency_curve = frequency_curve
+      self.frequency_xs = [x for x,y in frequency_curve.points]
+      amplitude_func = sound_info.amplitude_axis.convertTo
+      positions = [ix / max(partial_count - 1, 1) for ix in range(partial_count)]
+      self.start_db = [amplitude_func(start_curve.getY(x)) for x in positions]
+      self.end_db = [amplitude_func(end_curve.getY(x)) for x in positions]
+      self.scale = 1.0
+      total = max(sum(self.getLevels(0.0)), sum(self.getLevels(1.0)))
+      self.scale = (1.0 / total) if (total > 0.0) else 0.0
+      # Tables are mostly used by consecutive ranges of samples, only the last ones are kept.
+      self.ffts = {}
+      self.tables = {}
+
+   def getLevels(self, x):
+      # Relative amplitudes of partials at the given position within the sound.
+      min_amplitude_db = self.sound_info.min_amplitude_db
+      levels = []
+      for start_db,end_db in zip(self.start_db, self.end_db):
+         amplitude_db = start_db + x * (end_db - start_db)
+         levels.append(self.scale * 10.0**(amplitude_db / 20.0) if (amplitude_db > min_amplitude_db) else 0.0)
+      return levels
+
+   def getMaxIncrement(self, start, stop):
+      # Highest phase increment per sample in range [start, stop) of samples, from the points of the frequency curve
+      # within the range and its ends. Frequency axis is increasing, so the highest Y gives the highest frequency.
+      last_ix = self.sound_info.num_samples - 1.0
+      x1 = min(max(start / last_ix, 0.0), 1.0)
+      x2 = min(max(stop / last_ix, 0.0), 1.0)
+      points = self.frequency_curve.points
+      ys = [y for x,y in points[bisect.bisect_left(self.frequency_xs, x1):bisect.bisect_right(self.frequency_xs, x2)]]
+      max_y = max(ys + [self.frequency_curve.getY(x1), self.frequency_curve.getY(x2)])
+      return self.sound_info.frequency_axis.convertTo(max_y) / self.sound_info.sampling_rate_hz
+
+   def getTable(self, table_ix):
+      # Sum of partials over one period of the fundamental, at the sample at the given multiple of the interval.
+      # Partials above the Nyquist frequency anywhere between the neighbouring tables are left out, they would alias.
+      if table_ix not in self.tables:
+         start = table_ix * TABLE_INTERVAL
+         levels = self.getLevels(min(start / (self.sound_info.num_samples - 1.0), 1.0))
+         increment = self.getMaxIncrement(start - TABLE_INTERVAL, start + TABLE_INTERVAL)
+         count = min(len(levels), max(math.ceil(0.5 / increment) - 1, 0)) if (increment > 0.0) else len(levels)
+         size = MIN_TABLE_SIZE
+         while size < TABLE_OVERSAMPLING * count:
+            size *= 2
+         if size not in self.ffts:
+            self.ffts[size] = fft.FFT(size)
+         # Transform of the spectrum with the level of the k-th partial at index k gives the negated sum of sines.
+         spectrum = [0j] * size
+         spectrum[1:count+1] = levels[:count]
+         table = [-v.imag for v in self.ffts[size].transform(spectrum)]
+         # Table is extended, so that interpolation does not need to wrap around.
+         self.tables[table_ix] = table + table[:2]
+         while len(self.tables) > 2:
+            del self.tables[min(self.tables)]
+      return self.tables[table_ix]
+
+   def getSamples(self, phases, start, stop):
+      # Returns list of samples in range [start, stop) at the given positions within the period of the fundamental.
+      # Tables are built once per interval, independently of the number of partials, so the cost per sample
+      # is the linear interpolation within two tables and between them.
+      samples = []
+      for first in range(start - start % TABLE_INTERVAL, stop, TABLE_INTERVAL):
+         table1 = self.getTable(first // TABLE_INTERVAL)
+         table2 = self.getTable(first // TABLE_INTERVAL + 1)
+         size1 = len(table1) - 2
+         size2 = len(table2) - 2
+         for ix in range(max(start, first), min(stop, first + TABLE_INTERVAL)):
+            phase = phases[ix - start]
+            pos1 = phase * size1
+            ix1 = int(pos1)
+            value1 = table1[ix1] + (pos1 - ix1) * (table1[ix1+1] - table1[ix1])
+            pos2 = phase * size2
+            ix2 = int(pos2)
+            value2 = table2[ix2] + (pos2 - ix2) * (table2[ix2+1] - table2[ix2])
+            samples.append(value1 + ((ix - first) / TABLE_INTERVAL) * (value2 - value1))
+      return samples
@@ -0,0 +1,105 @@
+
+from src import spec
+
+import collections, sys
+
+# Kinds of differences between two frozen values.
+SET   = 0 # Value is replaced.
+SPAN  = 1 # Range of elements of a tuple is replaced by a range of different length.
+ITEMS = 2 # Some elements of a tuple are changed, each with its own difference.
+
+#===============================================================================
+def diffValues(old, new):
+   # Returns None if the values are equal. Comparison of shared parts is cheap, because they are identical.
+   if old == new:
+      return None
+   if not (isinstance(old, tuple) and isinstance(new, tuple) and (type(old) is type(new))):
+      return (SET, old, new)
+   # Skip the common prefix and suffix.
+   start = 0
+   count = min(len(old), len(new))
+   while (start < count) and (old[start] == new[start]):
+      start += 1
+   stop = 0
+   while (stop < count - start) and (old[-1-stop] == new[-1-stop]):
+      stop += 1
+   if len(old) != len(new):
+      return (SPAN, start, old[start:len(old)-stop], new[start:len(new)-stop])
+   changes = tuple(
+      (ix, diffValues(old[ix], new[ix]))
+      for ix in range(start, len(old)-stop)
+      if old[ix] != new[ix])
+   # Replacing the whole value is smaller when most of the elements are changed.
+   if 2*len(changes) > len(old):
+      return (SET, old, new)
+   return (ITEMS, changes)
+
+#===============================================================================
+def applyDiff(value, diff, forward):
+   # Returns a new value, which shares the unchanged parts with the given one.
+   if diff[0] == SET:
+      return diff[2] if forward else diff[1]
+   elif diff[0] == SPAN:
+      start, old, new = diff[1:]
+      if not forward:
+         old, new = new, old
+      return type(value)(value[:start] + new + value[start+len(old):])
+   else:
+      items = list(value)
+      for ix,item_diff in diff[1]:
+         items[ix] = applyDiff(items[ix], item_diff, forward)
+      return type(value)(items)
+
+#===============================================================================
+def estimateSize(value):
+   size = sys.getsizeof(value)
+   if isinstance(value, tuple):
+      size += sum(estimateSize(item) for item in value)
+   return size
+
+#===============================================================================
+class History:
+
+   def __init__(self, snapshot, max_bytes):
+      # Only the current snapshot is kept, other ones are reconstructed from the differences.
+      self.current = spec.freeze(snapshot)
+      self.max_bytes = max_bytes
+      self.size_bytes = 0
+      # Each step holds a difference and its estimated size.
+      self.undo_steps = collections.deque()
+      self.redo_steps = []
+
+   def canUndo(self):
+      return len(self.undo_steps) > 0
+
+   def canRedo(self):
+      return len(self.redo_steps) > 0
+
+   def record(self, snapshot):
+      # Returns True if the snapshot differs from the current one.
+      diff = diffValues(self.current, spec.freeze(snapshot))
+      if diff is None:
+         return False
+      # New snapshot is built from the current one, so that they share unchanged parts.
+      self.current = applyDiff(self.current, diff, True)
+      self.undo_steps.append((diff, estimateSize(diff)))
+      self.size_bytes += self.undo_steps[-1][1]
+      # Steps which were undone cannot be redone after a new change.
+      self.size_bytes -= sum(size for diff,size in self.redo_steps)
+      self.redo_steps = []
+      # Oldest steps are dropped when the history is too large.
+      while (self.size_bytes > self.max_bytes) and (len(self.undo_steps) > 0):
+         self.size_bytes -= self.undo_steps.popleft()[1]
+      return True
+
+   def undo(self):
+      step = self.undo_steps.pop()
+      self.redo_steps.append(step)
+      self.current = applyDiff(self.current, step[0], False)
+      return spec.thaw(self.current)
+
+   def redo(self):
+      step = self.redo_steps.pop()
+      self.undo_steps.append(step)
+      self.current = applyDiff(self.current, step[0], True)
+      return spec.thaw(self.current)
@@ -0,0 +1,186 @@
+
+from src import history, spec
+
+import os, pickle, queue, struct, sys, threading, time, zlib
+
+if sys.platform == 'win32':
+   import msvcrt
+else:
+   import fcntl
+
+# Changes arriving within this interval are written and synced to the disk together.
+SYNC_INTERVAL_S = 1.0
+# Journal is rewritten as a single snapshot after this many changes.
+COMPACT_RECORDS = 200
+
+# Each record is a length and CRC-32 of the payload, followed by the pickled payload.
+# Payload is either ('SNAPSHOT', frozen specification) or ('DELTA', difference to the previous state).
+RECORD_HEADER = struct.Struct('<II')
+# Each running instance has its own journal, and holds the lock of the lock file next to it.
+JOURNAL_EXTENSION = '.journal'
+LOCK_EXTENSION = '.lock'
+
+#===============================================================================
+def readRecords(path):
+   # Records after the first incomplete or damaged one (e.g. after a crash during writing) are ignored.
+   records = []
+   with open(path, 'rb') as f:
+      while True:
+         header = f.read(RECORD_HEADER.size)
+         if len(header) < RECORD_HEADER.size:
+            break
+         length, crc = RECORD_HEADER.unpack(header)
+         payload = f.read(length)
+         if (len(payload) < length) or (zlib.crc32(payload) != crc):
+            break
+         records.append(pickle.loads(payload))
+   return records
+
+#===============================================================================
+def recover(path):
+   # Returns the last state recorded in the journal, or None if there is no journal.
+   try:
+      records = readRecords(path)
+   except (OSError, pickle.UnpicklingError):
+      return None
+   current = None
+   for kind,value in records:
+      if kind == 'SNAPSHOT':
+         current = value
+      elif current is not None:
+         current = history.applyDiff(current, value, True)
+   return spec.thaw(current) if (current is not None) else None
+
+#===============================================================================
+def lockFile(path):
+   # Returns the lock file opened and locked by this process, or None if it is locked by another process.
+   # Lock is released by the system when the process exits, also when it crashes.
+   f = open(path, 'a+b')
+   try:
+      f.seek(0)
+      if sys.platform == 'win32':
+         msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+      else:
+         fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+   except OSError:
+      f.close()
+      return None
+   return f
+
+#===============================================================================
+def removeLockFile(lock):
+   # Lock file is closed first, locked files cannot be removed on Windows.
+   lock.close()
+   try:
+      os.remove(lock.name)
+   except OSError:
+      pass
+
+#===============================================================================
+def findStale(directory):
+   # Returns path of the most recent journal left by an instance which is not running any more,
+   # together with its lock file, which is held until the journal is discarded. Returns (None, None) if there is none.
+   try:
+      paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(JOURNAL_EXTENSION)]
+   except OSError:
+      return (None, None)
+   journals = []
+   for path in paths:
+      try:
+         journals.append((os.path.getmtime(path), path))
+      except OSError:
+         pass
+   for mtime,path in sorted(journals, reverse = True):
+      lock = lockFile(path + LOCK_EXTENSION)
+      if lock is not None:
+         # Journal may have been discarded by another instance in the meantime.
+         if os.path.exists(path):
+            return (path, lock)
+         removeLockFile(lock)
+   return (None, None)
+
+#===============================================================================
+def discardStale(path, lock):
+   try:
+      os.remove(path)
+   except OSError:
+      pass
+   removeLockFile(lock)
+
+#===============================================================================
+def encodeRecord(record):
+   payload = pickle.dumps(record, protocol = pickle.HIGHEST_PROTOCOL)
+   return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+#===============================================================================
+class Journal:
+
+   def __init__(self, path, snapshot):
+      # New journal is started with the given frozen snapshot. All disk operations
+      # are done by the journal thread, so that recording a change never blocks.
+      # Journal is locked before it is created, so that it is never taken for a stale one.
+      self.path = path
+      os.makedirs(os.path.dirname(self.path), exist_ok = True)
+      self.lock = lockFile(self.path + LOCK_EXTENSION)
+      self.queue = queue.Queue()
+      self.queue.put(('SNAPSHOT', snapshot))
+      self.thread = threading.Thread(target = self.journalThread)
+      self.thread.start()
+
+   def record(self, snapshot):
+      # Snapshot must be frozen, only its difference to the previous one is written.
+      self.queue.put(('RECORD', snapshot))
+
+   def close(self, discard = True):
+      # Journal is not needed after a clean exit, it is only kept to recover from a crash.
+      self.queue.put(('CLOSE', discard))
+      self.thread.join()
+
+   def writeSnapshot(self, snapshot):
+      # Snapshot replaces the whole journal. It is written into a temporary file first,
+      # so that there is always a complete journal on the disk.
+      if self.file is not None:
+         self.file.close()
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+         f.write(encodeRecord(('SNAPSHOT', snapshot)))
+         f.flush()
+         os.fsync(f.fileno())
+      os.replace(tmp_path, self.path)
+      self.file = open(self.path, 'ab')
+      self.record_count = 0
+
+   def journalThread(self):
+      self.file = None
+      current = None
+      while True:
+         cmds = [self.queue.get()]
+         # Collect changes arriving within the sync interval.
+         deadline = time.monotonic() + SYNC_INTERVAL_S
+         while cmds[-1][0] == 'RECORD':
+            try:
+               cmds.append(self.queue.get(timeout = max(deadline - time.monotonic(), 0.0)))
+            except queue.Empty:
+               break
+         for cmd in cmds:
+            if cmd[0] == 'SNAPSHOT':
+               current = cmd[1]
+               self.writeSnapshot(current)
+            elif cmd[0] == 'RECORD':
+               diff = history.diffValues(current, cmd[1])
+               if diff is not None:
+                  current = cmd[1]
+                  self.file.write(encodeRecord(('DELTA', diff)))
+                  self.record_count += 1
+            elif cmd[0] == 'CLOSE':
+               self.file.close()
+               if cmd[1]:
+                  os.remove(self.path)
+               if self.lock is not None:
+                  removeLockFile(self.lock)
+               return
+         # All changes of the batch are synced at once.
+         self.file.flush()
+         os.fsync(self.file.fileno())
+         if self.record_count >= COMPACT_RECORDS:
+            self.writeSnapshot(current)
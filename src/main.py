@@ -1,20 +1,45 @@
 
-from src import axis, plot, wavegen
+from src import axis, cache, harmonics, history, journal, noise, plot, project, pyramid, server, spectrogram, wavegen
 
-import json, re
+import json, os, queue, re
 import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.filedialog as tkfiledialog
+import tkinter.messagebox as tkmessagebox
+import tkinter.simpledialog as tksimpledialog
 
 PROGRAM_NAME       = 'Waveform Editor'
 
 SAMPLING_RATES_HZ  = (8000, 11025, 16000, 22050, 32000, 44100, 48000)
+# Sampling rates offered for export at more rates, the sound is rendered once at the highest of them.
+EXPORT_RATES_HZ    = (22050, 48000)
 MAX_WAVE_COUNT     = 8
 PLOT_WIDTH_PX      = 400
 PLOT_HEIGHT_PX     = 200
+SPECTROGRAM_HEIGHT_PX = 100
+SPECTROGRAM_WINDOW_SIZE = 1024
+SPECTROGRAM_HOP_SIZE    = 256
+MAX_FRAME_RATE_FPS = 60
+RENDER_POLL_MS     = 50
+# Previews are sent at most once per interval while a curve is dragged in live mode,
+# and rendered within the latency budget.
+LIVE_PREVIEW_INTERVAL_MS = 50
+LIVE_LATENCY_BUDGET_MS   = 30
+# Sound is rendered in advance when there is no change for this time.
+IDLE_RENDER_DELAY_MS = 1000
+# Interval of updates of the shown statistics of the render cache.
+CACHE_STATS_POLL_MS = 1000
+# Estimated memory used by the undo/redo history.
+HISTORY_MAX_BYTES = 4 * 1024 * 1024
+# Rendered sounds are kept on disk between sessions.
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Samples of recently rendered waves are kept in memory, so that switching between variants does not render them again.
+MEMORY_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# Waves are rendered in parallel by worker processes, one core is left for the editor.
+RENDER_PROCESS_COUNT = min(MAX_WAVE_COUNT, (os.cpu_count() or 1) - 1)
 
 MIN_TOTAL_TIME_MS  = 10
-MAX_TOTAL_TIME_MS  = 10000
+MAX_TOTAL_TIME_MS  = 600000
 MIN_FREQUENCY_HZ   = 20
 MAX_FREQUENCY_HZ   = 20000
 AMPLITUDE_RANGE_DB = 60
@@ -23,6 +48,11 @@ CUSTOM_WAVEFORM_CURVE = (
    (None,       (0.0, 0.5), (0.0, 1.0)),
    ((0.5, 1.0), (0.5, 0.5), (0.5, 0.0)),
    ((1.0, 0.0), (1.0, 0.5), None))
+# Levels of partials of a harmonic bank, falling from the fundamental to the last partial.
+HARMONIC_SPECTRUM_CURVE = (
+   (None,       (0.0, 1.0), (1/3, 5/6)),
+   ((2/3, 2/3), (1.0, 0.5), None))
+HARMONIC_PARTIAL_COUNT = 16
 
 # That gives roughly the same width for both.
 INTEGER_SELECT_WIDTH = 5
@@ -106,6 +136,50 @@ class IntegerSelect:
          self.value = v
          self.callback(v)
 
+#===============================================================================
+class StringSelect:
+
+   def __init__(self, tk_parent, text, width, init_value, valid_values, callback):
+      self.value = init_value
+      self.valid_values = valid_values
+      self.callback = callback
+      # String variable associated with the combobox.
+      self.string_var = StringVariable(init_value, self.onUpdate)
+      # Frame.
+      self.frame = tk.Frame(tk_parent)
+      # Label.
+      self.label = tk.Label(self.frame, text = text)
+      # Combobox.
+      self.combo = ttk.Combobox(self.frame, textvariable = self.string_var.getTkVar(), width = width)
+      self.combo['values'] = valid_values
+      self.combo.state(['readonly'])
+      # Configure inner grid.
+      self.label.grid(row = 0, column = 0, sticky = 'NE', **pad('E'))
+      self.combo.grid(row = 0, column = 1, sticky = 'NE')
+
+   def grid(self, **kwargs):
+      self.frame.grid(**kwargs)
+
+   def configure(self, **kwargs):
+      self.label.configure(**kwargs)
+      # Enabled combobox stays read-only.
+      if kwargs.get('state') == 'normal':
+         kwargs['state'] = 'readonly'
+      self.combo.configure(**kwargs)
+
+   def get(self):
+      return self.value
+
+   def set(self, value):
+      if value in self.valid_values:
+         self.value = value
+         self.string_var.set(self.value)
+
+   def onUpdate(self, value):
+      if self.value != value:
+         self.value = value
+         self.callback(value)
+
 #===============================================================================
 class IntegerEntry:
 
@@ -190,9 +264,9 @@ class WaveListWidget:
    def grid(self, **kwargs):
       self.frame.grid(**kwargs)
 
-   def setCount(self, count):
+   def setCount(self, count, index = 0):
       self.count = count
-      self.index = 0 if (self.min_count > 0) else None
+      self.index = index if (self.min_count > 0) else None
       self.configureButtons()
 
    def createOnSelectFunc(self, index):
@@ -242,7 +316,7 @@ class WaveListWidget:
 #===============================================================================
 class CustomWaveformTop:
 
-   def __init__(self, tk_parent, width, height, input_curve, zoom_widget, callback):
+   def __init__(self, tk_parent, width, height, input_curve, zoom_widget, scheduler, callback):
       self.wnd = tk.Toplevel(tk_parent)
       self.wnd.title('Custom waveform')
       # Waveform plot.
@@ -252,7 +326,8 @@ class CustomWaveformTop:
          x_axis      = axis.Angle(),
          y_axis      = axis.Unit(),
          zoom_widget = zoom_widget,
-         callback    = callback)
+         callback    = callback,
+         scheduler   = scheduler)
       # Load the input curve.
       self.deserialize(input_curve)
       # Configure grid.
@@ -266,12 +341,53 @@ class CustomWaveformTop:
    def deserialize(self, input_curve):
       self.waveform_plot.deserialize(input_curve)
 
+#===============================================================================
+class SpectrumTop:
+
+   def __init__(self, tk_parent, width, height, input_curves, partial_count, amplitude_range_db, zoom_widget, scheduler, callback):
+      # Spectra at the start and at the end of the sound, each partial changes between them.
+      self.wnd = tk.Toplevel(tk_parent)
+      self.wnd.title('Harmonic spectrum')
+      # Axes are owned by the window, the amplitude axis is a copy of the one of the sound.
+      self.partial_axis = axis.Partial(partial_count)
+      amplitude_axis = axis.Amplitude(amplitude_range_db)
+      # Spectrum plots.
+      self.labels = [ttk.Label(self.wnd, text = text) for text in ('Start', 'End')]
+      self.spectrum_plots = [
+         plot.Panel(self.wnd,
+            width       = width,
+            height      = height,
+            x_axis      = self.partial_axis,
+            y_axis      = amplitude_axis,
+            zoom_widget = zoom_widget,
+            callback    = callback,
+            scheduler   = scheduler)
+         for ix in range(2)]
+      # Load the input curves.
+      self.deserialize(input_curves)
+      # Configure grid.
+      self.wnd.columnconfigure(0, weight = 1)
+      for ix,(label,spectrum_plot) in enumerate(zip(self.labels, self.spectrum_plots)):
+         self.wnd.rowconfigure(2*ix+1, weight = 1)
+         label.grid(column = 0, row = 2*ix, sticky = 'NW', **pad('NEW'))
+         spectrum_plot.grid(column = 0, row = 2*ix+1, sticky = 'NSEW')
+
+   def setPartialCount(self, partial_count):
+      self.partial_axis.set(partial_count)
+
+   def serialize(self):
+      return tuple(spectrum_plot.serialize() for spectrum_plot in self.spectrum_plots)
+
+   def deserialize(self, input_curves):
+      for spectrum_plot,input_curve in zip(self.spectrum_plots, input_curves):
+         spectrum_plot.deserialize(input_curve)
+
 #===============================================================================
 
 class WaveformWidget:
 
    def __init__(self, tk_parent, callback):
-      waveform_types = ('Sine', 'Triangle', 'Square', 'Sawtooth', 'Noise', 'Custom')
+      waveform_types = ('Sine', 'Triangle', 'Square', 'Sawtooth', 'Noise', 'Harmonics', 'Custom')
       self.callback = callback
       # String variable associated with the radio button.
       self.string_var = StringVariable(waveform_types[0], self.onUpdate)
@@ -281,7 +397,7 @@ class WaveformWidget:
       self.radio = [
          ttk.Radiobutton(self.frame, text = v, variable = self.string_var.getTkVar(), value = v)
          for v in waveform_types]
-      # Custom waveform button.
+      # Button defining the custom waveform, or the spectrum of harmonics.
       self.custom_btn = ttk.Button(self.frame,
          text    = 'Define',
          state   = 'disabled',
@@ -294,9 +410,36 @@ class WaveformWidget:
          lower_limit = 0,
          upper_limit = 359,
          callback    = self.onUpdate)
+      # Number of partials of harmonics.
+      self.partial_count = IntegerEntry(self.frame,
+         text        = 'Partials',
+         width       = 5,
+         init_value  = HARMONIC_PARTIAL_COUNT,
+         lower_limit = 1,
+         upper_limit = harmonics.MAX_PARTIALS,
+         callback    = self.onUpdate)
+      # Color of noise.
+      self.noise_color = StringSelect(self.frame,
+         text         = 'Color',
+         width        = INTEGER_SELECT_WIDTH,
+         init_value   = noise.NOISE_COLORS[0],
+         valid_values = noise.NOISE_COLORS,
+         callback     = self.onUpdate)
+      # Seed of noise, the same seed gives the same noise.
+      self.noise_seed = IntegerEntry(self.frame,
+         text        = 'Seed',
+         width       = 5,
+         init_value  = 0,
+         lower_limit = 0,
+         upper_limit = 99999,
+         callback    = self.onUpdate)
       # Custom waveform.
       self.custom_curve = CUSTOM_WAVEFORM_CURVE
       self.custom_top = None
+      # Spectrum of harmonics.
+      self.spectrum_curve = HARMONIC_SPECTRUM_CURVE
+      self.end_spectrum_curve = HARMONIC_SPECTRUM_CURVE
+      self.spectrum_top = None
       # Save initial value.
       self.value = self.determineValue()
       # Configure inner grid.
@@ -305,6 +448,9 @@ class WaveformWidget:
       ix = len(self.radio)
       self.custom_btn.grid (row = ix,   column = 0, sticky = 'NW', **pad('EW', west = 18))
       self.phase_shift.grid(row = ix+1, column = 0, sticky = 'NE', **pad('NSEW', north = 10))
+      self.partial_count.grid(row = ix+2, column = 0, sticky = 'NE', **pad('SEW'))
+      self.noise_color.grid(row = ix+3, column = 0, sticky = 'NE', **pad('SEW'))
+      self.noise_seed.grid (row = ix+4, column = 0, sticky = 'NE', **pad('SEW'))
 
    def grid(self, **kwargs):
       self.frame.grid(**kwargs)
@@ -316,28 +462,58 @@ class WaveformWidget:
       self.value = input
       self.string_var.set(self.value['Type'])
       self.phase_shift.set(self.value.get('Phase [deg]', 0))
+      self.noise_color.set(self.value.get('Color', noise.NOISE_COLORS[0]))
+      self.noise_seed.set(self.value.get('Seed', 0))
+      self.partial_count.set(self.value.get('Partials', HARMONIC_PARTIAL_COUNT))
       self.custom_curve = self.value.get('Curve', CUSTOM_WAVEFORM_CURVE)
+      self.spectrum_curve = self.value.get('Spectrum', HARMONIC_SPECTRUM_CURVE)
+      self.end_spectrum_curve = self.value.get('End spectrum', self.spectrum_curve)
       self.configureElements()
 
    def configureElements(self):
-      self.custom_btn.configure(state = 'normal' if (self.value['Type'] == 'Custom') else 'disabled')
+      self.custom_btn.configure(state = 'normal' if (self.value['Type'] in ('Custom', 'Harmonics')) else 'disabled')
+      self.partial_count.configure(state = 'normal' if (self.value['Type'] == 'Harmonics') else 'disabled')
       self.phase_shift.configure(state = 'normal' if (self.value['Type'] != 'Noise') else 'disabled')
+      self.noise_color.configure(state = 'normal' if (self.value['Type'] == 'Noise') else 'disabled')
+      self.noise_seed.configure(state = 'normal' if (self.value['Type'] == 'Noise') else 'disabled')
 
    def determineValue(self):
-      return {
-         'Type': self.string_var.get(),
-         'Phase [deg]': self.phase_shift.get(),
-         'Curve': self.custom_curve}
+      # Only parameters which apply to the type are included, others get their defaults when loaded.
+      value = {'Type': self.string_var.get()}
+      if value['Type'] == 'Noise':
+         value['Color'] = self.noise_color.get()
+         value['Seed'] = self.noise_seed.get()
+      else:
+         value['Phase [deg]'] = self.phase_shift.get()
+      if value['Type'] == 'Harmonics':
+         value['Partials'] = self.partial_count.get()
+         value['Spectrum'] = self.spectrum_curve
+         value['End spectrum'] = self.end_spectrum_curve
+      elif value['Type'] == 'Custom':
+         value['Curve'] = self.custom_curve
+      return value
 
    def onCustomDefine(self):
       # TODO: Morph between two custom waveforms.
       # TODO: Remember window size.
-      self.custom_top = CustomWaveformTop(self.frame,
-         width       = PLOT_WIDTH_PX,
-         height      = PLOT_HEIGHT_PX,
-         input_curve = self.custom_curve,
-         zoom_widget = self.callback.zoom_widget,
-         callback    = self.onCustomUpdate)
+      if self.value['Type'] == 'Harmonics':
+         self.spectrum_top = SpectrumTop(self.frame,
+            width              = PLOT_WIDTH_PX,
+            height             = PLOT_HEIGHT_PX,
+            input_curves       = (self.spectrum_curve, self.end_spectrum_curve),
+            partial_count      = self.partial_count.get(),
+            amplitude_range_db = self.callback.sound_widget.amplitude_axis.amplitude_range_db,
+            zoom_widget        = self.callback.zoom_widget,
+            scheduler          = self.callback.frame_scheduler,
+            callback           = self.onSpectrumUpdate)
+      else:
+         self.custom_top = CustomWaveformTop(self.frame,
+            width       = PLOT_WIDTH_PX,
+            height      = PLOT_HEIGHT_PX,
+            input_curve = self.custom_curve,
+            zoom_widget = self.callback.zoom_widget,
+            scheduler   = self.callback.frame_scheduler,
+            callback    = self.onCustomUpdate)
 
    def onCustomUpdate(self):
       self.custom_curve = self.custom_top.serialize()
@@ -346,11 +522,21 @@ class WaveformWidget:
          self.value = v
          self.callback.onSoundChange()
 
+   def onSpectrumUpdate(self):
+      self.spectrum_curve, self.end_spectrum_curve = self.spectrum_top.serialize()
+      v = self.determineValue()
+      if self.value != v:
+         self.value = v
+         self.callback.onSoundChange()
+
    def onUpdate(self, value):
       v = self.determineValue()
       if self.value != v:
          self.value = v
          self.configureElements()
+         # Open spectrum shows the current number of partials.
+         if (self.spectrum_top is not None) and self.spectrum_top.wnd.winfo_exists():
+            self.spectrum_top.setPartialCount(self.partial_count.get())
          self.callback.onWaveformChange()
 
 #===============================================================================
@@ -398,6 +584,28 @@ class FileWidget:
    def grid(self, **kwargs):
       self.frame.grid(**kwargs)
 
+#===============================================================================
+class EditWidget:
+
+   def __init__(self, tk_parent, callback):
+      self.callback = callback
+      # Frame.
+      self.frame = ttk.LabelFrame(tk_parent, text = 'Edit', labelanchor = 'n')
+      # Undo/redo buttons.
+      self.undo_btn = ttk.Button(self.frame, text = 'Undo', command = callback.onUndo)
+      self.redo_btn = ttk.Button(self.frame, text = 'Redo', command = callback.onRedo)
+      self.setState(False, False)
+      # Configure inner grid.
+      self.undo_btn.grid(row = 0, column = 0, sticky = 'NE', **pad('NSEW'))
+      self.redo_btn.grid(row = 0, column = 1, sticky = 'NE', **pad('NSE'))
+
+   def grid(self, **kwargs):
+      self.frame.grid(**kwargs)
+
+   def setState(self, can_undo, can_redo):
+      self.undo_btn.state(['!disabled' if can_undo else 'disabled'])
+      self.redo_btn.state(['!disabled' if can_redo else 'disabled'])
+
 #===============================================================================
 class SoundWidget:
 
@@ -427,13 +635,22 @@ class SoundWidget:
       self.amplitude_axis = axis.Amplitude(AMPLITUDE_RANGE_DB)
       # Play/stop button.
       self.playstop_btn = ttk.Button(self.frame, text = 'Play', command = self.onPlayStop)
+      # Live checkbox, sound is updated also while a curve is dragged.
+      self.live = tk.BooleanVar(value = False)
+      self.live_check = ttk.Checkbutton(self.frame, text = 'Live', variable = self.live)
       # Export button.
       self.export_btn = ttk.Button(self.frame, text = 'Export', command = callback.onExport)
+      self.export_rates_btn = ttk.Button(self.frame, text = 'Export rates', command = callback.onExportRates)
+      # Statistics of the memory cache of the render server.
+      self.cache_label = ttk.Label(self.frame, text = '')
       # Configure inner grid.
       self.sampling_rate.grid(row = 0, column = 0, sticky = 'NE', **pad('NSEW'))
       self.total_time.grid   (row = 1, column = 0, sticky = 'NE', **pad('SEW'))
       self.playstop_btn.grid (row = 2, column = 0, sticky = 'NE', **pad('SEW'))
-      self.export_btn.grid   (row = 3, column = 0, sticky = 'NE', **pad('SEW'))
+      self.live_check.grid   (row = 3, column = 0, sticky = 'NE', **pad('SEW'))
+      self.export_btn.grid   (row = 4, column = 0, sticky = 'NE', **pad('SEW'))
+      self.export_rates_btn.grid(row = 5, column = 0, sticky = 'NE', **pad('SEW'))
+      self.cache_label.grid  (row = 6, column = 0, sticky = 'NE', **pad('SEW'))
 
    def grid(self, **kwargs):
       self.frame.grid(**kwargs)
@@ -456,6 +673,14 @@ class SoundWidget:
    def isPlaying(self):
       return self.playing
 
+   def setCacheStats(self, stats):
+      lookups = stats['Hits'] + stats['Misses']
+      self.cache_label.configure(text = 'Cache {:.0f}/{:.0f} MB, {:.0f}% hits'.format(
+         stats['Size [B]'] / 2**20, stats['Max size [B]'] / 2**20, (100.0 * stats['Hits'] / lookups) if (lookups > 0) else 0.0))
+
+   def isLive(self):
+      return self.live.get()
+
    def onSamplingRateChange(self, value):
       self.callback.onSoundChange()
 
@@ -480,8 +705,19 @@ class WaveformEditor:
    def __init__(self):
       self.wnd = tk.Tk()
       self.wnd.title(PROGRAM_NAME)
-      # Wave generator thread.
-      self.wavegen_thread = wavegen.Thread()
+      # Sounds are rendered and played by the render server, which runs in its own process
+      # and can be shared with other tools. Rendered sounds are passed to the GUI through a queue.
+      self.render_results = queue.Queue()
+      self.disk_cache = cache.DiskCache(os.path.join(cache.getDefaultPath(PROGRAM_NAME), 'renders'), DISK_CACHE_MAX_BYTES)
+      self.pyramid = pyramid.MinMaxPyramid()
+      self.render_client = server.connect(
+         PROGRAM_NAME, self.onRenderEvent,
+         (DISK_CACHE_MAX_BYTES, MEMORY_CACHE_MAX_BYTES, RENDER_PROCESS_COUNT))
+      # Spectrum analysis thread. Spectra are passed to the GUI through the same queue.
+      self.spectrogram_thread = spectrogram.AnalysisThread(
+         window_size = SPECTROGRAM_WINDOW_SIZE,
+         hop_size    = SPECTROGRAM_HOP_SIZE,
+         callback    = lambda *args: self.render_results.put(('SPECTRUM',) + args))
       # Column frames.
       self.column_frames = [tk.Frame(self.wnd) for i in range(4)]
       # Wave list widget.
@@ -494,6 +730,10 @@ class WaveformEditor:
       self.file_widget = FileWidget(self.column_frames[3], self)
       # Sound widget.
       self.sound_widget = SoundWidget(self.column_frames[3], self)
+      # Edit widget.
+      self.edit_widget = EditWidget(self.column_frames[3], self)
+      # Both plots are redrawn from the same frame.
+      self.frame_scheduler = plot.FrameScheduler(self.wnd, MAX_FRAME_RATE_FPS)
       # Frequency plot.
       self.frequency_plot = plot.Panel(self.column_frames[1],
          width       = PLOT_WIDTH_PX,
@@ -501,7 +741,8 @@ class WaveformEditor:
          x_axis      = self.sound_widget.time_axis,
          y_axis      = self.sound_widget.frequency_axis,
          zoom_widget = self.zoom_widget,
-         callback    = self.onSoundChange)
+         callback    = self.onSoundChange,
+         scheduler   = self.frame_scheduler)
       # Amplitude plot.
       self.amplitude_plot = plot.Panel(self.column_frames[1],
          width       = PLOT_WIDTH_PX,
@@ -509,20 +750,50 @@ class WaveformEditor:
          x_axis      = self.sound_widget.time_axis,
          y_axis      = self.sound_widget.amplitude_axis,
          zoom_widget = self.zoom_widget,
-         callback    = self.onSoundChange)
-      # Keep zoom level of the X axis on both plots in sync.
+         callback    = self.onSoundChange,
+         scheduler   = self.frame_scheduler)
+      # Spectrogram of the rendered sound.
+      self.spectrogram_panel = spectrogram.Panel(self.column_frames[1],
+         width     = PLOT_WIDTH_PX,
+         height    = SPECTROGRAM_HEIGHT_PX,
+         y_axis    = self.sound_widget.frequency_axis,
+         scheduler = self.frame_scheduler)
+      # Keep zoom level of the X axis on both plots and the spectrogram in sync.
       self.frequency_plot.registerViewChangeCallback(
-         lambda x_range, y_range: self.amplitude_plot.setView(x_range, None))
+         lambda x_range, y_range: self.onViewChange(self.frequency_plot, x_range))
       self.amplitude_plot.registerViewChangeCallback(
-         lambda x_range, y_range: self.frequency_plot.setView(x_range, None))
+         lambda x_range, y_range: self.onViewChange(self.amplitude_plot, x_range))
+      # Live previews while a curve is dragged.
+      self.preview_after_id = None
+      self.speculation_after_id = None
+      # Request rendering the sound in advance, which is not cancelled yet.
+      self.speculation_id = None
+      self.frequency_plot.registerCurveDragCallback(self.onCurveDrag)
+      self.amplitude_plot.registerCurveDragCallback(self.onCurveDrag)
       # Configure grid.
       self.configureGrid()
       # Stored waves.
       self.default_wave = self.serializeCurrentWave()
       self.wave_list = [self.default_wave]
       self.wave_index = 0
+      # Offer to recover the sound from the autosave journal left by a crashed instance.
+      # Journal is discarded when it is restored or refused, others are offered on the next start.
+      autosave_dir = cache.getDefaultPath(PROGRAM_NAME)
+      stale_path, stale_lock = journal.findStale(autosave_dir)
+      if stale_path is not None:
+         recovered = journal.recover(stale_path)
+         message = 'Sound from a session which was not closed properly was found. Do you want to restore it?'
+         if (recovered is not None) and tkmessagebox.askyesno(PROGRAM_NAME, message):
+            self.deserialize(recovered)
+         journal.discardStale(stale_path, stale_lock)
+      # Undo/redo history of the whole sound.
+      self.history = history.History(self.serialize(), HISTORY_MAX_BYTES)
+      # Every change is appended to the autosave journal of this instance.
+      autosave_path = os.path.join(autosave_dir, 'autosave-{}{}'.format(os.getpid(), journal.JOURNAL_EXTENSION))
+      self.journal = journal.Journal(autosave_path, self.history.current)
+      self.wnd.bind('<Control-z>', lambda event: self.onUndo())
+      self.wnd.bind('<Control-y>', lambda event: self.onRedo())
       # TODO: Add some kind of marker to indicate whether played sound is up-to-date.
-      # TODO: Undo/redo.
 
    def configureGrid(self):
       # Only column #2 (containing plots) gets wider on resize.
@@ -542,6 +813,7 @@ class WaveformEditor:
       self.column_frames[1].columnconfigure(0, weight = 1)
       self.column_frames[1].rowconfigure   (0, weight = 1)
       self.column_frames[1].rowconfigure   (1, weight = 1)
+      self.column_frames[1].rowconfigure   (2, weight = 0)
       # Column #3.
       self.column_frames[2].columnconfigure(0, weight = 1)
       # Column #4.
@@ -551,12 +823,14 @@ class WaveformEditor:
       # Column #2 widgets.
       self.frequency_plot.grid (column = 0, row = 0, sticky = 'NSEW')
       self.amplitude_plot.grid (column = 0, row = 1, sticky = 'NSEW')
+      self.spectrogram_panel.grid(column = 0, row = 2, sticky = 'NSEW')
       # Column #3 widgets.
       self.waveform_widget.grid(column = 0, row = 0, sticky = 'NEW', **pad('SEW'))
       # Column #4 widgets.
       self.zoom_widget.grid    (column = 0, row = 0, sticky = 'NSEW', **pad('SE'))
       self.file_widget.grid    (column = 1, row = 0, sticky = 'NSEW', **pad('SE'))
       self.sound_widget.grid   (column = 0, row = 1, columnspan = 2, sticky = 'NEW', **pad('SE'))
+      self.edit_widget.grid    (column = 0, row = 2, columnspan = 2, sticky = 'NEW', **pad('SE'))
 
    def serializeCurrentWave(self):
       return {
@@ -576,15 +850,17 @@ class WaveformEditor:
          'Waves': self.wave_list[:],
          'Sound': self.sound_widget.serialize()}
 
-   def deserialize(self, input):
+   def deserialize(self, input, wave_index = 0):
       self.sound_widget.deserialize(input['Sound'])
-      self.wavelist_widget.setCount(len(input['Waves']))
-      self.wave_list = input['Waves']
-      self.wave_index = 0
+      self.wavelist_widget.setCount(len(input['Waves']), wave_index)
+      self.wave_list = list(input['Waves'])
+      self.wave_index = wave_index
       self.deserializeCurrentWave(self.wave_list[self.wave_index])
 
    def configurePlots(self):
-      if self.waveform_widget.serialize()['Type'] == 'Noise':
+      # Frequency of noise matters only for band-limited noise.
+      waveform = self.waveform_widget.serialize()
+      if (waveform['Type'] == 'Noise') and (waveform.get('Color') != 'Band'):
          self.frequency_plot.configure(state = 'disabled')
       else:
          self.frequency_plot.configure(state = 'normal')
@@ -609,47 +885,190 @@ class WaveformEditor:
       self.configurePlots()
       self.onSoundChange()
 
-   def onSoundChange(self):
+   def onSoundChange(self, preview = False):
+      # Pending preview would replace the sound with an older state.
+      if (self.preview_after_id is not None) and not preview:
+         self.wnd.after_cancel(self.preview_after_id)
+      self.preview_after_id = None
+      # Every finished change is a step of the history.
+      if not preview:
+         self.history.record(self.serialize())
+         self.edit_widget.setState(self.history.canUndo(), self.history.canRedo())
+         self.journal.record(self.history.current)
+         self.scheduleSpeculation()
       if self.sound_widget.isPlaying():
-         self.wavegen_thread.play(self.serialize())
+         if preview:
+            self.render_client.preview(self.serialize(), LIVE_LATENCY_BUDGET_MS / 1000.0)
+         else:
+            self.render_client.play(self.serialize())
+
+   def onCurveDrag(self):
+      self.scheduleSpeculation()
+      # Full quality sound is rendered when the drag ends, only previews are sent until then.
+      if self.sound_widget.isPlaying() and self.sound_widget.isLive() and (self.preview_after_id is None):
+         self.preview_after_id = self.wnd.after(LIVE_PREVIEW_INTERVAL_MS, lambda: self.onSoundChange(preview = True))
+
+   def scheduleSpeculation(self):
+      # Sound rendered in advance would be outdated by the change, so it is cancelled
+      # and started again once there are no more changes for a while.
+      # Cancel is sent only once for a started speculation, not on every motion of a dragged curve.
+      if self.speculation_after_id is not None:
+         self.wnd.after_cancel(self.speculation_after_id)
+      if self.speculation_id is not None:
+         self.render_client.speculate(None)
+         self.speculation_id = None
+      self.speculation_after_id = self.wnd.after(IDLE_RENDER_DELAY_MS, self.onIdle)
+
+   def onIdle(self):
+      self.speculation_after_id = None
+      # Playing sound is rendered anyway.
+      if not self.sound_widget.isPlaying():
+         self.speculation_id = self.render_client.speculate(self.serialize())
 
    def onPlay(self):
-      self.wavegen_thread.play(self.serialize())
+      self.render_client.play(self.serialize())
 
    def onStop(self):
-      self.wavegen_thread.stop()
+      self.render_client.stop()
+
+   def onUndo(self):
+      if self.history.canUndo():
+         self.restore(self.history.undo())
+
+   def onRedo(self):
+      if self.history.canRedo():
+         self.restore(self.history.redo())
+
+   def restore(self, input):
+      # Stay on the current wave if it still exists.
+      self.deserialize(input, min(self.wave_index, len(input['Waves'])-1))
+      # Sound of the restored state is likely still cached by the wave generator.
+      self.onSoundChange()
 
    def onExport(self):
-      self.wavegen_thread.prepare(self.serialize())
+      prepare_id = self.render_client.prepare(self.serialize())
       path = tkfiledialog.asksaveasfilename(
          title = 'Export',
          defaultextension = '.wav',
          filetypes = (('Waveform audio format (*.wav)', '.wav'),))
       if path:
-         self.wavegen_thread.write(path)
+         self.render_client.write(prepare_id, path)
       else:
-         self.wavegen_thread.drop()
+         self.render_client.drop(prepare_id)
+
+   def onExportRates(self):
+      # Sound is written to one file per sampling rate, named by appending the rate to the chosen name.
+      text = tksimpledialog.askstring(
+         title        = 'Export rates',
+         prompt       = 'Sampling rates [Hz]',
+         initialvalue = ', '.join(str(rate_hz) for rate_hz in EXPORT_RATES_HZ),
+         parent       = self.wnd)
+      if text:
+         try:
+            rates_hz = sorted({int(value) for value in re.split(r'[\s,;]+', text.strip())})
+         except ValueError:
+            rates_hz = []
+         if (len(rates_hz) == 0) or any((rate_hz not in SAMPLING_RATES_HZ) for rate_hz in rates_hz):
+            tkmessagebox.showerror(PROGRAM_NAME, 'Sampling rates must be some of {}.'.format(', '.join(map(str, SAMPLING_RATES_HZ))))
+         else:
+            path = tkfiledialog.asksaveasfilename(
+               title = 'Export rates',
+               defaultextension = '.wav',
+               filetypes = (('Waveform audio format (*.wav)', '.wav'),))
+            if path:
+               root, ext = os.path.splitext(path)
+               outputs = [('{}-{}{}'.format(root, rate_hz, ext), rate_hz) for rate_hz in rates_hz]
+               self.render_client.export(self.serialize(), outputs)
 
    def onOpen(self):
       path = tkfiledialog.askopenfilename(
          title = 'Open',
-         defaultextension = '.json',
-         filetypes = (('{} format (*.json)'.format(PROGRAM_NAME), '.json'),))
+         defaultextension = '.wfe',
+         filetypes = (
+            ('{} project (*.wfe)'.format(PROGRAM_NAME), '.wfe'),
+            ('{} format (*.json)'.format(PROGRAM_NAME), '.json')))
       if path:
-         with open(path, 'r') as f:
-            self.deserialize(json.load(f))
+         with open(path, 'rb') as f:
+            if project.isProjectFile(f):
+               input, renders = project.read(f)
+               # Embedded sound is used only if it was rendered by the same version of the wave generator.
+               key = wavegen.getRenderKey(input)
+               for render_key,offset,length in renders:
+                  if render_key == key:
+                     self.disk_cache.put(key, project.readRender(f, offset, length))
+            else:
+               input = json.load(f)
+         self.deserialize(input)
          self.onSoundChange()
 
    def onSave(self):
       path = tkfiledialog.asksaveasfilename(
          title = 'Save',
-         defaultextension = '.json',
-         filetypes = (('{} format (*.json)'.format(PROGRAM_NAME), '.json'),))
+         defaultextension = '.wfe',
+         filetypes = (
+            ('{} project (*.wfe)'.format(PROGRAM_NAME), '.wfe'),
+            ('{} format (*.json)'.format(PROGRAM_NAME), '.json')))
       if path:
-         # TODO: Strip redundant elements on save (frequency and phase for noise, curve for non-custom).
-         with open(path, 'w') as f:
-            json.dump(self.serialize(), f)
+         input = self.serialize()
+         # JSON format is kept for interchange.
+         if path.lower().endswith('.json'):
+            # TODO: Strip redundant elements on save (frequency and phase for noise, curve for non-custom).
+            with open(path, 'w') as f:
+               json.dump(input, f)
+         else:
+            # Sound is embedded if it has been rendered already, so that it can be played right after opening.
+            key = wavegen.getRenderKey(input)
+            data = self.disk_cache.get(key)
+            with open(path, 'wb') as f:
+               project.write(f, input, [(key, data)] if (data is not None) else [])
+
+   def onViewChange(self, source_plot, x_range):
+      for view in (self.frequency_plot, self.amplitude_plot, self.spectrogram_panel):
+         if view is not source_plot:
+            view.setView(x_range, None)
+
+   def onRenderEvent(self, event, request_id, *args):
+      # Called from the receiving thread of the render client.
+      if event == 'RENDER':
+         # Pyramid is updated only in the parts in which the samples have changed.
+         samples, sampling_rate_hz = args
+         self.pyramid = self.pyramid.updated(samples)
+         self.render_results.put(('RENDER', self.pyramid, sampling_rate_hz))
+      elif event in ('STATS', 'ERROR'):
+         self.render_results.put((event,) + args)
+
+   def pollRenderResults(self):
+      # Only the most recent result of each type is shown.
+      results = {}
+      while not self.render_results.empty():
+         result = self.render_results.get_nowait()
+         results[result[0]] = result[1:]
+      if 'RENDER' in results:
+         overlay, sampling_rate_hz = results['RENDER']
+         # Waveform is drawn over the amplitude curve only, sample values have no meaning on the frequency axis.
+         # Both plots have the same X axis, so they share the limit of zoom.
+         self.amplitude_plot.setOverlay(overlay)
+         self.frequency_plot.setXsamples(len(overlay))
+         self.spectrogram_thread.analyze(overlay.samples, sampling_rate_hz)
+      if 'SPECTRUM' in results:
+         self.spectrogram_panel.setSpectrum(*results['SPECTRUM'])
+      if 'STATS' in results:
+         self.sound_widget.setCacheStats(results['STATS'][0])
+      if 'ERROR' in results:
+         tkmessagebox.showerror(PROGRAM_NAME, results['ERROR'][0])
+      self.wnd.after(RENDER_POLL_MS, self.pollRenderResults)
+
+   def pollCacheStats(self):
+      # Statistics are shown when they arrive.
+      self.render_client.stats()
+      self.wnd.after(CACHE_STATS_POLL_MS, self.pollCacheStats)
 
    def run(self):
+      self.pollRenderResults()
+      self.pollCacheStats()
+      self.scheduleSpeculation()
       self.wnd.mainloop()
-      self.wavegen_thread.quit()
+      self.journal.close()
+      self.spectrogram_thread.quit()
+      # Server stops the sound of a disconnected client, and exits when its last client disconnects.
+      self.render_client.close()
@@ -0,0 +1,212 @@
+
+import bisect, math
+from array import array
+
+# Kinds of points. Each control point has a left and a right curve point
+# (except the left one of the first and the right one of the last control point).
+CONTROL = 0
+LEFT    = 1
+RIGHT   = 2
+
+INDEX_MIN_CELLS = 16
+
+#===============================================================================
+class SpatialIndex:
+
+   def __init__(self, y_min, y_max):
+      self.y_min = y_min
+      self.y_max = y_max
+      self.cells = {}
+      self.cell_of = {}
+      self.x_cells = INDEX_MIN_CELLS
+      self.y_cells = INDEX_MIN_CELLS
+
+   def getCell(self, x, y):
+      cx = min(max(int(x * self.x_cells), 0), self.x_cells-1)
+      cy = min(max(int((y - self.y_min) / (self.y_max - self.y_min) * self.y_cells), 0), self.y_cells-1)
+      return (cx,cy)
+
+   def rebuild(self, points):
+      # Number of cells grows with the number of points to keep the cells small.
+      cell_count = max(INDEX_MIN_CELLS, math.isqrt(len(points)))
+      self.x_cells = cell_count
+      self.y_cells = cell_count
+      self.cells = {}
+      self.cell_of = {}
+      for key,x,y in points:
+         self.add(key, x, y)
+
+   def add(self, key, x, y):
+      cell = self.getCell(x, y)
+      self.cells.setdefault(cell, []).append(key)
+      self.cell_of[key] = cell
+
+   def move(self, key, x, y):
+      cell = self.getCell(x, y)
+      old_cell = self.cell_of[key]
+      if cell != old_cell:
+         self.cells[old_cell].remove(key)
+         self.cells.setdefault(cell, []).append(key)
+         self.cell_of[key] = cell
+
+   def query(self, x0, y0, x1, y1):
+      cx0,cy0 = self.getCell(x0, y0)
+      cx1,cy1 = self.getCell(x1, y1)
+      for cx in range(cx0, cx1+1):
+         for cy in range(cy0, cy1+1):
+            yield from self.cells.get((cx,cy), ())
+
+#===============================================================================
+class CurveModel:
+
+   def __init__(self, y_margin):
+      # Control points can be placed in range [0,1] on both axes,
+      # curve points can additionally reach into the margin on the Y axis.
+      self.y_margin = y_margin
+      # Coordinates of control, left and right curve points, sorted by X of control points.
+      # Coordinates of missing curve points are NaN.
+      self.xs = (array('d'), array('d'), array('d'))
+      self.ys = (array('d'), array('d'), array('d'))
+      # Spatial index is rebuilt lazily after points are inserted or deleted,
+      # because these operations change indices of the following points.
+      self.index = SpatialIndex(-y_margin, 1.0+y_margin)
+      self.index_valid = False
+      # Upper bound of the distance on the X axis between control points and their curve points.
+      self.max_handle_dist = 0.0
+
+   def __len__(self):
+      return len(self.xs[CONTROL])
+
+   def exists(self, kind, ix):
+      return (0 <= ix < len(self)) and not math.isnan(self.xs[kind][ix])
+
+   def getPoint(self, kind, ix):
+      return (self.xs[kind][ix], self.ys[kind][ix])
+
+   def getSegment(self, ix):
+      # Bezier curve between control point "ix" and the next one.
+      return (
+         (self.xs[CONTROL][ix],   self.ys[CONTROL][ix]),
+         (self.xs[RIGHT][ix],     self.ys[RIGHT][ix]),
+         (self.xs[LEFT][ix+1],    self.ys[LEFT][ix+1]),
+         (self.xs[CONTROL][ix+1], self.ys[CONTROL][ix+1]))
+
+   def findRange(self, x0, x1):
+      # Range of indices of control points which themselves or whose curve points can be within [x0,x1].
+      ix0 = bisect.bisect_left(self.xs[CONTROL], x0 - self.max_handle_dist)
+      ix1 = bisect.bisect_right(self.xs[CONTROL], x1 + self.max_handle_dist)
+      return (ix0, ix1)
+
+   def limitCoords(self, kind, x, y):
+      x = min(max(x, 0.0), 1.0)
+      if kind == CONTROL:
+         y = min(max(y, 0.0), 1.0)
+      else:
+         y = min(max(y, -self.y_margin), 1.0+self.y_margin)
+      return (x,y)
+
+   def setPoint(self, kind, ix, x, y):
+      self.xs[kind][ix] = x
+      self.ys[kind][ix] = y
+      if kind != CONTROL:
+         self.max_handle_dist = max(self.max_handle_dist, abs(x - self.xs[CONTROL][ix]))
+      if self.index_valid:
+         self.index.move((kind,ix), x, y)
+
+   #----------------------------------------------------------------------------
+
+   def insert(self, x, y, handle_dist):
+      x,y = self.limitCoords(CONTROL, x, y)
+      # New point is always placed between the first and the last one.
+      ix = min(max(bisect.bisect_right(self.xs[CONTROL], x), 1), len(self)-1)
+      coords = (
+         (x, y),
+         self.limitCoords(LEFT, x-handle_dist, y),
+         self.limitCoords(RIGHT, x+handle_dist, y))
+      for kind,(px,py) in enumerate(coords):
+         self.xs[kind].insert(ix, px)
+         self.ys[kind].insert(ix, py)
+      self.max_handle_dist = max(self.max_handle_dist, handle_dist)
+      self.index_valid = False
+      return ix
+
+   def delete(self, ix):
+      for kind in (CONTROL, LEFT, RIGHT):
+         del self.xs[kind][ix]
+         del self.ys[kind][ix]
+      self.index_valid = False
+
+   def isDeletable(self, kind, ix):
+      # First and last control points cannot be deleted.
+      return (kind == CONTROL) and (0 < ix < len(self)-1)
+
+   def moveControlPoint(self, ix, x, y):
+      x,y = self.limitCoords(CONTROL, x, y)
+      # First and last control points can only be moved along the Y axis.
+      if (ix == 0) or (ix == len(self)-1):
+         x = self.xs[CONTROL][ix]
+      # Other control points are limited in the X axis to their neighbors.
+      else:
+         x = min(max(x, self.xs[CONTROL][ix-1]), self.xs[CONTROL][ix+1])
+      dx = x - self.xs[CONTROL][ix]
+      dy = y - self.ys[CONTROL][ix]
+      self.setPoint(CONTROL, ix, x, y)
+      # Curve points follow their control point.
+      for kind in (LEFT, RIGHT):
+         if self.exists(kind, ix):
+            self.moveCurvePoint(kind, ix, self.xs[kind][ix] + dx, self.ys[kind][ix] + dy)
+
+   def moveCurvePoint(self, kind, ix, x, y):
+      x,y = self.limitCoords(kind, x, y)
+      # Curve points cannot cross the X value of their control point.
+      if kind == LEFT:
+         x = min(x, self.xs[CONTROL][ix])
+      else:
+         x = max(x, self.xs[CONTROL][ix])
+      self.setPoint(kind, ix, x, y)
+
+   def movePoint(self, kind, ix, x, y):
+      if kind == CONTROL:
+         self.moveControlPoint(ix, x, y)
+      else:
+         self.moveCurvePoint(kind, ix, x, y)
+
+   #----------------------------------------------------------------------------
+
+   def pick(self, x, y, x_radius, y_radius):
+      if not self.index_valid:
+         self.index.rebuild([
+            ((kind,ix), self.xs[kind][ix], self.ys[kind][ix])
+            for kind in (CONTROL, LEFT, RIGHT)
+            for ix in range(len(self))
+            if not math.isnan(self.xs[kind][ix])])
+         self.index_valid = True
+      # Find the nearest point within the ellipse given by the radii.
+      nearest = None
+      nearest_dist = 1.0
+      for kind,ix in self.index.query(x-x_radius, y-y_radius, x+x_radius, y+y_radius):
+         dist = ((self.xs[kind][ix] - x) / x_radius)**2 + ((self.ys[kind][ix] - y) / y_radius)**2
+         if dist <= nearest_dist:
+            nearest = (kind,ix)
+            nearest_dist = dist
+      return nearest
+
+   #----------------------------------------------------------------------------
+
+   def serialize(self):
+      out = []
+      for ix in range(len(self)):
+         out.append(tuple(
+            (self.getPoint(kind, ix) if self.exists(kind, ix) else None)
+            for kind in (LEFT, CONTROL, RIGHT)))
+      return tuple(out)
+
+   def deserialize(self, input):
+      nan = float('nan')
+      for kind,pos in ((LEFT,0), (CONTROL,1), (RIGHT,2)):
+         self.xs[kind][:] = array('d', ((item[pos][0] if (item[pos] is not None) else nan) for item in input))
+         self.ys[kind][:] = array('d', ((item[pos][1] if (item[pos] is not None) else nan) for item in input))
+      self.max_handle_dist = max(
+         (abs(x - cx) for kind in (LEFT, RIGHT) for x,cx in zip(self.xs[kind], self.xs[CONTROL]) if not math.isnan(x)),
+         default = 0.0)
+      self.index_valid = False
@@ -0,0 +1,117 @@
+
+from src import fft
+
+import math, operator, random
+
+NOISE_COLORS = ('White', 'Pink', 'Brown', 'Band')
+
+# White noise is generated in blocks, each from its own generator seeded by the block index.
+WHITE_BLOCK_SIZE = 4096
+# Colored noise is synthesized in overlapping frames, each from a random spectrum shaped by the color.
+FRAME_SIZE = 4096
+HOP_SIZE   = FRAME_SIZE // 2
+# RMS level of colored noise, which leaves room for its peaks.
+COLORED_RMS = 0.25
+# Width of the band of band-limited noise, in octaves around the frequency of the wave.
+BAND_WIDTH_OCTAVES = 1.0
+
+#===============================================================================
+class Noise:
+
+   def __init__(self, color, seed, sound_info, frequency_curve = None):
+      # Any range of samples can be generated on its own, with the same result for the same seed.
+      # Band-limited noise follows the frequency curve.
+      self.color = color
+      self.seed = seed
+      self.sound_info = sound_info
+      self.frequency_curve = frequency_curve
+      if color != 'White':
+         self.fft = fft.FFT(FRAME_SIZE)
+         # Sine window, windows of overlapping frames add up to constant power.
+         self.window = [math.sin(math.pi * (ix + 0.5) / FRAME_SIZE) for ix in range(FRAME_SIZE)]
+         # Frequency of each bin, up to the Nyquist frequency.
+         self.bin_frequencies = [ix * sound_info.sampling_rate_hz / FRAME_SIZE for ix in range(FRAME_SIZE//2)]
+         if color == 'Pink':
+            self.shape = self.normalizeShape([0.0] + [1.0 / math.sqrt(f) for f in self.bin_frequencies[1:]])
+         elif color == 'Brown':
+            self.shape = self.normalizeShape([0.0] + [1.0 / f for f in self.bin_frequencies[1:]])
+         # The last pair of frames, which is used by consecutive ranges.
+         self.pair_ix = None
+         self.pair = None
+
+   def getSamples(self, start, stop):
+      # Returns list of samples in range [start, stop).
+      if start >= stop:
+         return []
+      if self.color == 'White':
+         return self.getWhiteSamples(start, stop)
+      samples = [0.0] * (stop - start)
+      # Each sample is covered by two frames.
+      for frame_ix in range(start // HOP_SIZE - 1, (stop - 1) // HOP_SIZE + 1):
+         frame = self.getFrame(frame_ix)
+         frame_start = frame_ix * HOP_SIZE
+         first = max(start, frame_start)
+         last = min(stop, frame_start + FRAME_SIZE)
+         if first < last:
+            samples[first-start:last-start] = map(operator.add,
+               samples[first-start:last-start], frame[first-frame_start:last-frame_start])
+      return samples
+
+   def getWhiteSamples(self, start, stop):
+      # Uniformly distributed samples in range [-1,1].
+      samples = []
+      for block_ix in range(start // WHITE_BLOCK_SIZE, (stop - 1) // WHITE_BLOCK_SIZE + 1):
+         rand = random.Random('White:{}:{}'.format(self.seed, block_ix)).random
+         block_start = block_ix * WHITE_BLOCK_SIZE
+         first = max(start - block_start, 0)
+         last = min(stop - block_start, WHITE_BLOCK_SIZE)
+         block = [2.0 * rand() - 1.0 for ix in range(last)]
+         samples += block[first:]
+      return samples
+
+   def normalizeShape(self, shape):
+      # Random spectrum has components with variance 1/12, and each of them contributes twice (with its conjugate).
+      scale = math.sqrt(3.0 * COLORED_RMS**2 / sum(v * v for v in shape))
+      return [v * scale for v in shape]
+
+   def getBandShape(self, frame_ix):
+      # Band around the frequency of the wave in the middle of the frame.
+      last_ix = self.sound_info.num_samples - 1.0
+      x = min(max((frame_ix * HOP_SIZE + FRAME_SIZE // 2) / last_ix, 0.0), 1.0)
+      frequency_hz = self.sound_info.frequency_axis.convertTo(self.frequency_curve.getY(x))
+      ratio = 2.0**(BAND_WIDTH_OCTAVES / 2.0)
+      low_hz, high_hz = frequency_hz / ratio, frequency_hz * ratio
+      shape = [(1.0 if (low_hz <= f <= high_hz) else 0.0) for f in self.bin_frequencies]
+      shape[0] = 0.0
+      # Band narrower than a bin is represented by the nearest bin.
+      if sum(shape) == 0.0:
+         shape[min(max(round(frequency_hz / self.bin_frequencies[1]), 1), FRAME_SIZE//2 - 1)] = 1.0
+      return self.normalizeShape(shape)
+
+   def getFrame(self, frame_ix):
+      # Frames are calculated in pairs, as real and imaginary part of one transform.
+      pair_ix = frame_ix // 2
+      if self.pair_ix != pair_ix:
+         self.pair = self.calculatePair(pair_ix)
+         self.pair_ix = pair_ix
+      return self.pair[frame_ix % 2]
+
+   def calculatePair(self, pair_ix):
+      rand = random.Random('{}:{}:{}'.format(self.color, self.seed, pair_ix)).random
+      if self.color == 'Band':
+         shape1 = self.getBandShape(2 * pair_ix)
+         shape2 = self.getBandShape(2 * pair_ix + 1)
+      else:
+         shape1 = shape2 = self.shape
+      # Spectra of both frames have random components with the given magnitudes. Each of them is
+      # conjugate symmetric, so that their transforms are real, and they are combined into one spectrum.
+      spectrum = [0j] * FRAME_SIZE
+      for ix in range(1, FRAME_SIZE//2):
+         value1 = complex(rand() - 0.5, rand() - 0.5) * shape1[ix]
+         value2 = complex(rand() - 0.5, rand() - 0.5) * shape2[ix]
+         spectrum[ix] = value1 + 1j * value2
+         spectrum[FRAME_SIZE-ix] = value1.conjugate() + 1j * value2.conjugate()
+      values = self.fft.transform(spectrum)
+      return (
+         [v.real * w for v,w in zip(values, self.window)],
+         [v.imag * w for v,w in zip(values, self.window)])
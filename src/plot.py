@@ -1,4 +1,6 @@
+from src import model
 
+import math, time
 import tkinter as tk
 import tkinter.ttk as ttk
 
@@ -10,6 +12,7 @@ COLOR_GRID          = '#c0c0c0'
 COLOR_HIGHLIGHT     = '#ff0000'
 COLOR_CONTROL_POINT = '#00ff00'
 COLOR_CURVE_POINT   = '#ffff00'
+COLOR_OVERLAY       = '#a0c0ff'
 
 # "_PX" values specify number of pixels.
 # "_REL" values specify fraction of the working area (excluding margins).
@@ -19,273 +22,255 @@ X_MARGIN_PX         = 40
 Y_MARGIN_REL        = 0.25
 GRID_MIN_STEP_PX    = 15
 GRID_TEXT_OFFSET_PX = 5
+GRID_CHAR_WIDTH_PX  = 7
+GRID_CACHE_SIZE     = 32
+
+# Sets of grid ticks within a decade on logarithmic axes, from the densest one.
+# Each set ends with the first tick of the next decade.
+GRID_LOG_MANTISSAS  = (
+   (1, 2, 3, 4, 5, 6, 7, 8, 9, 10),
+   (1, 2, 5, 10),
+   (1, 10))
 
 SPAWN_MIN_DIST_REL  = 0.02
 ZOOM_MULTIPLIER     = 1.2
 ZOOM_MAX            = 100.0
 
+# Curves with more visible segments than one per this number of pixels are drawn as a polyline.
+LOD_MIN_SEGMENT_PX  = 3
+
+# Layers of canvas objects, from the bottom.
+PLOT_LAYERS         = ('grid', 'overlay', 'curve', 'point')
+
+# Zoom on the X axis is allowed up to this number of pixels per sample of the overlay.
+OVERLAY_MAX_SAMPLE_PX = 20
+# Largest sample value of the overlay (16-bit samples).
+OVERLAY_MAX_VALUE     = 32768.0
+
+#===============================================================================
+class FrameScheduler:
+
+   def __init__(self, tk_widget, max_fps):
+      self.tk_widget = tk_widget
+      self.frame_interval = 1.0 / max_fps
+      self.last_frame_time = 0.0
+      self.after_id = None
+      # Tasks to execute on the next frame, in order of scheduling.
+      # Callables are used as keys, so scheduling the same task again before
+      # the next frame does not execute it twice.
+      self.tasks = {}
+
+   def schedule(self, task):
+      self.tasks[task] = task
+      if self.after_id is None:
+         # Wait for the remaining part of the frame interval,
+         # or just until Tk is idle if the interval has already passed.
+         delay_ms = round(1000.0 * (self.last_frame_time + self.frame_interval - time.perf_counter()))
+         if delay_ms > 0:
+            self.after_id = self.tk_widget.after(delay_ms, self.onFrame)
+         else:
+            self.after_id = self.tk_widget.after_idle(self.onFrame)
+
+   def onFrame(self):
+      self.after_id = None
+      self.last_frame_time = time.perf_counter()
+      # Tasks scheduled while processing the frame (e.g. redraw of a linked plot
+      # requested by a view change) are executed within the same frame.
+      # Tasks re-scheduled by themselves are postponed to the next frame.
+      executed = set()
+      while True:
+         task = next((t for t in self.tasks if t not in executed), None)
+         if task is None:
+            break
+         del self.tasks[task]
+         executed.add(task)
+         task()
+      if len(self.tasks) > 0:
+         self.after_id = self.tk_widget.after(round(1000.0 * self.frame_interval), self.onFrame)
+
 #===============================================================================
 class Grid:
 
    def __init__(self, plot):
       self.plot = plot
-      self.lines = []
-      self.texts = []
-
-   def drawLineItems(self, line_items):
-      for ix in range(len(line_items)):
-         # Create a new line object if necessary.
-         if len(self.lines) <= ix:
-            self.lines.append(self.plot.canvas.create_line(0,0,0,0, fill = COLOR_GRID))
-         # Set coordinates and move to the bottom.
-         self.plot.canvas.coords(self.lines[ix], *line_items[ix])
-         self.plot.canvas.tag_lower(self.lines[ix])
-      # Delete redundant line objects.
-      while len(self.lines) > len(line_items):
-         self.plot.canvas.delete(self.lines.pop())
-
-   def drawTextItems(self, text_items):
-      for ix in range(len(text_items)):
-         px,py,anchr,txt = text_items[ix]
-         # Create a new text object if necessary.
-         if len(self.texts) <= ix:
-            self.texts.append(self.plot.canvas.create_text(0,0, fill = COLOR_GRID))
-         # Set coordinates, anchor, text, and move to the bottom.
-         self.plot.canvas.coords(self.texts[ix], px, py)
-         self.plot.canvas.itemconfig(self.texts[ix], anchor = anchr, text = txt)
-         self.plot.canvas.tag_lower(self.texts[ix])
-      # Delete redundant text objects.
-      while len(self.texts) > len(text_items):
-         self.plot.canvas.delete(self.texts.pop())
-
-   def determinePrecision(self, delta):
-      fract_digits = 0
-      while delta < 1.0:
-         delta *= 10.0
-         fract_digits += 1
-      return fract_digits
+      # Line and text objects of the grid, identified by keys of their layout items.
+      self.lines = {}
+      self.texts = {}
+      # Hidden line and text objects which can be reused.
+      self.free_lines = []
+      self.free_texts = []
+      # Last coordinates and options set for each object.
+      self.item_state = {}
+      # Recently calculated layouts.
+      self.layout_cache = {}
+
+   def createLine(self):
+      line_id = self.plot.canvas.create_line(0,0,0,0, fill = COLOR_GRID, tags = 'grid')
+      # Move to the bottom. Stacking order is only set once, objects keep it when they are moved.
+      self.plot.canvas.tag_lower(line_id)
+      return line_id
+
+   def createText(self):
+      text_id = self.plot.canvas.create_text(0,0, fill = COLOR_GRID, tags = 'grid')
+      self.plot.canvas.tag_lower(text_id)
+      return text_id
+
+   def updateItem(self, item_id, coords, options):
+      old_coords, old_options = self.item_state.get(item_id, (None, None))
+      # Only touch the object if something has actually changed.
+      if coords != old_coords:
+         self.plot.canvas.coords(item_id, *coords)
+      if options != old_options:
+         self.plot.canvas.itemconfig(item_id, **options)
+      self.item_state[item_id] = (coords, options)
+
+   def drawItems(self, items, active, free, create_func):
+      keys = set(key for key,coords,options in items)
+      # Hide objects which are no longer part of the layout, and keep them for reuse.
+      for key in [key for key in active if key not in keys]:
+         item_id = active.pop(key)
+         self.plot.canvas.itemconfig(item_id, state = 'hidden')
+         free.append(item_id)
+      for key,coords,options in items:
+         item_id = active.get(key)
+         # Objects with the same key are just moved, new keys reuse hidden objects if possible.
+         if item_id is None:
+            if len(free) > 0:
+               item_id = free.pop()
+               self.plot.canvas.itemconfig(item_id, state = 'normal')
+            else:
+               item_id = create_func()
+            active[key] = item_id
+         self.updateItem(item_id, coords, options)
 
    def value2string(self, value, fract_digits):
       return '{:.{precision}f}'.format(value, precision = fract_digits)
 
-   def draw(self):
+   def calculateNiceStep(self, min_step):
+      # Smallest step from the 1-2-5 sequence which is not smaller than the given one.
+      magnitude = 10.0**math.floor(math.log10(min_step))
+      for multiplier in (1.0, 2.0, 5.0, 10.0):
+         if magnitude * multiplier >= min_step:
+            return (magnitude * multiplier)
+
+   def calculateLinearTicks(self, axis, c0, c1, pixel_length):
+      v0,v1 = sorted((axis.convertTo(c0), axis.convertTo(c1)))
+      if v1 <= v0:
+         return []
+      step = self.calculateNiceStep((v1 - v0) * GRID_MIN_STEP_PX / pixel_length)
+      fract_digits = max(0, -math.floor(math.log10(step) + 1e-9))
+      # Ticks are identified by the step and their index, so they keep their keys when panning.
+      ticks = []
+      for n in range(math.ceil(v0 / step - 1e-9), math.floor(v1 / step + 1e-9) + 1):
+         value = n * step
+         ticks.append(((step, n), n, axis.convertFrom(value), self.value2string(value, fract_digits)))
+      return ticks
+
+   def calculateLogarithmicTicks(self, axis, c0, c1, pixel_length):
+      v0,v1 = sorted((axis.convertTo(c0), axis.convertTo(c1)))
+      if v1 <= v0:
+         return []
+      pixels_per_decade = pixel_length / (math.log10(v1) - math.log10(v0))
+      # Select the densest set of ticks within a decade which keeps the minimum distance.
+      # The distance between consecutive ticks is the smallest at the end of the decade.
+      decade_step = 1
+      for mantissas in GRID_LOG_MANTISSAS:
+         if math.log10(mantissas[-1] / mantissas[-2]) * pixels_per_decade >= GRID_MIN_STEP_PX:
+            break
+      else:
+         mantissas = (1, 10)
+         decade_step = math.ceil(GRID_MIN_STEP_PX / pixels_per_decade)
+      ticks = []
+      for decade in range(math.floor(math.log10(v0)), math.ceil(math.log10(v1)) + 1):
+         if (decade % decade_step) != 0:
+            continue
+         for m in mantissas[:-1]:
+            value = m * 10.0**decade
+            if v0 * (1.0 - 1e-9) <= value <= v1 * (1.0 + 1e-9):
+               fract_digits = max(0, -decade)
+               ticks.append(((decade, m), len(ticks), axis.convertFrom(value), self.value2string(value, fract_digits)))
+      return ticks
+
+   def calculateTicks(self, axis, c0, c1, pixel_length):
+      if axis.isLogarithmic():
+         return self.calculateLogarithmicTicks(axis, c0, c1, pixel_length)
+      else:
+         return self.calculateLinearTicks(axis, c0, c1, pixel_length)
+
+   def calculateLayout(self):
       line_items = []
       text_items = []
-      # Determine the number of positions to display on X and Y axes
-      # based on lengths (in pixels) of those axes.
-      horiz_count = max(self.plot.getPixelWidth()  // GRID_MIN_STEP_PX, 3)
-      vert_count  = max(self.plot.getPixelHeight() // GRID_MIN_STEP_PX, 3)
-      # Always use odd numbers of positions to have a center line.
-      if (horiz_count % 2) == 0:
-         horiz_count -= 1
-      if (vert_count % 2) == 0:
-         vert_count -= 1
       # Get X and Y axes.
       x_axis = self.plot.getXaxis()
       y_axis = self.plot.getYaxis()
       # Get ranges for coordinates on X and Y axes.
       x0,x1 = self.plot.getXcoordsRange()
       y0,y1 = self.plot.getYcoordsRange()
-      # Calculate coordinates for all positions on X and Y axes.
-      x_coords = [x0 + (x1-x0) * (i/(horiz_count-1)) for i in range(horiz_count)]
-      y_coords = [y0 + (y1-y0) * (i/(vert_count-1))  for i in range(vert_count)]
+      # Calculate ticks on X and Y axes based on lengths (in pixels) of those axes.
+      x_ticks = self.calculateTicks(x_axis, x0, x1, self.plot.getPixelWidth())
+      y_ticks = self.calculateTicks(y_axis, y0, y1, self.plot.getPixelHeight())
+      # Create line items for the border of the grid.
+      px0,py0 = self.plot.coords2pixels(x0,y0)
+      px1,py1 = self.plot.coords2pixels(x1,y1)
+      line_items.append(('left',   (px0,py0,px0,py1), {}))
+      line_items.append(('right',  (px1,py0,px1,py1), {}))
+      line_items.append(('bottom', (px0,py0,px1,py0), {}))
+      line_items.append(('top',    (px0,py1,px1,py1), {}))
       # Create line items for all horizontal and vertical lines of the grid.
-      line_items += [self.plot.coords2pixels(x,y0) + self.plot.coords2pixels(x,y1) for x in x_coords]
-      line_items += [self.plot.coords2pixels(x0,y) + self.plot.coords2pixels(x1,y) for y in y_coords]
+      for key,ix,x,txt in x_ticks:
+         px,py = self.plot.coords2pixels(x,y0)
+         line_items.append((('x', key), (px,py0,px,py1), {}))
+      for key,ix,y,txt in y_ticks:
+         px,py = self.plot.coords2pixels(x0,y)
+         line_items.append((('y', key), (px0,py,px1,py), {}))
       # Create text item for unit of the X axis.
       if x_axis.getUnit() is not None:
-         px1,py0 = self.plot.coords2pixels(x1,y0)
-         item = (px1+GRID_TEXT_OFFSET_PX, py0, 'sw', x_axis.getUnit())
-         text_items.append(item)
+         text_items.append(('x_unit', (px1+GRID_TEXT_OFFSET_PX, py0), {'anchor': 'sw', 'text': x_axis.getUnit()}))
       # Create text item for unit of the Y axis.
       if y_axis.getUnit() is not None:
-         px0,py1 = self.plot.coords2pixels(x0,y1)
-         item = (px0, py1-GRID_TEXT_OFFSET_PX, 'sw', y_axis.getUnit())
-         text_items.append(item)
-      # Calculate values for all positions on X and Y axes.
-      x_values = [x_axis.convertTo(x) for x in x_coords]
-      y_values = [y_axis.convertTo(y) for y in y_coords]
-      # Determine representation precision based on differences between consecutive values.
-      x_prec = self.determinePrecision(x_values[1] - x_values[0])
-      y_prec = self.determinePrecision(y_values[1] - y_values[0])
-      # Determine how many positions to skip on the X axis
-      # based on the length of string representing the second to last value.
-      x_mod = (len(self.value2string(x_values[-2], x_prec)) + 4) // 3
+         text_items.append(('y_unit', (px0, py1-GRID_TEXT_OFFSET_PX), {'anchor': 'sw', 'text': y_axis.getUnit()}))
+      # Determine how many ticks to skip on the X axis
+      # based on the length of the longest string and the distance between ticks.
+      if len(x_ticks) > 1:
+         tick_dist_px = abs(self.plot.coords2pixels(x_ticks[1][2],y0)[0] - self.plot.coords2pixels(x_ticks[0][2],y0)[0])
+         text_len_px = (max(len(txt) for key,ix,x,txt in x_ticks) + 2) * GRID_CHAR_WIDTH_PX
+         # Keep the labeled values round as well.
+         x_mod = round(self.calculateNiceStep(max(text_len_px / max(tick_dist_px, 1), 1.0)))
+      else:
+         x_mod = 1
       # Create text items for values on the X axis.
-      for ix in range(len(x_coords)):
+      for key,ix,x,txt in x_ticks:
          if (ix % x_mod) == 0:
-            px,py = self.plot.coords2pixels(x_coords[ix], y0)
-            item = (px, py+GRID_TEXT_OFFSET_PX, 'n', self.value2string(x_values[ix], x_prec))
-            text_items.append(item)
+            px,py = self.plot.coords2pixels(x,y0)
+            text_items.append((('x', key), (px, py+GRID_TEXT_OFFSET_PX), {'anchor': 'n', 'text': txt}))
       # Create text items for values on the Y axis.
-      for ix in range(len(y_coords)):
-         px,py = self.plot.coords2pixels(x0, y_coords[ix])
-         item = (px-GRID_TEXT_OFFSET_PX, py, 'e', self.value2string(y_values[ix], y_prec))
-         text_items.append(item)
-      # Draw the prepared line and text items.
-      self.drawLineItems(line_items)
-      self.drawTextItems(text_items)
-
-#===============================================================================
-class Point:
-
-   def __init__(self, plot, color):
-      self.plot = plot
-      self.color = color
-      self.oval_id = plot.canvas.create_oval(0,0,0,0)
-
-   def delete(self):
-      self.plot.canvas.delete(self.oval_id)
-
-   def setEnabled(self, value):
-      if value:
-         self.plot.canvas.itemconfig(self.oval_id, fill = self.color, outline = COLOR_DEFAULT)
-         self.plot.canvas.tag_bind(self.oval_id, '<Enter>', lambda evt: self.plot.selectPoint(self))
-         self.plot.canvas.tag_bind(self.oval_id, '<Leave>', lambda evt: self.plot.deselectPoint())
-      else:
-         self.plot.canvas.itemconfig(self.oval_id, fill = COLOR_DISABLE_LIGHT, outline = COLOR_DISABLE_DARK)
-         self.plot.canvas.tag_unbind(self.oval_id, '<Enter>')
-         self.plot.canvas.tag_unbind(self.oval_id, '<Leave>')
-
-   def setHighlight(self, value):
-      self.plot.canvas.itemconfig(self.oval_id, outline = (COLOR_HIGHLIGHT if value else COLOR_DEFAULT))
-
-   def refreshPosition(self):
-      px,py = self.plot.coords2pixels(self.x, self.y)
-      self.plot.canvas.coords(
-         self.oval_id,
-         px - POINT_RADIUS_PX,
-         py - POINT_RADIUS_PX,
-         px + POINT_RADIUS_PX,
-         py + POINT_RADIUS_PX)
-
-   def serialize(self):
-      return (self.x, self.y)
-
-   def deserialize(self, input):
-      self.x = input[0]
-      self.y = input[1]
-      self.refreshPosition()
-
-#===============================================================================
-class ControlPoint(Point):
-
-   def __init__(self, plot):
-      super().__init__(plot, COLOR_CONTROL_POINT)
-
-   def limitCoords(self, x, y):
-      x = min(max(x, 0.0), 1.0)
-      y = min(max(y, 0.0), 1.0)
-      return (x,y)
-
-   def refreshPosition(self):
-      if self.left is not None:
-         self.left.refreshPosition()
-      if self.right is not None:
-         self.right.refreshPosition()
-      super().refreshPosition()
-
-   def spawn(self, prev, next, x, y):
-      self.x, self.y = self.limitCoords(x,y)
-      self.prev = prev
-      self.next = next
-      self.left = None
-      self.right = None
-      if prev is not None:
-         prev.next = self
-         self.left = CurvePoint(self.plot)
-         self.left.spawn(self, self.x-SPAWN_MIN_DIST_REL, self.y)
-      if next is not None:
-         next.prev = self
-         self.right = CurvePoint(self.plot)
-         self.right.spawn(self, self.x+SPAWN_MIN_DIST_REL, self.y)
-      super().refreshPosition()
-      self.setEnabled(True)
-
-   def delete(self):
-      if self.prev is not None:
-         self.prev.next = self.next
-      if self.next is not None:
-         self.next.prev = self.prev
-      if self.left is not None:
-         self.left.delete()
-      if self.right is not None:
-         self.right.delete()
-      super().delete()
-      self.prev = None
-      self.next = None
-      self.left = None
-      self.right = None
-
-   def setEnabled(self, value):
-      super().setEnabled(value)
-      if self.left is not None:
-         self.left.setEnabled(value)
-      if self.right is not None:
-         self.right.setEnabled(value)
-
-   def moveTo(self, x, y):
-      x,y = self.limitCoords(x,y)
-      # First and last control points can only be moved along the Y axis.
-      if (self.prev is None) or (self.next is None):
-         x = self.x
-      # Other control points are limited in the X axis to their neighbors.
-      else:
-         x = min(max(x, self.prev.x), self.next.x)
-      dx = x - self.x
-      dy = y - self.y
-      self.x = x
-      self.y = y
-      if self.left is not None:
-         self.left.moveTo(self.left.x + dx, self.left.y + dy)
-      if self.right is not None:
-         self.right.moveTo(self.right.x + dx, self.right.y + dy)
-      super().refreshPosition()
-
-   def serialize(self):
-      return (
-         self.left.serialize() if (self.left is not None) else None,
-         super().serialize(),
-         self.right.serialize() if (self.right is not None) else None)
-
-   def deserialize(self, input):
-      if self.left is not None:
-         self.left.deserialize(input[0])
-      super().deserialize(input[1])
-      if self.right is not None:
-         self.right.deserialize(input[2])
-
-#===============================================================================
-class CurvePoint(Point):
+      for key,ix,y,txt in y_ticks:
+         px,py = self.plot.coords2pixels(x0,y)
+         text_items.append((('y', key), (px-GRID_TEXT_OFFSET_PX, py), {'anchor': 'e', 'text': txt}))
+      return (line_items, text_items)
 
-   def __init__(self, plot):
-      super().__init__(plot, COLOR_CURVE_POINT)
-
-   def limitCoords(self, x, y):
-      x = min(max(x, 0.0), 1.0)
-      y = min(max(y, -Y_MARGIN_REL), 1.0+Y_MARGIN_REL)
-      return (x,y)
-
-   def spawn(self, parent, x, y):
-      self.x, self.y = self.limitCoords(x,y)
-      self.parent = parent
-      self.refreshPosition()
-
-   def moveTo(self, x, y):
-      x,y = self.limitCoords(x,y)
-      # Curve points cannot cross the X value of their control point.
-      if self is self.parent.left:
-         x = min(x, self.parent.x)
-      else:
-         x = max(x, self.parent.x)
-      self.x = x
-      self.y = y
-      self.refreshPosition()
+   def draw(self):
+      # Layout depends on the size of the plot, the visible range and parameters of the axes.
+      key = (
+         self.plot.width, self.plot.height,
+         self.plot.getXcoordsRange(), self.plot.getYcoordsRange(),
+         self.plot.getXaxis().version, self.plot.getYaxis().version)
+      layout = self.layout_cache.pop(key, None)
+      if layout is None:
+         layout = self.calculateLayout()
+         # Drop the least recently used layout.
+         if len(self.layout_cache) >= GRID_CACHE_SIZE:
+            del self.layout_cache[next(iter(self.layout_cache))]
+      self.layout_cache[key] = layout
+      # Draw the prepared line and text items.
+      line_items, text_items = layout
+      self.drawItems(line_items, self.lines, self.free_lines, self.createLine)
+      self.drawItems(text_items, self.texts, self.free_texts, self.createText)
 
 #===============================================================================
 class Panel:
 
-   def __init__(self, tk_parent, width, height, x_axis, y_axis, zoom_widget, callback):
+   def __init__(self, tk_parent, width, height, x_axis, y_axis, zoom_widget, callback, scheduler):
       self.width  = width
       self.height = height
       self.x_axis = x_axis
@@ -293,8 +278,16 @@ class Panel:
       self.zoom_widget = zoom_widget
       self.on_curve_change = callback
       self.on_view_change = None
+      self.on_curve_drag = None
       self.mouse_pos = None
+      self.pending_mouse_pos = None
       self.enabled = True
+      # Parts of the plot which need to be redrawn on the next frame.
+      self.dirty = set()
+      # Points (identified by their kind and index) and curve segments
+      # (identified by index of their first control point) which need to be redrawn on the next frame.
+      self.dirty_points = set()
+      self.dirty_segments = set()
       # Parameters to allow zooming.
       self.x_range = [0.0, 1.0]
       self.y_range = [0.0, 1.0]
@@ -310,24 +303,41 @@ class Panel:
       self.canvas.bind('<Button-1>', self.onMouse1Press)
       self.canvas.bind('<ButtonRelease-1>', self.onMouse1Release)
       self.canvas.bind('<B1-Motion>', self.onMouse1Motion)
+      self.canvas.bind('<Motion>', self.onMouseMotion)
       self.canvas.bind('<MouseWheel>', self.onMouseWheel)
-      # Control points.
-      head = ControlPoint(self)
-      tail = ControlPoint(self)
-      head.spawn(None, tail, 0.0, 0.5)
-      tail.spawn(head, None, 1.0, 0.5)
-      self.control_points = head
-      self.selected_point = None
-      self.grabbed_point = None
-      # Curve lines.
-      self.curve_lines = []
-      self.drawCurveLines()
+      # Redraws are deferred and coalesced into frames.
+      # Plots sharing the scheduler are updated from the same frame.
+      self.scheduler = scheduler
       # Grid.
       self.plot_grid = Grid(self)
       self.plot_grid.draw()
+      # Curve data.
+      self.model = model.CurveModel(Y_MARGIN_REL)
+      self.selected_point = None
+      self.grabbed_point = None
+      # Only visible points and segments have canvas objects.
+      # Objects which are no longer visible are hidden and kept in pools for reuse.
+      self.visible_ovals = {}
+      self.visible_lines = {}
+      self.oval_pool = []
+      self.line_pool = []
+      self.item_options = {}
+      # Single polyline used instead of segments when the curve is too dense.
+      self.lod_mode = False
+      self.lod_line = None
+      self.dirty_lod = False
+      self.visible_area = self.getVisibleArea()
+      # Overlay of rendered samples, and the number of rendered samples spanning the X axis.
+      self.overlay = None
+      self.overlay_line = None
+      self.x_samples = 0
+      self.deserialize((
+         (None, (0.0, 0.5), (SPAWN_MIN_DIST_REL, 0.5)),
+         ((1.0-SPAWN_MIN_DIST_REL, 0.5), (1.0, 0.5), None)))
+      self.redraw()
       # Callbacks to update grid.
-      self.x_axis.registerCallback(self.plot_grid.draw)
-      self.y_axis.registerCallback(self.plot_grid.draw)
+      self.x_axis.registerCallback(lambda: self.invalidate('grid'))
+      self.y_axis.registerCallback(lambda: self.invalidate('grid'))
       # Context menu.
       self.createMenu(tk_parent)
 
@@ -365,10 +375,15 @@ class Panel:
       y = y * (self.y_range[1] - self.y_range[0]) + self.y_range[0]
       return (x,y)
 
-   def calculateViewZoom(self, coord, range, multiplier):
+   def getMaxXzoom(self):
+      # Allow zooming in on individual rendered samples.
+      return max(ZOOM_MAX, self.x_samples * OVERLAY_MAX_SAMPLE_PX / self.getPixelWidth())
+
+   def calculateViewZoom(self, coord, range, multiplier, zoom_max = ZOOM_MAX):
       new_range = range[:]
       new_zoom = multiplier / (new_range[1] - new_range[0])
-      if new_zoom <= ZOOM_MAX:
+      # Zoom out is always allowed, e.g. when the limit was lowered by a shorter sound.
+      if (new_zoom <= zoom_max) or (multiplier < 1.0):
          # Clip coordinate to the currently visible range.
          coord = min(max(coord, new_range[0]), new_range[1])
          # Zoom in if multiplier > 1, zoom out if multiplier < 1.
@@ -425,7 +440,7 @@ class Panel:
    def onResize(self, event):
       self.width = event.width
       self.height = event.height
-      self.refreshPositions()
+      self.invalidate('grid', 'view')
 
    def onMouse3Press(self, event):
       self.showMenu(event, self.selected_point)
@@ -435,25 +450,45 @@ class Panel:
       self.mouse_pos = (event.x, event.y)
 
    def onMouse1Release(self, event):
+      # Apply the motion which has not been processed yet.
+      self.processMotion()
       if self.grabbed_point is not None:
          self.on_curve_change()
       self.ungrabPoint()
 
+   def onMouseMotion(self, event):
+      # Hit-testing is done on the curve data instead of canvas objects.
+      self.selectPoint(self.pickPoint(event.x, event.y) if self.enabled else None)
+
    def onMouse1Motion(self, event):
+      # Motion events are coalesced, only the last position is processed on the next frame.
+      self.pending_mouse_pos = (event.x, event.y)
+      self.scheduler.schedule(self.processMotion)
+
+   def processMotion(self):
+      if self.pending_mouse_pos is None:
+         return
+      px,py = self.pending_mouse_pos
+      self.pending_mouse_pos = None
       if self.grabbed_point is not None:
-         self.grabbed_point.moveTo(*self.pixels2coords(event.x, event.y))
-         self.drawCurveLines()
+         kind,ix = self.grabbed_point
+         self.model.movePoint(kind, ix, *self.pixels2coords(px, py))
+         self.invalidateControlPoint(ix)
+         self.dirty_lod = True
+         # Curve is changed again on release, this only notifies of the intermediate state.
+         if self.on_curve_drag is not None:
+            self.on_curve_drag()
       else:
          x0,y0 = self.pixels2coords(self.mouse_pos[0], self.mouse_pos[1])
-         x1,y1 = self.pixels2coords(event.x, event.y)
+         x1,y1 = self.pixels2coords(px, py)
          x_range = self.calculateViewMove(x1 - x0, self.x_range)
          y_range = self.calculateViewMove(y1 - y0, self.y_range)
          # Update view, and notify of the change.
          self.setView(x_range, y_range)
          if self.on_view_change is not None:
             self.on_view_change(x_range, y_range)
-      # Update saved maouse position.
-      self.mouse_pos = (event.x, event.y)
+      # Update saved mouse position.
+      self.mouse_pos = (px, py)
 
    def onMouseWheel(self, event):
       x,y = self.pixels2coords(event.x, event.y)
@@ -466,7 +501,7 @@ class Panel:
       y_range = self.y_range
       zoom_mode =  self.zoom_widget.getZoomMode()
       if 'X' in zoom_mode:
-         x_range = self.calculateViewZoom(x, x_range, multiplier)
+         x_range = self.calculateViewZoom(x, x_range, multiplier, self.getMaxXzoom())
       if 'Y' in zoom_mode:
          y_range = self.calculateViewZoom(y, y_range, multiplier)
       # Update view, and notify of the change.
@@ -476,14 +511,24 @@ class Panel:
 
    #----------------------------------------------------------------------------
 
+   def pickPoint(self, px, py):
+      # Points are picked through the spatial index of the model, also when the curve is drawn as a polyline.
+      x,y = self.pixels2coords(px, py)
+      # Radius of points in coordinates.
+      x_radius = self.pixels2coords(px + POINT_RADIUS_PX, py)[0] - x
+      y_radius = y - self.pixels2coords(px, py + POINT_RADIUS_PX)[1]
+      return self.model.pick(x, y, x_radius, y_radius)
+
    def selectPoint(self, point):
-      if point is not None:
-         point.setHighlight(True)
-      self.selected_point = point
+      if self.selected_point != point:
+         self.deselectPoint()
+         if point is not None:
+            self.setHighlight(point, True)
+         self.selected_point = point
 
    def deselectPoint(self):
       if (self.selected_point is not None) and (self.grabbed_point is None):
-         self.selected_point.setHighlight(False)
+         self.setHighlight(self.selected_point, False)
       self.selected_point = None
 
    def grabPoint(self, point):
@@ -491,68 +536,287 @@ class Panel:
 
    def ungrabPoint(self):
       if (self.grabbed_point is not None) and (self.selected_point is None):
-         self.grabbed_point.setHighlight(False)
+         self.setHighlight(self.grabbed_point, False)
       self.grabbed_point = None
 
+   def clearSelection(self):
+      # Indices of points are no longer valid when points are inserted or deleted.
+      self.grabbed_point = None
+      self.deselectPoint()
+
+   def isHighlighted(self, point):
+      return (point == self.selected_point) or (point == self.grabbed_point)
+
    #----------------------------------------------------------------------------
 
    def addControlPoint(self, x, y):
-      new_point = ControlPoint(self)
-      cur_point = self.control_points
-      # Note that there are always at least two control points in the list.
-      while True:
-         cur_point = cur_point.next
-         if (x < cur_point.x) or (cur_point.next is None):
-            new_point.spawn(cur_point.prev, cur_point, x, y)
-            break
-      # Re-draw curve, and notify of the change.
-      self.drawCurveLines()
+      self.clearSelection()
+      self.model.insert(x, y, SPAWN_MIN_DIST_REL)
+      # Indices of the following points are changed, so visible objects are re-assigned.
+      self.invalidate('view')
+      # Notify of the change, the curve is re-drawn on the next frame.
       self.on_curve_change()
 
    def deleteControlPoint(self, point):
-      point.delete()
+      kind,ix = point
+      self.clearSelection()
+      self.model.delete(ix)
+      self.invalidate('view')
       self.on_curve_change()
-      self.drawCurveLines()
 
-   def isDeletable(self, point_to_check):
-      cur_point = self.control_points
-      # Note that there are always at least two control points in the list.
-      while True:
-         cur_point = cur_point.next
-         if cur_point.next is None:
-            return False
-         if cur_point is point_to_check:
-            return True
+   def isDeletable(self, point):
+      return (point is not None) and self.model.isDeletable(*point)
+
+   #----------------------------------------------------------------------------
+
+   def configureItem(self, item_id, **options):
+      # Only send options which are actually changed.
+      old_options = self.item_options.setdefault(item_id, {})
+      changed = {key: value for key,value in options.items() if old_options.get(key) != value}
+      if len(changed) > 0:
+         self.canvas.itemconfig(item_id, **changed)
+         old_options.update(changed)
+
+   def stackItem(self, item_id, layer):
+      # Place the object above all objects of lower layers, and below objects of higher layers.
+      # Stacking order is only set once, objects keep it when they are moved or reused.
+      for lower_layer in reversed(PLOT_LAYERS[:PLOT_LAYERS.index(layer)]):
+         if len(self.canvas.find_withtag(lower_layer)) > 0:
+            self.canvas.tag_raise(item_id, lower_layer)
+            return
+      self.canvas.tag_lower(item_id)
+
+   def acquireItem(self, pool, create_func):
+      if len(pool) > 0:
+         item_id = pool.pop()
+         self.configureItem(item_id, state = 'normal')
+      else:
+         item_id = create_func()
+      return item_id
+
+   def releaseItem(self, pool, item_id):
+      # Objects are hidden and kept for reuse instead of being deleted.
+      self.configureItem(item_id, state = 'hidden')
+      pool.append(item_id)
+
+   def createPointOval(self):
+      oval_id = self.canvas.create_oval(0,0,0,0, tags = 'point')
+      self.stackItem(oval_id, 'point')
+      return oval_id
+
+   def createCurveLine(self):
+      line_id = self.canvas.create_line(0,0,0,0, smooth = 'bezier', tags = 'curve')
+      self.stackItem(line_id, 'curve')
+      return line_id
+
+   def getPointColors(self, kind, highlight):
+      if not self.enabled:
+         return (COLOR_DISABLE_LIGHT, COLOR_DISABLE_DARK)
+      fill = COLOR_CONTROL_POINT if (kind == model.CONTROL) else COLOR_CURVE_POINT
+      outline = COLOR_HIGHLIGHT if highlight else COLOR_DEFAULT
+      return (fill, outline)
+
+   def getCurveLineColor(self):
+      return (COLOR_DEFAULT if self.enabled else COLOR_DISABLE_DARK)
+
+   def setHighlight(self, point, value):
+      # Only highlighted points are shown when the curve is drawn as a polyline, so the point is drawn or released.
+      if self.lod_mode:
+         self.dirty_points.add(point)
+         self.scheduler.schedule(self.redraw)
+      oval_id = self.visible_ovals.get(point)
+      if oval_id is not None:
+         fill,outline = self.getPointColors(point[0], value)
+         self.configureItem(oval_id, outline = outline)
 
    #----------------------------------------------------------------------------
 
+   def getVisibleArea(self):
+      # Area of the whole canvas (including margins) in coordinates,
+      # extended by radius of points so that partially visible points are included.
+      x0,y0 = self.pixels2coords(-POINT_RADIUS_PX, self.height + POINT_RADIUS_PX)
+      x1,y1 = self.pixels2coords(self.width + POINT_RADIUS_PX, -POINT_RADIUS_PX)
+      return (x0, y0, x1, y1)
+
+   def isPointVisible(self, kind, ix):
+      if not self.model.exists(kind, ix):
+         return False
+      x,y = self.model.getPoint(kind, ix)
+      x0,y0,x1,y1 = self.visible_area
+      return (x0 <= x <= x1) and (y0 <= y <= y1)
+
+   def isPointShown(self, kind, ix):
+      if self.lod_mode and not self.isHighlighted((kind, ix)):
+         return False
+      return self.isPointVisible(kind, ix)
+
+   def isSegmentVisible(self, ix):
+      if not (0 <= ix < len(self.model)-1):
+         return False
+      # Bezier curve is within the bounding box of its points.
+      xs,ys = zip(*self.model.getSegment(ix))
+      x0,y0,x1,y1 = self.visible_area
+      return (min(xs) <= x1) and (max(xs) >= x0) and (min(ys) <= y1) and (max(ys) >= y0)
+
+   def updateVisibility(self):
+      self.visible_area = self.getVisibleArea()
+      x0,y0,x1,y1 = self.visible_area
+      # Range of control points which themselves or whose curve points can be visible.
+      ix0,ix1 = self.model.findRange(x0, x1)
+      segment_range = range(max(ix0-1, 0), min(ix1, len(self.model)-1))
+      # Dense curves are drawn as a single polyline with pixel resolution.
+      self.lod_mode = len(segment_range) * LOD_MIN_SEGMENT_PX > self.getPixelWidth()
+      if self.lod_mode:
+         # Only the hovered or grabbed point is drawn.
+         points = set(point for point in (self.selected_point, self.grabbed_point) if point is not None)
+         segments = set()
+         self.dirty_lod = True
+      else:
+         points = set(
+            (kind,ix)
+            for kind in (model.CONTROL, model.LEFT, model.RIGHT)
+            for ix in range(ix0, ix1)
+            if self.isPointVisible(kind, ix))
+         segments = set(ix for ix in segment_range if self.isSegmentVisible(ix))
+         if self.lod_line is not None:
+            self.configureItem(self.lod_line, state = 'hidden')
+      # Release objects which are no longer visible, all visible ones need to be redrawn.
+      for point in [point for point in self.visible_ovals if point not in points]:
+         self.releaseItem(self.oval_pool, self.visible_ovals.pop(point))
+      for ix in [ix for ix in self.visible_lines if ix not in segments]:
+         self.releaseItem(self.line_pool, self.visible_lines.pop(ix))
+      self.dirty_points = points
+      self.dirty_segments = segments
+
    def drawCurveLines(self):
-      curve = self.serialize()
-      for ix in range(len(curve)-1):
-         px1,py1 = self.coords2pixels(*curve[ix][1])
-         px2,py2 = self.coords2pixels(*curve[ix][2])
-         px3,py3 = self.coords2pixels(*curve[ix+1][0])
-         px4,py4 = self.coords2pixels(*curve[ix+1][1])
-         # Create a new line object if necessary.
-         if len(self.curve_lines) <= ix:
-            self.curve_lines.append(self.canvas.create_line(0,0,0,0, smooth = 'bezier'))
-         # Setup coordinates.
-         self.canvas.coords(self.curve_lines[ix], px1, py1, px2, py2, px3, py3, px4, py4)
-         # Setup color.
-         self.canvas.itemconfig(self.curve_lines[ix], fill = (COLOR_DEFAULT if self.enabled else COLOR_DISABLE_DARK))
-         # Move curve lines below all points but above grid.
-         self.canvas.tag_lower(self.curve_lines[ix], self.control_points.oval_id)
-      # Remove redundant line objects.
-      while len(self.curve_lines) > len(curve)-1:
-         self.canvas.delete(self.curve_lines.pop())
+      for ix in self.dirty_segments:
+         line_id = self.visible_lines.get(ix)
+         if self.isSegmentVisible(ix):
+            if line_id is None:
+               line_id = self.acquireItem(self.line_pool, self.createCurveLine)
+               self.visible_lines[ix] = line_id
+            self.configureItem(line_id, fill = self.getCurveLineColor())
+            pixels = []
+            for x,y in self.model.getSegment(ix):
+               pixels += self.coords2pixels(x,y)
+            self.canvas.coords(line_id, *pixels)
+         elif line_id is not None:
+            self.releaseItem(self.line_pool, self.visible_lines.pop(ix))
+      self.dirty_segments.clear()
 
    def refreshPositions(self):
-      self.plot_grid.draw()
-      self.drawCurveLines()
-      point = self.control_points
-      while point is not None:
-         point.refreshPosition()
-         point = point.next
+      for point in self.dirty_points:
+         oval_id = self.visible_ovals.get(point)
+         if self.isPointShown(*point):
+            if oval_id is None:
+               oval_id = self.acquireItem(self.oval_pool, self.createPointOval)
+               self.visible_ovals[point] = oval_id
+            fill,outline = self.getPointColors(point[0], self.isHighlighted(point))
+            self.configureItem(oval_id, fill = fill, outline = outline)
+            px,py = self.coords2pixels(*self.model.getPoint(*point))
+            self.canvas.coords(
+               oval_id,
+               px - POINT_RADIUS_PX,
+               py - POINT_RADIUS_PX,
+               px + POINT_RADIUS_PX,
+               py + POINT_RADIUS_PX)
+         elif oval_id is not None:
+            self.releaseItem(self.oval_pool, self.visible_ovals.pop(point))
+      self.dirty_points.clear()
+
+   def drawLodLine(self):
+      x0,y0,x1,y1 = self.visible_area
+      ix0,ix1 = self.model.findRange(x0, x1)
+      # Include one control point on both sides, so that the line reaches the borders.
+      ix0 = max(ix0-1, 0)
+      ix1 = min(ix1+1, len(self.model))
+      # Segments are narrower than a few pixels, so they are approximated by straight lines.
+      # Only the minimum and maximum per pixel column is kept.
+      pixels = []
+      column_px = None
+      for ix in range(ix0, ix1):
+         px,py = self.coords2pixels(*self.model.getPoint(model.CONTROL, ix))
+         if px != column_px:
+            column_px = px
+            pixels.append([px, py, py])
+         else:
+            pixels[-1][1] = min(pixels[-1][1], py)
+            pixels[-1][2] = max(pixels[-1][2], py)
+      coords = []
+      for px,py_min,py_max in pixels:
+         coords += (px, py_min, px, py_max)
+      if self.lod_line is None:
+         self.lod_line = self.canvas.create_line(0,0,0,0, tags = 'curve')
+         self.stackItem(self.lod_line, 'curve')
+      self.configureItem(self.lod_line, state = 'normal', fill = self.getCurveLineColor())
+      self.canvas.coords(self.lod_line, *coords)
+      self.dirty_lod = False
+
+   def drawOverlay(self):
+      count = len(self.overlay) if (self.overlay is not None) else 0
+      if count < 2:
+         if self.overlay_line is not None:
+            self.configureItem(self.overlay_line, state = 'hidden')
+         return
+      # Convert from sample value to coordinates on the Y axis.
+      value2coord = lambda v: (v / OVERLAY_MAX_VALUE + 1.0) / 2.0
+      # Range of samples which covers the whole canvas.
+      # Sample "ix" is at X coordinate ix/(count-1), same as in the wave generator.
+      x0,y0 = self.pixels2coords(0, 0)
+      x1,y1 = self.pixels2coords(self.width, 0)
+      start = min(max(math.floor(x0 * (count-1)), 0), count-1)
+      stop = min(max(math.ceil(x1 * (count-1)) + 1, start+1), count)
+      px0 = self.coords2pixels(start / (count-1), 0.0)[0]
+      px1 = self.coords2pixels((stop-1) / (count-1), 0.0)[0]
+      coords = []
+      if (stop - start) <= (px1 - px0):
+         # At least one pixel per sample, draw individual samples.
+         for ix,value in enumerate(self.overlay.getSamples(start, stop), start):
+            coords += self.coords2pixels(ix / (count-1), value2coord(value))
+      else:
+         # Draw minimum and maximum value per pixel column from the pyramid.
+         for px,(v_min,v_max) in enumerate(self.overlay.getMinMax(start, stop, px1 - px0 + 1), px0):
+            coords += (px, self.coords2pixels(0.0, value2coord(v_max))[1])
+            coords += (px, self.coords2pixels(0.0, value2coord(v_min))[1])
+      if self.overlay_line is None:
+         self.overlay_line = self.canvas.create_line(0,0,0,0, fill = COLOR_OVERLAY, tags = 'overlay')
+         self.stackItem(self.overlay_line, 'overlay')
+      self.configureItem(self.overlay_line, state = 'normal')
+      if len(coords) < 4:
+         coords += coords
+      self.canvas.coords(self.overlay_line, *coords)
+
+   def invalidateControlPoint(self, ix):
+      # Control point, its curve points, and segments on both sides of it.
+      for kind in (model.CONTROL, model.LEFT, model.RIGHT):
+         if self.model.exists(kind, ix):
+            self.dirty_points.add((kind,ix))
+      if ix > 0:
+         self.dirty_segments.add(ix-1)
+      if ix < len(self.model)-1:
+         self.dirty_segments.add(ix)
+      self.scheduler.schedule(self.redraw)
+
+   def invalidate(self, *parts):
+      self.dirty.update(parts)
+      self.scheduler.schedule(self.redraw)
+
+   def redraw(self):
+      dirty = self.dirty
+      self.dirty = set()
+      if 'grid' in dirty:
+         self.plot_grid.draw()
+      # Change of the view or of the number of points affects visibility of everything.
+      if 'view' in dirty:
+         self.updateVisibility()
+      if 'view' in dirty or 'overlay' in dirty:
+         self.drawOverlay()
+      self.refreshPositions()
+      if self.lod_mode:
+         if self.dirty_lod:
+            self.drawLodLine()
+      else:
+         self.drawCurveLines()
 
    #----------------------------------------------------------------------------
 
@@ -564,23 +828,33 @@ class Panel:
          enabled = not (kwargs['state'] == 'disabled')
          if self.enabled != enabled:
             self.enabled = enabled
-            # Update color of points and bind/unbind their events.
-            point = self.control_points
-            while point is not None:
-               point.setEnabled(self.enabled)
-               point = point.next
-            # Update color of lines.
-            self.drawCurveLines()
+            if not self.enabled:
+               self.clearSelection()
+            # Update color of visible points and lines.
+            self.invalidate('view')
 
    def registerViewChangeCallback(self, callback):
       self.on_view_change = callback
 
+   def registerCurveDragCallback(self, callback):
+      self.on_curve_drag = callback
+
    def setView(self, x_range, y_range):
       if x_range is not None:
          self.x_range = list(x_range)
       if y_range is not None:
          self.y_range = list(y_range)
-      self.refreshPositions()
+      self.invalidate('grid', 'view')
+
+   def setOverlay(self, overlay):
+      # Overlay is a pyramid of rendered samples, spanning the whole X axis.
+      self.overlay = overlay
+      self.setXsamples(len(overlay) if (overlay is not None) else 0)
+      self.invalidate('overlay')
+
+   def setXsamples(self, count):
+      # Linked plots without overlay are given the same number of samples, so that they share the zoom limit.
+      self.x_samples = count
 
    def getXaxis(self):
       return self.x_axis
@@ -589,30 +863,9 @@ class Panel:
       return self.y_axis
 
    def serialize(self):
-      out = []
-      pt = self.control_points
-      while pt is not None:
-         out.append(pt.serialize())
-         pt = pt.next
-      return tuple(out)
+      return self.model.serialize()
 
    def deserialize(self, input):
-      cur_point = self.control_points
-      # Deserialize all points except the last one (which needs to remain last).
-      for item in input[:-1]:
-         # This is the last existing point, we need to add a new one before it.
-         if cur_point.next is None:
-            new_point = ControlPoint(self)
-            new_point.spawn(cur_point.prev, cur_point, 0, 0)
-            new_point.deserialize(item)
-         else:
-            cur_point.deserialize(item)
-            cur_point = cur_point.next
-      # Remove redundant existing points.
-      while cur_point.next is not None:
-         cur_point = cur_point.next
-         cur_point.prev.delete()
-      # Deserialize the last point.
-      cur_point.deserialize(input[-1])
-      # Re-draw curve.
-      self.drawCurveLines()
+      self.clearSelection()
+      self.model.deserialize(input)
+      self.invalidate('view')
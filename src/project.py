@@ -0,0 +1,147 @@
+
+import json, math, struct, sys
+from array import array
+
+# Project file starts with the magic and the format version, followed by sections.
+# Each section has a 4 byte tag and a 64-bit length of its payload. Sections with
+# unknown tags are skipped, so that older versions can read newer files.
+MAGIC          = b'WFEP'
+FORMAT_VERSION = 1
+HEADER         = struct.Struct('<4sH')
+SECTION        = struct.Struct('<4sQ')
+CURVE_HEADER   = struct.Struct('<I')
+
+# Sections.
+SPEC_TAG   = b'SPEC' # Sound specification (UTF-8 JSON) with curves replaced by their indices.
+CURVES_TAG = b'CURV' # Curves, each as a count of control points followed by their coordinates.
+RENDER_TAG = b'REND' # Rendered sound, as its content hash followed by the WAV data.
+
+# Values with these keys are curves, which are stored as arrays of 64-bit floats.
+CURVE_KEYS = ('Frequency', 'Amplitude', 'Curve', 'Spectrum', 'End spectrum')
+CURVE_REF  = 'Curve #'
+RENDER_KEY_LENGTH = 64
+
+#===============================================================================
+def isProjectFile(f):
+   # Checks the magic without moving within the file.
+   pos = f.tell()
+   magic = f.read(len(MAGIC))
+   f.seek(pos)
+   return magic == MAGIC
+
+#===============================================================================
+def extractCurves(value, curves):
+   # Returns the value with curves replaced by references to the list of curves.
+   if isinstance(value, dict):
+      out = {}
+      for key,item in value.items():
+         if (key in CURVE_KEYS) and isinstance(item, (list, tuple)):
+            out[key] = {CURVE_REF: len(curves)}
+            curves.append(item)
+         else:
+            out[key] = extractCurves(item, curves)
+      return out
+   elif isinstance(value, (list, tuple)):
+      return [extractCurves(item, curves) for item in value]
+   else:
+      return value
+
+#===============================================================================
+def insertCurves(value, curves):
+   if isinstance(value, dict):
+      if CURVE_REF in value:
+         return curves[value[CURVE_REF]]
+      return {key: insertCurves(item, curves) for key,item in value.items()}
+   elif isinstance(value, list):
+      return [insertCurves(item, curves) for item in value]
+   else:
+      return value
+
+#===============================================================================
+def encodeCurve(curve):
+   # Left curve point, control point and right curve point of each control point, NaN if missing.
+   nan = float('nan')
+   coords = array('d')
+   for item in curve:
+      for point in item:
+         coords.extend(point if (point is not None) else (nan, nan))
+   if sys.byteorder != 'little':
+      coords.byteswap()
+   return CURVE_HEADER.pack(len(curve)) + coords.tobytes()
+
+#===============================================================================
+def readCurve(f):
+   # Returns the curve and the number of bytes read.
+   count, = CURVE_HEADER.unpack(f.read(CURVE_HEADER.size))
+   coords = array('d')
+   coords.frombytes(f.read(count*6*coords.itemsize))
+   if sys.byteorder != 'little':
+      coords.byteswap()
+   curve = tuple(
+      tuple(
+         (None if math.isnan(coords[ix*6+kind*2]) else (coords[ix*6+kind*2], coords[ix*6+kind*2+1]))
+         for kind in range(3))
+      for ix in range(count))
+   return (curve, CURVE_HEADER.size + count*6*coords.itemsize)
+
+#===============================================================================
+def writeSection(f, tag, *parts):
+   f.write(SECTION.pack(tag, sum(memoryview(part).nbytes for part in parts)))
+   for part in parts:
+      f.write(part)
+
+#===============================================================================
+def write(f, input, renders = ()):
+   # Renders are pairs of a content hash and WAV data. Sections are written one by one,
+   # so that large renders are not copied into a single buffer.
+   curves = []
+   spec = extractCurves(input, curves)
+   f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+   writeSection(f, SPEC_TAG, json.dumps(spec).encode('utf-8'))
+   writeSection(f, CURVES_TAG, *[encodeCurve(curve) for curve in curves])
+   for key,data in renders:
+      writeSection(f, RENDER_TAG, key.encode('ascii'), data)
+
+#===============================================================================
+def read(f):
+   # Returns the sound specification and the list of renders, as their content hash, offset and length within the file.
+   # Renders are not read, so that only the one which is used is loaded by readRender().
+   magic, version = HEADER.unpack(f.read(HEADER.size))
+   if magic != MAGIC:
+      raise ValueError('Not a project file')
+   if version > FORMAT_VERSION:
+      raise ValueError('Unsupported project file version {}'.format(version))
+   spec = None
+   curves = []
+   renders = []
+   while True:
+      header = f.read(SECTION.size)
+      if len(header) < SECTION.size:
+         break
+      tag, length = SECTION.unpack(header)
+      if tag == SPEC_TAG:
+         spec = json.loads(f.read(length).decode('utf-8'))
+      elif tag == CURVES_TAG:
+         pos = 0
+         while pos < length:
+            curve, size = readCurve(f)
+            curves.append(curve)
+            pos += size
+      elif tag == RENDER_TAG:
+         key = f.read(RENDER_KEY_LENGTH).decode('ascii')
+         renders.append((key, f.tell(), length - RENDER_KEY_LENGTH))
+         f.seek(length - RENDER_KEY_LENGTH, 1)
+      else:
+         f.seek(length, 1)
+   if spec is None:
+      raise ValueError('Project file has no specification')
+   return (insertCurves(spec, curves), renders)
+
+#===============================================================================
+def readRender(f, offset, length):
+   # Returns WAV data of a render listed by read().
+   f.seek(offset)
+   data = f.read(length)
+   if len(data) < length:
+      raise ValueError('Project file is truncated')
+   return data
@@ -0,0 +1,100 @@
+
+from array import array
+
+# Number of blocks of the lower level merged into one block of the next level.
+PYRAMID_FACTOR = 4
+
+#===============================================================================
+# Finds the range of elements which differ between two arrays of the same type and length.
+def findChangedSpan(old, new):
+   old_bytes = memoryview(old).cast('B')
+   new_bytes = memoryview(new).cast('B')
+   item_size = old.itemsize
+   count = len(old)
+   # Binary search for the length of the common prefix and suffix.
+   # Comparison of byte views is done by memcmp.
+   left, right = 0, count
+   while left < right:
+      mid = (left + right + 1) // 2
+      if old_bytes[:mid*item_size] == new_bytes[:mid*item_size]:
+         left = mid
+      else:
+         right = mid - 1
+   start = left
+   left, right = 0, count - start
+   while left < right:
+      mid = (left + right + 1) // 2
+      if old_bytes[(count-mid)*item_size:] == new_bytes[(count-mid)*item_size:]:
+         left = mid
+      else:
+         right = mid - 1
+   stop = count - left
+   return (start, stop)
+
+#===============================================================================
+class MinMaxPyramid:
+
+   def __init__(self, samples = None):
+      # Level 0 holds the samples, each following level holds minimum and maximum values
+      # of blocks of PYRAMID_FACTOR elements of the previous level.
+      self.samples = samples if (samples is not None) else array('h')
+      self.mins = [self.samples]
+      self.maxs = [self.samples]
+      level_length = len(self.samples)
+      while level_length > 1:
+         level_length = -(-level_length // PYRAMID_FACTOR)
+         self.mins.append(array(self.samples.typecode, bytes(level_length * self.samples.itemsize)))
+         self.maxs.append(array(self.samples.typecode, bytes(level_length * self.samples.itemsize)))
+      self.calculateLevels(0, len(self.samples))
+
+   def __len__(self):
+      return len(self.samples)
+
+   def calculateLevels(self, start, stop):
+      # Recalculate blocks of all levels which cover samples in range [start, stop).
+      for level in range(1, len(self.mins)):
+         start = start // PYRAMID_FACTOR
+         stop = -(-stop // PYRAMID_FACTOR)
+         lower_mins = self.mins[level-1]
+         lower_maxs = self.maxs[level-1]
+         mins = self.mins[level]
+         maxs = self.maxs[level]
+         for ix in range(start, stop):
+            mins[ix] = min(lower_mins[ix*PYRAMID_FACTOR:(ix+1)*PYRAMID_FACTOR])
+            maxs[ix] = max(lower_maxs[ix*PYRAMID_FACTOR:(ix+1)*PYRAMID_FACTOR])
+
+   def updated(self, samples):
+      # Returns a pyramid for the new samples. This pyramid is not modified,
+      # so that it can be still used by other threads.
+      if (len(samples) != len(self.samples)) or (samples.typecode != self.samples.typecode):
+         return MinMaxPyramid(samples)
+      start, stop = findChangedSpan(self.samples, samples)
+      pyramid = MinMaxPyramid.__new__(MinMaxPyramid)
+      pyramid.samples = samples
+      pyramid.mins = [samples] + [array(a.typecode, a) for a in self.mins[1:]]
+      pyramid.maxs = [samples] + [array(a.typecode, a) for a in self.maxs[1:]]
+      # Only blocks covering the changed samples are recalculated.
+      if start < stop:
+         pyramid.calculateLevels(start, stop)
+      return pyramid
+
+   def getSamples(self, start, stop):
+      return self.samples[start:stop]
+
+   def getMinMax(self, start, stop, count):
+      # Minimum and maximum values for each of "count" equal parts of the samples in range [start, stop).
+      # The level is selected so that only a few blocks need to be merged for each part.
+      samples_per_part = (stop - start) / count
+      level = 0
+      block_size = 1
+      while (level+1 < len(self.mins)) and (block_size * PYRAMID_FACTOR <= samples_per_part):
+         level += 1
+         block_size *= PYRAMID_FACTOR
+      mins = self.mins[level]
+      maxs = self.maxs[level]
+      out = []
+      for part in range(count):
+         ix0 = int((start + part * samples_per_part) // block_size)
+         ix1 = max(int(-(-(start + (part+1) * samples_per_part) // block_size)), ix0+1)
+         out.append((min(mins[ix0:ix1]), max(maxs[ix0:ix1])))
+      return out
@@ -0,0 +1,75 @@
+
+import functools, math, operator
+
+# Pass band of the low-pass filter, relative to the lower of both Nyquist frequencies.
+CUTOFF = 0.9
+# Number of zero crossings of the windowed sinc on each side, at the cutoff frequency.
+ZERO_CROSSINGS = 16
+# Number of filter banks kept, one for each pair of sampling rates.
+FILTER_CACHE_SIZE = 16
+
+#===============================================================================
+@functools.lru_cache(maxsize = FILTER_CACHE_SIZE)
+def getFilterBank(up, down):
+   # Sampling rate changes by the ratio up/down. Output sample falls between two input samples
+   # at one of "up" fractional positions, each of them has its own set of filter taps (polyphase filter).
+   # Taps are the windowed sinc at distances of the input samples from the output sample.
+   scale = min(1.0, up / down) * CUTOFF
+   half = math.ceil(ZERO_CROSSINGS / scale)
+   bank = []
+   for phase in range(up):
+      fraction = phase / up
+      taps = []
+      for ix in range(2 * half):
+         distance = fraction + (half - 1 - ix)
+         u = distance / half
+         # Blackman window.
+         window = 0.42 + 0.5 * math.cos(math.pi * u) + 0.08 * math.cos(2.0*math.pi * u)
+         x = math.pi * scale * distance
+         taps.append(scale * (math.sin(x) / x if (x != 0.0) else 1.0) * window)
+      # Gain of each phase is 1, so that there is no ripple of a constant signal.
+      total = sum(taps)
+      bank.append(tuple(tap / total for tap in taps))
+   return bank
+
+#===============================================================================
+class Resampler:
+
+   def __init__(self, source_rate_hz, target_rate_hz, num_samples):
+      # Converts samples given block by block into the given number of samples at the target rate.
+      # Samples before the start and after the end of the input are zero.
+      divisor = math.gcd(source_rate_hz, target_rate_hz)
+      self.up = target_rate_hz // divisor
+      self.down = source_rate_hz // divisor
+      self.bank = getFilterBank(self.up, self.down)
+      self.half = len(self.bank[0]) // 2
+      self.num_samples = num_samples
+      # Input samples which are still needed, and the index of the first one.
+      self.buffer = [0.0] * self.half
+      self.buffer_start = -self.half
+      # Index of the next output sample.
+      self.next_ix = 0
+
+   def process(self, samples, final = False):
+      # Returns list of output samples which can be calculated from the input so far,
+      # or all remaining output samples if the input is final.
+      self.buffer += samples
+      if final:
+         last_input = ((self.num_samples - 1) * self.down) // self.up + self.half + 1
+         self.buffer += [0.0] * max(last_input - self.buffer_start - len(self.buffer), 0)
+      output = []
+      mul = operator.mul
+      while self.next_ix < self.num_samples:
+         input_ix, phase = divmod(self.next_ix * self.down, self.up)
+         first = input_ix - self.half + 1 - self.buffer_start
+         if first + 2 * self.half > len(self.buffer):
+            break
+         output.append(sum(map(mul, self.bank[phase], self.buffer[first:first + 2 * self.half])))
+         self.next_ix += 1
+      # Input before the first one used by the next output sample is dropped.
+      input_ix = (self.next_ix * self.down) // self.up
+      drop = min(input_ix - self.half + 1 - self.buffer_start, len(self.buffer))
+      if drop > 0:
+         del self.buffer[:drop]
+         self.buffer_start += drop
+      return output
@@ -0,0 +1,354 @@
+
+from src import cache, wavegen
+
+import argparse, getpass, os, secrets, socket, subprocess, sys, threading, time
+from multiprocessing import connection, resource_tracker, shared_memory
+from array import array
+
+# Minimum interval between progress events of one request.
+PROGRESS_INTERVAL_S = 0.1
+# Time to wait for a started server to accept connections.
+START_TIMEOUT_S = 10.0
+START_POLL_S = 0.05
+
+#===============================================================================
+def getAddress(program_name):
+   # Named pipe on Windows, Unix domain socket in the cache directory elsewhere.
+   name = program_name.replace(' ', '-').lower()
+   if sys.platform == 'win32':
+      return r'\\.\pipe\{}-{}'.format(name, getpass.getuser())
+   return os.path.join(cache.getDefaultPath(program_name), 'server.sock')
+
+#===============================================================================
+def getKeyPath(program_name):
+   # Key authenticating the clients, readable only by the user.
+   return os.path.join(cache.getDefaultPath(program_name), 'server.key')
+
+#===============================================================================
+def isServing(address):
+   # Whether a server accepts connections on the Unix domain socket. Socket left by a server
+   # which has not exited properly refuses them. Named pipe in use cannot be bound again, so it is not checked.
+   if sys.platform == 'win32':
+      return False
+   with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+      try:
+         s.connect(address)
+      except (ConnectionRefusedError, FileNotFoundError):
+         return False
+   return True
+
+#===============================================================================
+def openBlock(name):
+   # Blocks of shared memory are owned by the server, they must not be removed
+   # by the resource tracker of the client process.
+   try:
+      return shared_memory.SharedMemory(name, track = False)
+   except TypeError:
+      block = shared_memory.SharedMemory(name)
+      if os.name == 'posix':
+         resource_tracker.unregister(block._name, 'shared_memory')
+      return block
+
+#===============================================================================
+class Server:
+
+   def __init__(self, program_name, disk_cache_max_bytes, memory_cache_max_bytes, process_count):
+      path = cache.getDefaultPath(program_name)
+      os.makedirs(path, exist_ok = True)
+      self.address = getAddress(program_name)
+      # Only the socket of a server which has not exited properly is removed, not one of a running server.
+      if (sys.platform != 'win32') and os.path.exists(self.address):
+         if isServing(self.address):
+            raise OSError('Server is already running at {}'.format(self.address))
+         os.remove(self.address)
+      # New key is generated for each run of the server. It is written only after the listener is bound,
+      # so that a server which fails to start does not replace the key of the running one.
+      self.authkey = secrets.token_bytes(32)
+      self.listener = connection.Listener(self.address, authkey = self.authkey)
+      key_path = getKeyPath(program_name)
+      temp_path = '{}.{}.tmp'.format(key_path, os.getpid())
+      fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+      with os.fdopen(fd, 'wb') as f:
+         f.write(self.authkey)
+      os.replace(temp_path, key_path)
+      self.lock = threading.Lock()
+      # Connections of clients with the locks of sending to them, keyed by client ID.
+      self.clients = {}
+      self.next_client_id = 0
+      # Blocks of shared memory with rendered samples, which are not released by clients yet.
+      self.blocks = {}
+      # Time of the last progress event of each request.
+      self.progress_times = {}
+      self.running = True
+      # Samples of waves are cached in memory for all clients.
+      self.memory_cache = cache.MemoryCache(memory_cache_max_bytes)
+      # Requests of all clients are processed by one wave generator, with request IDs prefixed by client ID.
+      # Client is the owner of its requests, so that they do not replace requests of other clients.
+      self.wavegen_thread = wavegen.Thread(
+         callback      = self.onEvent,
+         disk_cache    = cache.DiskCache(os.path.join(path, 'renders'), disk_cache_max_bytes),
+         memory_cache  = self.memory_cache,
+         process_count = process_count,
+         get_owner     = lambda request_id: request_id[0])
+
+   def serve(self):
+      # Each client is served by its own thread. Server exits when the last client disconnects.
+      while self.running:
+         try:
+            conn = self.listener.accept()
+         except (OSError, EOFError, connection.AuthenticationError):
+            continue
+         with self.lock:
+            if not self.running:
+               conn.close()
+               break
+            client_id = self.next_client_id
+            self.next_client_id += 1
+            self.clients[client_id] = (conn, threading.Lock())
+         threading.Thread(target = self.clientThread, args = (client_id, conn), daemon = True).start()
+      self.listener.close()
+      self.wavegen_thread.thread.join()
+      with self.lock:
+         for block in self.blocks.values():
+            self.releaseBlock(block)
+         self.blocks.clear()
+
+   def shutdown(self):
+      with self.lock:
+         if not self.running:
+            return
+         self.running = False
+      self.wavegen_thread.quit()
+      # Listener is woken up by a connection of its own.
+      try:
+         connection.Client(self.address, authkey = self.authkey).close()
+      except OSError:
+         pass
+
+   def clientThread(self, client_id, conn):
+      try:
+         while True:
+            if not self.onMessage(client_id, conn.recv()):
+               break
+      except (OSError, EOFError):
+         pass
+      # Unfinished requests of a disconnected client are cancelled, and its sound is stopped.
+      for request_id in self.wavegen_thread.getPendingRequests():
+         if request_id[0] == client_id:
+            self.wavegen_thread.cancel(request_id)
+      self.wavegen_thread.stop((client_id, None))
+      with self.lock:
+         conn, send_lock = self.clients.pop(client_id)
+         for name,(owner_id, block) in list(self.blocks.items()):
+            if owner_id == client_id:
+               self.releaseBlock(block)
+               del self.blocks[name]
+         is_last = (len(self.clients) == 0)
+      with send_lock:
+         conn.close()
+      if is_last:
+         self.shutdown()
+
+   def onMessage(self, client_id, msg):
+      # Returns False when the client should be disconnected.
+      cmd, request_id, args = msg[0], (client_id, msg[1]), msg[2:]
+      if cmd == 'PLAY':
+         self.wavegen_thread.play(request_id, *args)
+      elif cmd == 'PREVIEW':
+         self.wavegen_thread.preview(request_id, *args)
+      elif cmd == 'SPECULATE':
+         self.wavegen_thread.speculate(request_id, *args)
+      elif cmd == 'STOP':
+         self.wavegen_thread.stop(request_id)
+      elif cmd == 'PREPARE':
+         self.wavegen_thread.prepare(request_id, *args)
+      elif cmd == 'WRITE':
+         self.wavegen_thread.write(request_id, (client_id, args[0]), args[1])
+      elif cmd == 'DROP':
+         self.wavegen_thread.drop(request_id, (client_id, args[0]))
+      elif cmd == 'EXPORT':
+         self.wavegen_thread.export(request_id, *args)
+      # CANCEL message: Cancel the request with the given ID.
+      elif cmd == 'CANCEL':
+         self.wavegen_thread.cancel(request_id)
+      # RELEASE message: Client does not use the block with rendered samples anymore.
+      elif cmd == 'RELEASE':
+         with self.lock:
+            owner_id, block = self.blocks.pop(args[0], (None, None))
+            if block is not None:
+               self.releaseBlock(block)
+      # STATS message: Statistics of the memory cache, which are sent back at once.
+      elif cmd == 'STATS':
+         self.send(client_id, ('STATS', msg[1], self.memory_cache.getStats()))
+      # CLOSE message: Client disconnects.
+      elif cmd == 'CLOSE':
+         return False
+      # QUIT message: Stop the server for all clients.
+      elif cmd == 'QUIT':
+         self.shutdown()
+         return False
+      else:
+         self.send(client_id, ('ERROR', msg[1], 'Unknown command {}'.format(cmd)))
+      return True
+
+   def onEvent(self, event, request_id, *args):
+      client_id, client_request_id = request_id
+      if event == 'PROGRESS':
+         now = time.perf_counter()
+         if now - self.progress_times.get(request_id, 0.0) < PROGRESS_INTERVAL_S:
+            return
+         self.progress_times[request_id] = now
+      elif event == 'RENDER':
+         # Samples (16-bit, little endian) are passed in a block of shared memory, which is kept until released by the client.
+         wav = args[0]
+         data = memoryview(wav.buffer).cast('B')[wavegen.WAV_HEADER.size:]
+         block = shared_memory.SharedMemory(create = True, size = max(len(data), 1))
+         block.buf[:len(data)] = data
+         with self.lock:
+            self.blocks[block.name] = (client_id, block)
+         args = (block.name, len(data) // 2, wav.sound_info.sampling_rate_hz)
+      else:
+         self.progress_times.pop(request_id, None)
+      if not self.send(client_id, (event, client_request_id) + args) and (event == 'RENDER'):
+         with self.lock:
+            owner_id, block = self.blocks.pop(args[0], (None, None))
+            if block is not None:
+               self.releaseBlock(block)
+
+   def send(self, client_id, msg):
+      # Returns False if the client is not connected anymore.
+      # Slow client blocks only the sending to itself, not the other clients.
+      with self.lock:
+         conn, send_lock = self.clients.get(client_id, (None, None))
+      if conn is None:
+         return False
+      with send_lock:
+         try:
+            conn.send(msg)
+         except OSError:
+            return False
+      return True
+
+   def releaseBlock(self, block):
+      block.close()
+      block.unlink()
+
+#===============================================================================
+class Client:
+
+   def __init__(self, address, authkey, callback = None):
+      # Callback is called from the receiving thread with events of requests (see wavegen.Thread),
+      # RENDER events carry the 16-bit samples and the sampling rate.
+      self.callback = callback
+      self.connection = connection.Client(address, authkey = authkey)
+      self.lock = threading.Lock()
+      self.next_request_id = 0
+      self.thread = threading.Thread(target = self.receiveThread, daemon = True)
+      self.thread.start()
+
+   def close(self):
+      # Server closes its end of the connection, which ends the receiving thread.
+      self.post(('CLOSE', None))
+      self.thread.join()
+      self.connection.close()
+
+   def post(self, msg):
+      with self.lock:
+         self.connection.send(msg)
+
+   def request(self, cmd, *args):
+      # Returns ID of the request, which is passed back with its events.
+      with self.lock:
+         self.next_request_id += 1
+         request_id = self.next_request_id
+         self.connection.send((cmd, request_id) + args)
+      return request_id
+
+   def play(self, params):
+      return self.request('PLAY', params)
+
+   def preview(self, params, budget_s):
+      return self.request('PREVIEW', params, budget_s)
+
+   def speculate(self, params):
+      return self.request('SPECULATE', params)
+
+   def stop(self):
+      return self.request('STOP')
+
+   def prepare(self, params):
+      return self.request('PREPARE', params)
+
+   def write(self, prepare_id, path):
+      return self.request('WRITE', prepare_id, path)
+
+   def drop(self, prepare_id):
+      return self.request('DROP', prepare_id)
+
+   def export(self, params, outputs):
+      return self.request('EXPORT', params, outputs)
+
+   def stats(self):
+      # Statistics are passed to the callback with the STATS event.
+      return self.request('STATS')
+
+   def cancel(self, request_id):
+      self.post(('CANCEL', request_id))
+
+   def quit(self):
+      self.post(('QUIT', None))
+
+   def receiveThread(self):
+      while True:
+         try:
+            event = self.connection.recv()
+         except (OSError, EOFError):
+            return
+         if event[0] == 'RENDER':
+            name, count, sampling_rate_hz = event[2:]
+            block = openBlock(name)
+            samples = array('h')
+            samples.frombytes(block.buf[:count*2])
+            block.close()
+            self.post(('RELEASE', None, name))
+            # Samples are passed in little endian byte order.
+            if sys.byteorder != 'little':
+               samples.byteswap()
+            event = (event[0], event[1], samples, sampling_rate_hz)
+         if self.callback is not None:
+            self.callback(*event)
+
+#===============================================================================
+def connect(program_name, callback = None, server_args = None):
+   # Connects to the running server. If it is not running and its arguments are given
+   # (disk cache size, memory cache size, process count), the server is started in its own process,
+   # which keeps running while there are connected clients.
+   try:
+      with open(getKeyPath(program_name), 'rb') as f:
+         return Client(getAddress(program_name), f.read(), callback)
+   except (OSError, EOFError, connection.AuthenticationError):
+      if server_args is None:
+         raise
+   root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+   subprocess.Popen(
+      [sys.executable, '-m', 'src.server', program_name] + [str(arg) for arg in server_args],
+      cwd = root, creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+   started = time.perf_counter()
+   while True:
+      time.sleep(START_POLL_S)
+      try:
+         with open(getKeyPath(program_name), 'rb') as f:
+            return Client(getAddress(program_name), f.read(), callback)
+      except (OSError, EOFError, connection.AuthenticationError):
+         if time.perf_counter() - started > START_TIMEOUT_S:
+            raise
+
+#===============================================================================
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description = 'Render server of the waveform editor.')
+   parser.add_argument('program_name')
+   parser.add_argument('disk_cache_max_bytes', type = int)
+   parser.add_argument('memory_cache_max_bytes', type = int)
+   parser.add_argument('process_count', type = int)
+   args = parser.parse_args()
+   Server(args.program_name, args.disk_cache_max_bytes, args.memory_cache_max_bytes, args.process_count).serve()
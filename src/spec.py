@@ -0,0 +1,46 @@
+
+import hashlib
+
+# Sound specifications (as returned by serialize()) are frozen into nested tuples,
+# so that they can be shared between snapshots, compared cheaply and used as keys.
+
+#===============================================================================
+class FrozenDict(tuple):
+   # Items of a dictionary sorted by key.
+   pass
+
+#===============================================================================
+def freeze(value):
+   if isinstance(value, dict):
+      return FrozenDict(sorted((key, freeze(item)) for key,item in value.items()))
+   elif isinstance(value, (list, tuple)):
+      return tuple(freeze(item) for item in value)
+   else:
+      return value
+
+#===============================================================================
+def thaw(value):
+   if isinstance(value, FrozenDict):
+      return {key: thaw(item) for key,item in value}
+   elif isinstance(value, tuple):
+      return tuple(thaw(item) for item in value)
+   else:
+      return value
+
+#===============================================================================
+def canonical(value):
+   # Like freeze(), but numbers are converted to floats, so that equal values
+   # have the same representation whether or not they were stored as integers.
+   if isinstance(value, dict):
+      return FrozenDict(sorted((key, canonical(item)) for key,item in value.items()))
+   elif isinstance(value, (list, tuple)):
+      return tuple(canonical(item) for item in value)
+   elif isinstance(value, int) and not isinstance(value, bool):
+      return float(value)
+   else:
+      return value
+
+#===============================================================================
+def contentHash(value):
+   # Unlike hash(), the result is the same in every session.
+   return hashlib.sha256(repr(canonical(value)).encode('utf-8')).hexdigest()
@@ -0,0 +1,208 @@
+
+from src import fft, plot, pyramid
+
+import math, threading
+import tkinter as tk
+import tkinter.ttk as ttk
+from array import array
+
+WINDOW_SIZE = 1024
+HOP_SIZE    = 256
+RANGE_DB    = 90.0
+COLOR_LEVELS = 64
+
+# Colors from silence (background) to full scale.
+COLOR_MAP = tuple(
+   '#{:02x}{:02x}{:02x}'.format(
+      round(255 * (1.0 - level)),
+      round(255 * (1.0 - level)**2),
+      round(255 * (1.0 - level * 0.6)))
+   for level in (i / (COLOR_LEVELS-1) for i in range(COLOR_LEVELS)))
+
+#===============================================================================
+class Spectrum:
+
+   def __init__(self, num_samples, sampling_rate_hz, window_size, hop_size, columns):
+      self.num_samples = num_samples
+      self.sampling_rate_hz = sampling_rate_hz
+      self.window_size = window_size
+      self.hop_size = hop_size
+      # One column per frame, each with levels (in dB) of frequency bins [0, window_size/2].
+      self.columns = columns
+
+#===============================================================================
+class Analysis:
+
+   def __init__(self, window_size, hop_size):
+      self.setParams(window_size, hop_size)
+      self.samples = None
+      self.columns = []
+
+   def setParams(self, window_size, hop_size):
+      self.window_size = window_size
+      self.hop_size = hop_size
+      self.fft = fft.FFT(window_size)
+      # Hann window, scaled so that a full scale sine (of 16-bit samples) gives 0 dB.
+      scale = 4.0 / (window_size * plot.OVERLAY_MAX_VALUE)
+      self.window = [0.5 * (1.0 - math.cos(2.0*math.pi*i/window_size)) * scale for i in range(window_size)]
+      self.columns = []
+
+   def calculateColumn(self, samples, frame):
+      start = frame * self.hop_size
+      values = samples[start:start+self.window_size]
+      values = [v * w for v,w in zip(values, self.window)]
+      values += [0.0] * (self.window_size - len(values))
+      spectrum = self.fft.transform(values)
+      floor = 10.0**(-RANGE_DB / 20.0)
+      return array('f', [20.0 * math.log10(max(abs(v), floor)) for v in spectrum[:self.window_size//2+1]])
+
+   def update(self, samples, sampling_rate_hz, is_cancelled):
+      frame_count = -(-len(samples) // self.hop_size)
+      # Only frames whose samples have changed are calculated again.
+      if (self.samples is None) or (len(self.samples) != len(samples)) or (len(self.columns) != frame_count):
+         frames = range(frame_count)
+         columns = [None] * frame_count
+      else:
+         start, stop = pyramid.findChangedSpan(self.samples, samples)
+         first = max(-(-(start - self.window_size + 1) // self.hop_size), 0)
+         last = min((stop - 1) // self.hop_size, frame_count - 1)
+         frames = range(first, last+1) if (start < stop) else range(0)
+         columns = self.columns[:]
+      for frame in frames:
+         # Analysis is abandoned when there is a newer request.
+         if is_cancelled():
+            return None
+         columns[frame] = self.calculateColumn(samples, frame)
+      self.samples = samples
+      self.columns = columns
+      return Spectrum(len(samples), sampling_rate_hz, self.window_size, self.hop_size, columns)
+
+#===============================================================================
+class AnalysisThread:
+
+   def __init__(self, window_size, hop_size, callback):
+      # Callback is called from the analysis thread with each calculated spectrum.
+      self.callback = callback
+      self.analysis = Analysis(window_size, hop_size)
+      self.condition = threading.Condition()
+      self.request = None
+      self.thread = threading.Thread(target = self.analysisThread)
+      self.thread.start()
+
+   def setRequest(self, request):
+      # Newer request replaces the one which is not processed yet.
+      with self.condition:
+         self.request = request
+         self.condition.notify()
+
+   def quit(self):
+      self.setRequest(('QUIT',))
+
+   def analyze(self, samples, sampling_rate_hz):
+      self.setRequest(('ANALYZE', samples, sampling_rate_hz))
+
+   def setParams(self, window_size, hop_size):
+      self.setRequest(('PARAMS', window_size, hop_size))
+
+   def isCancelled(self):
+      return self.request is not None
+
+   def analysisThread(self):
+      last = None
+      while True:
+         with self.condition:
+            while self.request is None:
+               self.condition.wait()
+            cmd = self.request
+            self.request = None
+         if cmd[0] == 'QUIT':
+            return
+         elif cmd[0] == 'PARAMS':
+            self.analysis.setParams(cmd[1], cmd[2])
+            # Analyze the last samples again with the new parameters.
+            if last is not None:
+               self.setRequest(last)
+         elif cmd[0] == 'ANALYZE':
+            last = cmd
+            spectrum = self.analysis.update(cmd[1], cmd[2], self.isCancelled)
+            if spectrum is not None:
+               self.callback(spectrum)
+
+#===============================================================================
+class Panel:
+
+   def __init__(self, tk_parent, width, height, y_axis, scheduler):
+      self.width = width
+      self.height = height
+      self.y_axis = y_axis
+      self.scheduler = scheduler
+      self.spectrum = None
+      self.x_range = [0.0, 1.0]
+      # Frame.
+      self.frame = ttk.Frame(tk_parent)
+      self.frame.columnconfigure(0, weight = 1)
+      self.frame.rowconfigure(0, weight = 1)
+      # Canvas with a single image.
+      self.canvas = tk.Canvas(self.frame, width = width, height = height, background = plot.COLOR_BACKGROUND)
+      self.canvas.grid(sticky = 'NSEW')
+      self.canvas.bind('<Configure>', self.onResize)
+      self.image = tk.PhotoImage(width = width, height = height)
+      self.image_id = self.canvas.create_image(0, 0, anchor = 'nw', image = self.image)
+      # Redraw when the frequency axis is changed.
+      self.y_axis.registerCallback(self.invalidate)
+
+   def grid(self, **kwargs):
+      self.frame.grid(**kwargs)
+
+   def onResize(self, event):
+      self.width = event.width
+      self.height = event.height
+      self.invalidate()
+
+   def setView(self, x_range, y_range):
+      if x_range is not None:
+         self.x_range = list(x_range)
+         self.invalidate()
+
+   def setSpectrum(self, spectrum):
+      self.spectrum = spectrum
+      self.invalidate()
+
+   def invalidate(self):
+      self.scheduler.schedule(self.redraw)
+
+   def redraw(self):
+      if (self.image.width() != self.width) or (self.image.height() != self.height):
+         self.image = tk.PhotoImage(width = self.width, height = self.height)
+         self.canvas.itemconfig(self.image_id, image = self.image)
+      spectrum = self.spectrum
+      if (spectrum is None) or (len(spectrum.columns) == 0) or (self.width <= 2*plot.X_MARGIN_PX):
+         self.image.blank()
+         return
+      # Frequency bin for each row of the image (None above the Nyquist frequency).
+      bin_count = spectrum.window_size // 2 + 1
+      rows = []
+      for row in range(self.height):
+         frequency_hz = self.y_axis.convertTo(1.0 - (row + 0.5) / self.height)
+         ix = round(frequency_hz * spectrum.window_size / spectrum.sampling_rate_hz)
+         rows.append(ix if (ix < bin_count) else None)
+      # Column of the spectrum for each column of the image, X axis is aligned with the plots.
+      columns = []
+      for px in range(self.width):
+         x = (px - plot.X_MARGIN_PX) / (self.width - 2*plot.X_MARGIN_PX)
+         x = x * (self.x_range[1] - self.x_range[0]) + self.x_range[0]
+         sample = x * (spectrum.num_samples - 1) - spectrum.window_size / 2
+         frame = round(sample / spectrum.hop_size)
+         columns.append(spectrum.columns[frame] if (0.0 <= x <= 1.0 and 0 <= frame < len(spectrum.columns)) else None)
+      # Build the whole image at once, row by row.
+      background = COLOR_MAP[0]
+      scale = (COLOR_LEVELS - 1) / RANGE_DB
+      data = []
+      for ix in rows:
+         if ix is None:
+            data.append('{' + ' '.join([background] * self.width) + '}')
+         else:
+            data.append('{' + ' '.join(
+               (COLOR_MAP[min(max(int((column[ix] + RANGE_DB) * scale), 0), COLOR_LEVELS-1)] if (column is not None) else background)
+               for column in columns) + '}')
+      self.image.put(' '.join(data), to = (0, 0))
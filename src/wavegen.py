@@ -1,10 +1,81 @@
 
-from src import axis
+from src import axis, harmonics, noise, resample, spec
 
-import ctypes, math, random, threading, winsound
+import bisect, collections, ctypes, math, mmap, multiprocessing, os, struct, sys, tempfile, threading, time, winsound
+from multiprocessing import shared_memory
+from array import array
 
 POINTS_PER_CURVE = 100
 
+# Must be increased whenever generated samples change, so that outdated entries of the disk cache are not used.
+GENERATOR_VERSION = 8
+
+# Type of arrays holding samples and envelopes of waves ('f' for 32-bit, 'd' for 64-bit floats).
+SAMPLE_TYPECODE = 'f'
+
+# Previews are rendered at the sampling rate divided by one of these divisors,
+# but not below the minimum rate.
+PREVIEW_RATE_DIVISORS = (1, 2, 3, 4, 6, 8)
+PREVIEW_MIN_RATE_HZ   = 4000
+# Weight of the last measurement in the estimated cost of rendering a sample.
+COST_SMOOTHING = 0.3
+# Number of rendered sounds kept, so that returning to a previous state (e.g. by undo) does not render it again.
+RENDER_CACHE_SIZE = 8
+# Number of samples calculated between checks whether the rendering is cancelled.
+CANCEL_CHECK_SAMPLES = 4096
+# Interval of checks whether the rendering is cancelled while waiting for the render pool.
+POOL_POLL_S = 0.01
+# Renders with fewer samples (of all changed waves) are not worth sending to the render pool.
+POOL_MIN_SAMPLES = 100000
+# Sounds with more samples are not rendered into memory, but streamed in blocks of the given size.
+STREAM_MIN_SAMPLES = 1 << 20
+STREAM_BLOCK_SAMPLES = 1 << 16
+
+# Waves with constant frequency and amplitude are rendered as one period of at most the given number
+# of samples, which is repeated. Period holds a whole number of cycles, its frequency may differ by the given ratio.
+STEADY_MAX_PERIOD_SAMPLES = 1 << 16
+STEADY_MAX_PITCH_ERROR    = 1e-6
+
+# Header of a WAV file with 16-bit mono samples.
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+#===============================================================================
+def packWavHeader(sampling_rate_hz, num_samples):
+   return WAV_HEADER.pack(
+      b'RIFF', (WAV_HEADER.size-8)+num_samples*2, b'WAVE',  # Main chunk: ID, size, RIFF type.
+      b'fmt ', 16,                                         # Format chunk: ID, size.
+      1, 1,                                                # Format code (PCM), number of channels.
+      sampling_rate_hz, sampling_rate_hz*2,                # Samples per second, bytes per second.
+      2, 16,                                               # Bytes per block, bits per sample.
+      b'data', num_samples*2)                              # Data chunk: ID, size.
+
+#===============================================================================
+def mixSamples(all_samples, num_samples):
+   # Returns 16-bit samples (in little endian byte order) of merged samples from different waves.
+   if len(all_samples) > 0:
+      mixed = map(sum, zip(*all_samples))
+   else:
+      mixed = (0.0 for ix in range(num_samples))
+   return quantizeSamples(mixed)
+
+#===============================================================================
+def quantizeSamples(samples):
+   # Convert from [-1,1] to the range of 16-bit signed integer (in little endian byte order) and clip.
+   data = array('h', (min(max(round(32767.0 * value), -32768), 32767) for value in samples))
+   if sys.byteorder != 'little':
+      data.byteswap()
+   return data
+
+#===============================================================================
+class Cancelled(Exception):
+   # Raised when rendering is cancelled before it is finished.
+   pass
+
+#===============================================================================
+# Key of the rendered sound in the disk cache.
+def getRenderKey(input, typecode = SAMPLE_TYPECODE):
+   return spec.contentHash((GENERATOR_VERSION, 'WAV', input, typecode))
+
 #===============================================================================
 class Curve:
 
@@ -81,9 +152,116 @@ class Curve:
 #===============================================================================
 class NullCurve:
 
+   def __init__(self):
+      self.points = [(0.0, 0.0), (1.0, 0.0)]
+
    def forwardGetY(self, x):
       return 0.0
 
+#===============================================================================
+def findFirstSample(x, last_ix):
+   # First sample with X greater than the given one, using the same calculation of X as for the samples.
+   ix = max(int(x * last_ix), 0)
+   while (ix / last_ix) <= x:
+      ix += 1
+   while (ix > 0) and ((ix - 1) / last_ix > x):
+      ix -= 1
+   return ix
+
+#===============================================================================
+def findSilentSpans(amplitude_curve, last_ix):
+   # Returns sorted ranges [start, stop) of samples in which the amplitude curve is at the bottom of the axis (silence).
+   # Samples are interpolated linearly between points of the curve, so a segment is silent if both of its points are.
+   spans = []
+   points = amplitude_curve.points
+   is_first = True
+   for ix in range(len(points)-1):
+      (x1,y1), (x2,y2) = points[ix], points[ix+1]
+      if x2 <= x1:
+         continue
+      if (y1 <= 0.0) and (y2 <= 0.0):
+         # Samples in the segment are those with X in (x1,x2], the first segment also includes X = x1.
+         start = 0 if is_first else findFirstSample(x1, last_ix)
+         stop = findFirstSample(x2, last_ix)
+         if (len(spans) > 0) and (spans[-1][1] >= start):
+            spans[-1] = (spans[-1][0], max(spans[-1][1], stop))
+         elif start < stop:
+            spans.append((start, stop))
+      is_first = False
+   return spans
+
+#===============================================================================
+def findPeriod(increment, max_samples):
+   # Returns number of samples and number of cycles of the shortest period of samples
+   # whose frequency is close enough to the given one (in cycles per sample), or None.
+   for cycles in range(1, int(max_samples * increment) + 1):
+      samples = round(cycles / increment)
+      if samples > max_samples:
+         break
+      if abs(cycles / (samples * increment) - 1.0) <= STEADY_MAX_PITCH_ERROR:
+         return (samples, cycles)
+   return None
+
+#===============================================================================
+def getConstantY(input_curve):
+   # Curve lies within the convex hull of its control points, so it is constant
+   # if all of them are at the same height. Returns the height, or None.
+   ys = [pt[1] for control in input_curve for pt in control if pt is not None]
+   return ys[0] if all((y == ys[0]) for y in ys) else None
+
+#===============================================================================
+class PhaseIndex:
+
+   def __init__(self, frequency_curve, sound_info, initial_phase):
+      # Position within the waveform is known in closed form for every sample, so that any range
+      # of samples can be calculated on its own, with the same result as in a complete render.
+      # Logarithm of frequency is linear within each segment of the curve (the frequency axis is
+      # logarithmic), so phase increments of the samples in the segment form a geometric sequence.
+      frequency_func = sound_info.frequency_axis.convertTo
+      last_ix = sound_info.num_samples - 1.0
+      # For each segment: first sample, phase at the first sample, scale of the sum of phase increments,
+      # and the change of logarithm of frequency per sample.
+      self.starts = []
+      self.phases = []
+      self.scales = []
+      self.log_steps = []
+      phase = initial_phase
+      points = frequency_curve.points
+      for ix in range(len(points)-1):
+         (x1,y1), (x2,y2) = points[ix], points[ix+1]
+         if x2 <= x1:
+            continue
+         # Samples in the segment are those with X in (x1,x2], the first segment also includes X = x1.
+         start = findFirstSample(x1, last_ix) if (len(self.starts) > 0) else 0
+         log_freq1 = math.log(frequency_func(y1))
+         log_freq2 = math.log(frequency_func(y2))
+         log_step = (log_freq2 - log_freq1) / ((x2 - x1) * last_ix)
+         increment = math.exp(log_freq1 + (start - x1 * last_ix) * log_step) / sound_info.sampling_rate_hz
+         self.starts.append(start)
+         self.phases.append(phase)
+         self.scales.append((increment / math.expm1(log_step)) if (log_step != 0.0) else increment)
+         self.log_steps.append(log_step)
+         # Phase at the first sample of the next segment.
+         phase = math.modf(phase + self.getSum(len(self.starts)-1, findFirstSample(x2, last_ix) - start))[0]
+
+   def getSum(self, segment, count):
+      # Sum of phase increments of the first "count" samples of the segment.
+      log_step = self.log_steps[segment]
+      if log_step != 0.0:
+         return self.scales[segment] * math.expm1(count * log_step)
+      else:
+         return self.scales[segment] * count
+
+   def getPhases(self, start, stop):
+      # Yields positions within the waveform of samples in range [start, stop).
+      segment = bisect.bisect_right(self.starts, start) - 1
+      next_start = self.starts[segment+1] if (segment+1 < len(self.starts)) else stop
+      for ix in range(start, stop):
+         while ix >= next_start:
+            segment += 1
+            next_start = self.starts[segment+1] if (segment+1 < len(self.starts)) else stop
+         yield math.modf(self.phases[segment] + self.getSum(segment, ix - self.starts[segment]))[0]
+
 #===============================================================================
 class SoundInfo:
 
@@ -100,32 +278,135 @@ class SoundInfo:
 #===============================================================================
 class Wave:
 
-   def __init__(self):
+   def __init__(self, typecode = SAMPLE_TYPECODE):
+      self.typecode = typecode
       self.input_wave = None
       self.sound_info = None
+      self.sample_range = None
+      self.shared_memory = None
+      # Whether all calculated samples are silent, so that the wave can be left out when mixing.
+      self.silent = False
+
+   def isChanged(self, input_wave, sound_info, sample_range):
+      return (self.input_wave != input_wave) or (self.sound_info.input_sound != sound_info.input_sound) or (self.sample_range != sample_range)
 
-   def generate(self, input_wave, sound_info):
+   def generate(self, input_wave, sound_info, sample_range, disk_cache = None, memory_cache = None, is_cancelled = None):
       # Samples are only calculated if the input data is different than before.
       # Otherwise, the previously calculated samples are used.
-      if self.input_wave != input_wave or self.sound_info.input_sound != sound_info.input_sound:
-         self.input_wave = input_wave
-         self.sound_info = sound_info
-         # Frequency curve.
-         if input_wave['Waveform']['Type'] == 'Noise':
-            self.frequency_curve = NullCurve()
-         else:
-            self.frequency_curve = Curve(input_wave['Frequency'])
-         # Amplitude curve.
-         self.amplitude_curve = Curve(input_wave['Amplitude'])
-         # Waveform.
-         self.setupWaveformFunc(input_wave['Waveform'])
-         self.setupPhaseShift(input_wave['Waveform'])
-         # Calculate samples.
-         self.calculateSamples()
+      if self.update(input_wave, sound_info, sample_range, disk_cache, memory_cache):
+         self.calculate(is_cancelled)
+         self.store(disk_cache, memory_cache)
       # Return samples.
       return self.samples
 
+   def update(self, input_wave, sound_info, sample_range, disk_cache = None, memory_cache = None):
+      # Returns True if the samples need to be calculated.
+      self.calculated = False
+      if not self.isChanged(input_wave, sound_info, sample_range):
+         return False
+      self.release()
+      self.silent = False
+      self.input_wave = input_wave
+      self.sound_info = sound_info
+      self.sample_range = sample_range
+      # Samples may have been calculated by another wave, or in a previous session.
+      if memory_cache is not None:
+         self.memory_key = (spec.freeze(input_wave), spec.freeze(sound_info.input_sound), sample_range, self.typecode)
+         self.samples = memory_cache.get(self.memory_key)
+         if self.samples is not None:
+            return False
+      if disk_cache is not None:
+         self.disk_key = spec.contentHash((GENERATOR_VERSION, 'WAVE', input_wave, sound_info.input_sound, sample_range, self.typecode))
+         data = disk_cache.get(self.disk_key)
+         if data is not None:
+            self.samples = memoryview(data).cast(self.typecode)
+            if memory_cache is not None:
+               memory_cache.put(self.memory_key, self.samples)
+            return False
+      return True
+
+   def calculate(self, is_cancelled = None, chunk = None, progress = None):
+      # Only the given chunk of the sample range is calculated, if given.
+      # Progress is reported as a fraction of the calculated samples, if a callback is given.
+      self.setup()
+      self.calculateSamples(*(chunk or self.sample_range), is_cancelled, progress)
+      self.calculated = True
+
+   def setup(self):
+      # After setup, any range of samples can be calculated.
+      input_wave = self.input_wave
+      # Frequency curve, used by noise only if it is band-limited.
+      if (input_wave['Waveform']['Type'] == 'Noise') and (input_wave['Waveform'].get('Color', 'White') != 'Band'):
+         self.frequency_curve = NullCurve()
+      else:
+         self.frequency_curve = Curve(input_wave['Frequency'])
+      # Amplitude curve.
+      self.amplitude_curve = Curve(input_wave['Amplitude'])
+      # Waveform.
+      self.setupWaveformFunc(input_wave['Waveform'])
+      self.setupPhaseShift(input_wave['Waveform'])
+      self.phase_index = PhaseIndex(self.frequency_curve, self.sound_info, self.waveform_x)
+      self.silent_spans = findSilentSpans(self.amplitude_curve, self.sound_info.num_samples - 1.0)
+      self.setupPeriod()
+
+   def isSteady(self):
+      # Spectrum of harmonics must not change either.
+      input_wave = self.input_wave
+      input_waveform = input_wave['Waveform']
+      return (
+         (input_waveform['Type'] != 'Noise') and
+         ((input_waveform['Type'] != 'Harmonics') or (input_waveform.get('End spectrum', input_waveform['Spectrum']) == input_waveform['Spectrum'])) and
+         (getConstantY(input_wave['Frequency']) is not None) and
+         (getConstantY(input_wave['Amplitude']) is not None))
+
+   def setupPeriod(self):
+      # Wave with constant frequency and amplitude is periodic, so only one period is calculated.
+      # Period is aligned with the start of the sound, so that any range of samples can be taken from it.
+      self.period_samples = None
+      if not self.isSteady():
+         return
+      sound_info = self.sound_info
+      amplitude_db = sound_info.amplitude_axis.convertTo(getConstantY(self.input_wave['Amplitude']))
+      if amplitude_db <= sound_info.min_amplitude_db:
+         return
+      increment = sound_info.frequency_axis.convertTo(getConstantY(self.input_wave['Frequency'])) / sound_info.sampling_rate_hz
+      period = findPeriod(increment, min(STEADY_MAX_PERIOD_SAMPLES, sound_info.num_samples))
+      if period is None:
+         return
+      samples, cycles = period
+      amplitude = 10.0**(amplitude_db / 20.0)
+      phases = [math.modf(self.waveform_x + ((ix * cycles) % samples) / samples)[0] for ix in range(samples)]
+      if self.harmonics is None:
+         values = map(self.waveform_func, phases)
+      else:
+         values = self.harmonics.getSamples(phases, 0, samples)
+      self.period_samples = array(self.typecode, (value * amplitude for value in values))
+
+   def setSharedSamples(self, shared_memory):
+      # Samples calculated by a worker process are used directly from the shared memory.
+      self.shared_memory = shared_memory
+      self.samples = shared_memory.buf.cast(self.typecode)[:self.sample_range[1] - self.sample_range[0]]
+      self.calculated = True
+
+   def store(self, disk_cache = None, memory_cache = None):
+      # Shared memory is released when the wave changes, so the memory cache gets a copy.
+      if memory_cache is not None:
+         memory_cache.put(self.memory_key, self.samples if (self.shared_memory is None) else array(self.typecode, self.samples))
+      if disk_cache is not None:
+         disk_cache.put(self.disk_key, self.samples)
+
+   def release(self):
+      # Shared memory can be closed only after its view is released.
+      if self.shared_memory is not None:
+         self.samples.release()
+         self.samples = None
+         self.shared_memory.close()
+         self.shared_memory = None
+
    def setupWaveformFunc(self, input_waveform):
+      # Noise and harmonic banks are generated for whole ranges of samples instead.
+      self.noise = None
+      self.harmonics = None
       if input_waveform['Type'] == 'Sine':
          self.waveform_func = self.calculateWaveformSine
       elif input_waveform['Type'] == 'Square':
@@ -135,7 +416,13 @@ class Wave:
       elif input_waveform['Type'] == 'Sawtooth':
          self.waveform_func = self.calculateWaveformSawtooth
       elif input_waveform['Type'] == 'Noise':
-         self.waveform_func = self.calculateWaveformNoise
+         self.waveform_func = lambda x: 0
+         self.noise = noise.Noise(input_waveform.get('Color', 'White'), input_waveform.get('Seed', 0), self.sound_info, self.frequency_curve)
+      elif input_waveform['Type'] == 'Harmonics':
+         self.waveform_func = lambda x: 0
+         self.harmonics = harmonics.HarmonicBank(input_waveform['Partials'],
+            Curve(input_waveform['Spectrum']), Curve(input_waveform.get('End spectrum', input_waveform['Spectrum'])),
+            self.sound_info, self.frequency_curve)
       elif input_waveform['Type'] == 'Custom':
          self.waveform_func = self.calculateWaveformCustom
          self.custom_curve  = Curve(input_waveform['Curve'])
@@ -160,197 +447,709 @@ class Wave:
       x = math.modf(x + 0.5)[0]
       return (2.0*x - 1.0)
 
-   def calculateWaveformNoise(self, x):
-      return random.uniform(-1.0, 1.0)
-
    def calculateWaveformCustom(self, x):
       return self.custom_func(self.custom_curve.getY(x))
 
-   def calculateSamples(self):
-      frequency_func = self.sound_info.frequency_axis.convertTo
+   def getAudibleSpans(self, start, stop):
+      # Returns ranges of samples within [start, stop) which are not in silent spans.
+      spans = []
+      ix = bisect.bisect_right(self.silent_spans, (start, math.inf)) - 1
+      ix = max(ix, 0)
+      while start < stop:
+         if (ix < len(self.silent_spans)) and (self.silent_spans[ix][0] < stop):
+            silent_start, silent_stop = self.silent_spans[ix]
+            ix += 1
+            if silent_stop <= start:
+               continue
+            if start < silent_start:
+               spans.append((start, silent_start))
+            start = silent_stop
+         else:
+            spans.append((start, stop))
+            start = stop
+      return spans
+
+   def isSilent(self, start, stop):
+      return len(self.getAudibleSpans(start, stop)) == 0
+
+   def calculateSamples(self, start, stop, is_cancelled = None, progress = None):
+      # Only samples in range [start, stop) of the sound are calculated.
       amplitude_func = self.sound_info.amplitude_axis.convertTo
-      sampling_rate_hz = self.sound_info.sampling_rate_hz
       min_amplitude_db = self.sound_info.min_amplitude_db
       num_samples = self.sound_info.num_samples
-      # Allocate array for samples.
-      self.samples = [0.0 for i in range(num_samples)]
-      for ix in range(num_samples):
-         # Calculate frequency and amplitude.
-         x = (ix / (num_samples - 1.0))
-         frequency_hz = frequency_func(self.frequency_curve.forwardGetY(x))
-         amplitude_db = amplitude_func(self.amplitude_curve.forwardGetY(x))
-         if amplitude_db > min_amplitude_db:
-            # Convert from dB to relative amplitude in range [0,1].
-            # 20 dB change corresponds to a change in relative amplitude by a factor of 10.
-            amplitude = 10.0**(amplitude_db / 20.0)
-            # Calculate waveform value.
-            waveform_y = self.waveform_func(self.waveform_x)
-            # Scale waveform value by amplitude.
-            self.samples[ix] = (waveform_y * amplitude)
+      waveform_func = self.waveform_func
+      count = stop - start
+      if self.period_samples is not None:
+         # Period is repeated from the position of the first sample.
+         period = self.period_samples
+         offset = start % len(period)
+         self.samples = (period[offset:] + period[:offset]) * (count // len(period) + 1)
+         del self.samples[count:]
+         self.silent = False
+         return
+      # Silent spans are left zero, only the audible ones are calculated.
+      # Position within the waveform is known for any sample, so there is nothing to advance across the silent spans.
+      self.samples = array(self.typecode, bytes(count * array(self.typecode).itemsize))
+      audible_spans = self.getAudibleSpans(start, stop)
+      for span_start,span_stop in audible_spans:
+         # Allocate arrays for the amplitude envelope and the position within the waveform of each sample.
+         span_count = span_stop - span_start
+         amplitudes = array(self.typecode, bytes(span_count * array(self.typecode).itemsize))
+         if self.noise is None:
+            phases = array(self.typecode, self.phase_index.getPhases(span_start, span_stop))
+         for ix in range(span_count):
+            if ix % CANCEL_CHECK_SAMPLES == 0:
+               if (is_cancelled is not None) and is_cancelled():
+                  raise Cancelled()
+               if progress is not None:
+                  progress((span_start - start + ix) / count)
+            # Calculate amplitude.
+            x = ((span_start + ix) / (num_samples - 1.0))
+            amplitude_db = amplitude_func(self.amplitude_curve.forwardGetY(x))
+            if amplitude_db > min_amplitude_db:
+               # Convert from dB to relative amplitude in range [0,1].
+               # 20 dB change corresponds to a change in relative amplitude by a factor of 10.
+               amplitudes[ix] = 10.0**(amplitude_db / 20.0)
+         # Calculate waveform values, scaled by amplitude.
+         if self.harmonics is not None:
+            # All partials are calculated block by block, which allows cancelling.
+            for first in range(0, span_count, CANCEL_CHECK_SAMPLES):
+               if (is_cancelled is not None) and is_cancelled():
+                  raise Cancelled()
+               last = min(first + CANCEL_CHECK_SAMPLES, span_count)
+               values = self.harmonics.getSamples(phases[first:last], span_start + first, span_start + last)
+               self.samples[span_start-start+first:span_start-start+last] = array(self.typecode, (
+                  (value * amplitude) for value,amplitude in zip(values, amplitudes[first:last])))
+         elif self.noise is None:
+            self.samples[span_start-start:span_stop-start] = array(self.typecode, (
+               ((waveform_func(phase) * amplitude) if (amplitude > 0.0) else 0.0)
+               for phase,amplitude in zip(phases, amplitudes)))
          else:
-            self.samples[ix] = 0.0
-         # Calculate the next position within the waveform.
-         self.waveform_x = math.modf(self.waveform_x + (frequency_hz / sampling_rate_hz))[0]
+            self.samples[span_start-start:span_stop-start] = array(self.typecode, (
+               (value * amplitude)
+               for value,amplitude in zip(self.noise.getSamples(span_start, span_stop), amplitudes)))
+      self.silent = (len(audible_spans) == 0)
 
 #===============================================================================
 class WavFile:
 
-   def __init__(self):
+   def __init__(self, disk_cache = None, memory_cache = None, typecode = SAMPLE_TYPECODE, pool = None):
       # Wave objects are preserved so that it is possible
       # to avoid generating samples when a wave is not changed.
       self.all_waves = []
+      self.typecode = typecode
+      # Serialized WAV file, once it is generated.
+      self.buffer = None
+      # Changed waves are calculated in parallel by the render pool, if given.
+      self.pool = pool
+      # Samples of waves are additionally looked up in the memory cache, which can be shared by more WAV files.
+      # Sounds and samples of waves are also looked up in the disk cache, if given.
+      # Only complete sounds are cached there, not partial renders of previews.
+      self.disk_cache = disk_cache
+      self.memory_cache = memory_cache
+
+   def countChangedWaves(self, input, sample_range = None):
+      # Number of waves whose samples would be calculated by generate().
+      sound_info = SoundInfo(input['Sound'])
+      if sample_range is None:
+         sample_range = (0, sound_info.num_samples)
+      return sum(
+         (1 if ((ix >= len(self.all_waves)) or self.all_waves[ix].isChanged(input_wave, sound_info, sample_range)) else 0)
+         for ix,input_wave in enumerate(input['Waves']))
 
-   def generate(self, input):
+   def generate(self, input, sample_range = None, is_cancelled = None, progress = None):
       self.sound_info = SoundInfo(input['Sound'])
+      # By default, all samples of the sound are generated.
+      if sample_range is None:
+         sample_range = (0, self.sound_info.num_samples)
+      self.num_samples = sample_range[1] - sample_range[0]
+      disk_cache = self.disk_cache if (sample_range == (0, self.sound_info.num_samples)) else None
+      self.calculated_samples = 0
+      if disk_cache is not None:
+         key = getRenderKey(input, self.typecode)
+         data = disk_cache.get(key)
+         if data is not None:
+            self.buffer = (ctypes.c_char * len(data)).from_buffer(data)
+            return
       # Prepare waves that will be used to generate samples.
       while len(self.all_waves) < len(input['Waves']):
-         self.all_waves.append(Wave())
+         self.all_waves.append(Wave(self.typecode))
       while len(self.all_waves) > len(input['Waves']):
-         self.all_waves.pop()
+         self.all_waves.pop().release()
       # Generate samples from each wave.
       self.all_samples = []
-      for wave,input_wave in zip(self.all_waves, input['Waves']):
-         self.all_samples.append(wave.generate(input_wave, self.sound_info))
+      pending = [
+         wave for wave,input_wave in zip(self.all_waves, input['Waves'])
+         if wave.update(input_wave, self.sound_info, sample_range, disk_cache, self.memory_cache)]
+      try:
+         # Steady waves are calculated quickly from their period, so they are not sent to the render pool.
+         pooled = [wave for wave in pending if not wave.isSteady()] if (self.pool is not None) else []
+         if len(pooled) * self.num_samples >= POOL_MIN_SAMPLES:
+            self.pool.render(pooled, is_cancelled, progress)
+         else:
+            pooled = []
+         serial = [wave for wave in pending if wave not in pooled]
+         for ix,wave in enumerate(serial):
+            wave_progress = (lambda fraction, ix = ix: progress((ix + fraction) / len(serial))) if (progress is not None) else None
+            wave.calculate(is_cancelled, None, wave_progress)
+      except BaseException:
+         # Waves which were not calculated are left without samples.
+         for wave in pending:
+            if not wave.calculated:
+               wave.input_wave = None
+         raise
+      for wave in pending:
+         wave.store(disk_cache, self.memory_cache)
+      # Silent waves are left out when mixing.
+      self.all_samples = [wave.samples for wave in self.all_waves if not wave.silent]
+      self.calculated_samples = len(pending) * self.num_samples
       # Merge samples from different waves, and serialize them into WAV file.
       self.serializeHeader()
       self.serializeData()
+      if disk_cache is not None:
+         disk_cache.put(key, self.buffer)
+
+   def detach(self):
+      # Rendered sound without the waves, which are kept by this object for further generation.
+      wav = WavFile(typecode = self.typecode)
+      wav.sound_info = self.sound_info
+      wav.num_samples = self.num_samples
+      wav.buffer = self.buffer
+      return wav
+
+   def getSamples(self):
+      # Copy of the 16-bit samples of the data chunk.
+      samples = array('h')
+      samples.frombytes(memoryview(self.buffer).cast('B')[WAV_HEADER.size:])
+      # Samples are stored in little endian byte order.
+      if sys.byteorder != 'little':
+         samples.byteswap()
+      return samples
 
    def writeToFile(self, path):
       with open(path, 'wb') as f:
          f.write(self.buffer)
 
-   def serializeInt16(self, value):
-      self.buffer[self.buffer_ix] = value & 0xff
-      self.buffer[self.buffer_ix+1] = (value >> 8) & 0xff
-      self.buffer_ix += 2
-
-   def serializeInt32(self, value):
-      self.buffer[self.buffer_ix] = value & 0xff
-      self.buffer[self.buffer_ix+1] = (value >> 8) & 0xff
-      self.buffer[self.buffer_ix+2] = (value >> 16) & 0xff
-      self.buffer[self.buffer_ix+3] = (value >> 24) & 0xff
-      self.buffer_ix += 4
-
-   def serializeString(self, value):
-      for c in value:
-         self.buffer[self.buffer_ix] = ord(c)
-         self.buffer_ix += 1
-
    def serializeHeader(self):
-      sampling_rate_hz = self.sound_info.sampling_rate_hz
-      num_samples = self.sound_info.num_samples
+      header = packWavHeader(self.sound_info.sampling_rate_hz, self.num_samples)
       # Allocate buffer.
-      self.buffer = ctypes.create_string_buffer(44+num_samples*2)
-      self.buffer_ix = 0
-      # Main chunk header.
-      self.serializeString('RIFF')              # Chunk ID.
-      self.serializeInt32((44-8)+num_samples*2) # Chunk size.
-      self.serializeString('WAVE')              # Riff type.
-      # Format chunk header.
-      self.serializeString('fmt ')              # Chunk ID.
-      self.serializeInt32(16)                   # Chunk size.
-      self.serializeInt16(1)                    # Format code (PCM).
-      self.serializeInt16(1)                    # Number of channels.
-      self.serializeInt32(sampling_rate_hz)     # Samples per second.
-      self.serializeInt32(sampling_rate_hz*2)   # Bytes per second.
-      self.serializeInt16(2)                    # Bytes per block.
-      self.serializeInt16(16)                   # Bits per sample.
-      # Data chunk header.
-      self.serializeString('data')              # Chunk ID.
-      self.serializeInt32(num_samples*2)        # Chunk size.
+      self.buffer = ctypes.create_string_buffer(len(header)+self.num_samples*2)
+      self.buffer[:len(header)] = header
+      self.buffer_ix = len(header)
 
    def serializeData(self):
-      for ix in range(self.sound_info.num_samples):
-         # Merge samples from different waves.
-         value = sum([samples[ix] for samples in self.all_samples])
-         # Convert from [-1,1] to the range of 16-bit signed integer and clip.
-         value = round(32767.0 * value)
-         value = min(max(value, -32768), 32767)
-         self.serializeInt16(value)
+      data = mixSamples(self.all_samples, self.num_samples)
+      # Copy all samples into the buffer at once.
+      ctypes.memmove(ctypes.addressof(self.buffer) + self.buffer_ix, data.buffer_info()[0], len(data) * data.itemsize)
+      self.buffer_ix += len(data) * data.itemsize
+
+#===============================================================================
+class Stream:
+
+   def __init__(self, input, typecode = SAMPLE_TYPECODE, pool = None):
+      # Sound is rendered block by block, so that the memory used does not depend on its duration.
+      # Blocks are calculated by the render pool, if given.
+      self.sound_info = SoundInfo(input['Sound'])
+      self.num_samples = self.sound_info.num_samples
+      self.pool = pool
+      self.waves = []
+      for input_wave in input['Waves']:
+         wave = Wave(typecode)
+         wave.input_wave = input_wave
+         wave.sound_info = self.sound_info
+         wave.setup()
+         self.waves.append(wave)
+
+   def getBlocks(self, is_cancelled = None, progress = None):
+      # Yields 16-bit samples (in little endian byte order) of consecutive blocks of the sound.
+      for mixed in self.getMixedBlocks(is_cancelled, progress):
+         yield quantizeSamples(mixed)
+
+   def getMixedBlocks(self, is_cancelled = None, progress = None):
+      # Yields lists of merged samples of consecutive blocks of the sound, before they are converted to 16 bits.
+      # Pool renders larger blocks, so that all its workers are used.
+      block_samples = STREAM_BLOCK_SAMPLES * (self.pool.process_count if (self.pool is not None) else 1)
+      for start in range(0, self.num_samples, block_samples):
+         stop = min(start + block_samples, self.num_samples)
+         # Waves which are silent in the block are neither calculated nor mixed.
+         waves = [wave for wave in self.waves if not wave.isSilent(start, stop)]
+         pooled = [wave for wave in waves if not wave.isSteady()] if (self.pool is not None) else []
+         if len(pooled) > 0:
+            for wave in pooled:
+               wave.sample_range = (start, stop)
+            self.pool.render(pooled, is_cancelled)
+         for wave in waves:
+            if wave not in pooled:
+               wave.calculateSamples(start, stop, is_cancelled)
+         if len(waves) > 0:
+            mixed = list(map(sum, zip(*[wave.samples for wave in waves])))
+         else:
+            mixed = [0.0] * (stop - start)
+         for wave in waves:
+            wave.release()
+         if progress is not None:
+            progress(stop / self.num_samples)
+         yield mixed
+
+   def writeToFile(self, path, is_cancelled = None, progress = None):
+      self.writeToFiles(((path, self.sound_info.sampling_rate_hz),), is_cancelled, progress)
+
+   def writeToFiles(self, outputs, is_cancelled = None, progress = None):
+      # Sound is rendered once and written to all outputs (pairs of path and sampling rate) in one pass.
+      # Outputs at other sampling rates are resampled from the rendered samples.
+      # Blocks are written as they are rendered. Incomplete files are removed if rendering fails.
+      rate_hz = self.sound_info.sampling_rate_hz
+      writers = []
+      resamplers = []
+      try:
+         for path,output_rate_hz in outputs:
+            num_samples = SoundInfo(dict(self.sound_info.input_sound, **{'Sampling rate [Hz]': output_rate_hz})).num_samples
+            writers.append(WavWriter(path, output_rate_hz, num_samples))
+            resamplers.append(resample.Resampler(rate_hz, output_rate_hz, num_samples) if (output_rate_hz != rate_hz) else None)
+         for mixed in self.getMixedBlocks(is_cancelled, progress):
+            for writer,resampler in zip(writers, resamplers):
+               writer.write(quantizeSamples(mixed if (resampler is None) else resampler.process(mixed)))
+         for writer,resampler in zip(writers, resamplers):
+            if resampler is not None:
+               writer.write(quantizeSamples(resampler.process([], final = True)))
+      except BaseException:
+         for writer in writers:
+            writer.abort()
+         raise
+      for writer in writers:
+         writer.close()
+
+#===============================================================================
+class WavWriter:
+
+   def __init__(self, path, sampling_rate_hz, num_samples):
+      # File is sized for all samples in advance, and filled through a memory map,
+      # so that the operating system writes the samples out while the next ones are rendered.
+      self.path = path
+      self.sampling_rate_hz = sampling_rate_hz
+      self.file = open(path, 'w+b')
+      self.file.truncate(WAV_HEADER.size + num_samples*2)
+      self.map = mmap.mmap(self.file.fileno(), 0)
+      # Chunks are empty until the header is patched, so that an incomplete file is not taken for a complete one.
+      self.map[:WAV_HEADER.size] = packWavHeader(sampling_rate_hz, 0)
+      self.offset = WAV_HEADER.size
+
+   def write(self, data):
+      # Data are 16-bit samples in little endian byte order.
+      data = memoryview(data).cast('B')
+      self.map[self.offset:self.offset + len(data)] = data
+      self.offset += len(data)
+
+   def close(self):
+      # Header is patched with the size of the written samples.
+      self.map[:WAV_HEADER.size] = packWavHeader(self.sampling_rate_hz, (self.offset - WAV_HEADER.size) // 2)
+      self.map.flush()
+      self.map.close()
+      # Space reserved for samples which were not written is removed.
+      self.file.truncate(self.offset)
+      self.file.close()
+
+   def abort(self):
+      self.map.close()
+      self.file.close()
+      try:
+         os.remove(self.path)
+      except OSError:
+         pass
+
+#===============================================================================
+# Runs in a worker process of the render pool.
+def renderWaveTask(task):
+   input_wave, input_sound, sample_range, chunk, typecode, block_name = task
+   wave = Wave(typecode)
+   wave.input_wave = input_wave
+   wave.sound_info = SoundInfo(input_sound)
+   wave.sample_range = sample_range
+   wave.calculate(chunk = chunk)
+   # Chunk is written to its position within the block of the wave.
+   offset = (chunk[0] - sample_range[0]) * wave.samples.itemsize
+   block = shared_memory.SharedMemory(block_name)
+   block.buf[offset:offset + len(wave.samples) * wave.samples.itemsize] = memoryview(wave.samples).cast('B')
+   block.close()
+
+#===============================================================================
+class RenderPool:
+
+   def __init__(self, process_count):
+      # Worker processes are started once and used for all renders.
+      self.process_count = process_count
+      self.pool = multiprocessing.get_context('spawn').Pool(process_count)
+
+   def close(self):
+      self.pool.terminate()
+
+   def splitRange(self, sample_range, count):
+      step = max(-(-(sample_range[1] - sample_range[0]) // count), 1)
+      return [(ix, min(ix + step, sample_range[1])) for ix in range(sample_range[0], sample_range[1], step)]
+
+   def render(self, waves, is_cancelled = None, progress = None):
+      # Each wave is calculated by workers into its own block of shared memory,
+      # which is then used by the wave without copying. Waves are split into chunks,
+      # so that all workers are used even for a single wave.
+      blocks = [
+         shared_memory.SharedMemory(create = True, size = max((wave.sample_range[1] - wave.sample_range[0]) * array(wave.typecode).itemsize, 1))
+         for wave in waves]
+      chunk_count = -(-self.process_count // len(waves))
+      tasks = [
+         (wave.input_wave, wave.sound_info.input_sound, wave.sample_range, chunk, wave.typecode, block.name)
+         for wave,block in zip(waves, blocks)
+         for chunk in self.splitRange(wave.sample_range, chunk_count)]
+      results = self.pool.imap_unordered(renderWaveTask, tasks)
+      try:
+         # Progress is reported as a fraction of the finished chunks.
+         remaining = len(tasks)
+         while remaining > 0:
+            if (is_cancelled is not None) and is_cancelled():
+               raise Cancelled()
+            try:
+               results.next(POOL_POLL_S)
+            except multiprocessing.TimeoutError:
+               continue
+            remaining -= 1
+            if progress is not None:
+               progress(1.0 - remaining / len(tasks))
+      except BaseException:
+         # Workers which are still running finish on their own.
+         for block in blocks:
+            block.close()
+            block.unlink()
+         raise
+      for wave,block in zip(waves, blocks):
+         # Name is not needed anymore, the memory is freed when the block is closed.
+         block.unlink()
+         wave.setSharedSamples(block)
 
 #===============================================================================
 class CommPort:
 
-   def __init__(self):
+   def __init__(self, get_owner = None):
+      # Commands which replace the previous ones only replace those of the same owner, which is given
+      # by the function of the request ID. Without it, all commands have the same owner.
+      self.get_owner = get_owner
       self.queue = []
-      self.value = None
+      self.values = collections.OrderedDict()
+      self.speculations = collections.OrderedDict()
+      # Number of commands set so far, used to detect that there is a newer command.
+      self.count = 0
+      # Commands can be set from more threads.
+      self.lock = threading.Lock()
       self.event = threading.Event()
 
+   def getOwner(self, request_id):
+      return self.get_owner(request_id) if (self.get_owner is not None) else None
+
    def set(self, cmd):
-      # PLAY / STOP commands overwrite previous, not yet processed commands of these types.
-      if (cmd[0] == 'PLAY') or (cmd[0] == 'STOP'):
-         self.value = cmd
-      # Otherwise command goes into the queue.
-      else:
-         self.queue.append(cmd)
-      # Signal that there is command to process.
-      self.event.set()
+      # Returns the command which was replaced by the given one, if any.
+      replaced = None
+      with self.lock:
+         self.count += 1
+         # PLAY / PREVIEW / STOP commands overwrite previous, not yet processed commands of these types.
+         if (cmd[0] == 'PLAY') or (cmd[0] == 'PREVIEW') or (cmd[0] == 'STOP'):
+            owner = self.getOwner(cmd[1])
+            replaced = self.values.pop(owner, None)
+            self.values[owner] = cmd
+         # SPECULATE command overwrites the previous one, and it is processed only when there is nothing else to do.
+         elif cmd[0] == 'SPECULATE':
+            owner = self.getOwner(cmd[1])
+            replaced = self.speculations.pop(owner, None)
+            self.speculations[owner] = cmd
+         # Otherwise command goes into the queue.
+         else:
+            self.queue.append(cmd)
+         # Signal that there is command to process.
+         self.event.set()
+      return replaced
 
    def get(self):
       self.event.wait()
-      # Queue has higher priority.
-      if len(self.queue) > 0:
-         cmd = self.queue.pop(0)
-      else:
-         cmd = self.value
-         self.value = None
-      # Indicate that there is no command to process.
-      if (len(self.queue) == 0) and (self.value is None):
-         self.event.clear()
+      with self.lock:
+         # Queue has higher priority. Commands of different owners are processed in order of their arrival.
+         if len(self.queue) > 0:
+            cmd = self.queue.pop(0)
+         elif len(self.values) > 0:
+            owner, cmd = self.values.popitem(last = False)
+         else:
+            owner, cmd = self.speculations.popitem(last = False)
+         # Indicate that there is no command to process.
+         if (len(self.queue) == 0) and (len(self.values) == 0) and (len(self.speculations) == 0):
+            self.event.clear()
       return cmd
 
 #===============================================================================
-
 class Thread:
 
-   def __init__(self):
-      self.port = CommPort()
+   def __init__(self, callback = None, disk_cache = None, memory_cache = None, process_count = 0, get_owner = None):
+      # Callback is called with events of requests: PROGRESS with the finished fraction,
+      # RENDER with each rendered sound which is published, and finally DONE, CANCELLED or ERROR with a message.
+      # It is called mostly from the wave generator thread.
+      # Owner of requests (see CommPort) can be given when requests come from more sources, each of them
+      # then has its own PLAY / PREVIEW / STOP and SPECULATE commands, and STOP only stops its own sound.
+      self.callback = callback
+      self.disk_cache = disk_cache
+      self.memory_cache = memory_cache
+      # Waves are rendered by worker processes if their count is given.
+      self.process_count = process_count
+      # Estimated time of calculating one sample of one wave, measured on previous renders.
+      self.cost_per_sample_s = None
+      # Time when the playing sound was started, its duration, and the part of the whole sound it covers.
+      self.play_started = None
+      self.play_duration_s = 0.0
+      self.play_span = (0.0, 1.0)
+      # File of the playing sound, if it is streamed, otherwise its buffer in memory.
+      # Buffer is referenced until another sound is played, so that it is not freed while it is playing.
+      self.play_path = None
+      self.play_buffer = None
+      # Owner of the request which started the playing sound.
+      self.play_owner = None
+      # Rendered sounds, keyed by frozen parameters, the most recently used last.
+      self.render_cache = collections.OrderedDict()
+      # Identifiers of requests which are not finished yet, and of those which are cancelled.
+      self.pending = set()
+      self.cancelled = set()
+      self.lock = threading.Lock()
+      self.port = CommPort(get_owner)
       self.thread = threading.Thread(target = self.waveGenThread)
       self.thread.start()
 
+   # Each request is identified by the given request ID, which is passed back with its events.
    def quit(self):
-      self.port.set(('QUIT',))
+      self.port.set(('QUIT', None))
+
+   def stop(self, request_id):
+      self.send(('STOP', request_id))
+
+   def play(self, request_id, params):
+      self.send(('PLAY', request_id, params))
+
+   def preview(self, request_id, params, budget_s):
+      self.send(('PREVIEW', request_id, params, budget_s))
+
+   def speculate(self, request_id, params):
+      # Sound is rendered in advance when there is nothing else to do, so that it is ready when it is requested.
+      # Any other request cancels it, None only cancels the previous speculation.
+      self.send(('SPECULATE', request_id, params))
+
+   def prepare(self, request_id, params):
+      self.send(('PREPARE', request_id, params))
+
+   def write(self, request_id, prepare_id, path):
+      # Writes the sound prepared by the given request to the file.
+      self.send(('WRITE', request_id, prepare_id, path))
+
+   def drop(self, request_id, prepare_id):
+      self.send(('DROP', request_id, prepare_id))
+
+   def export(self, request_id, params, outputs):
+      # Writes the sound to all outputs (pairs of path and sampling rate), rendered once at the highest of the rates.
+      self.send(('EXPORT', request_id, params, outputs))
 
-   def stop(self):
-      self.port.set(('STOP',))
+   def cancel(self, request_id):
+      with self.lock:
+         if request_id in self.pending:
+            self.cancelled.add(request_id)
 
-   def play(self, params):
-      self.port.set(('PLAY', params))
+   def getPendingRequests(self):
+      with self.lock:
+         return list(self.pending)
 
-   def prepare(self, params):
-      self.port.set(('PREPARE', params))
+   def isCancelled(self, request_id):
+      return request_id in self.cancelled
 
-   def write(self, path):
-      self.port.set(('WRITE', path))
+   def send(self, cmd):
+      with self.lock:
+         self.pending.add(cmd[1])
+      replaced = self.port.set(cmd)
+      if replaced is not None:
+         self.finish(replaced[1], 'CANCELLED')
 
-   def drop(self):
-      self.port.set(('DROP',))
+   def notify(self, event, request_id, *args):
+      if self.callback is not None:
+         self.callback(event, request_id, *args)
+
+   def finish(self, request_id, event, *args):
+      with self.lock:
+         self.pending.discard(request_id)
+         self.cancelled.discard(request_id)
+      self.notify(event, request_id, *args)
+
+   def render(self, wav, params, sample_range = None, is_cancelled = None, progress = None):
+      started = time.perf_counter()
+      wav.generate(params, sample_range, is_cancelled, progress)
+      # Update estimated cost of calculating a sample.
+      if wav.calculated_samples > 0:
+         cost_s = (time.perf_counter() - started) / wav.calculated_samples
+         if self.cost_per_sample_s is None:
+            self.cost_per_sample_s = cost_s
+         else:
+            self.cost_per_sample_s += COST_SMOOTHING * (cost_s - self.cost_per_sample_s)
+
+   def renderCached(self, wav, params, is_cancelled = None, progress = None):
+      # Returns the rendered sound from the cache, or renders it using the given WAV.
+      key = spec.freeze(params)
+      if key in self.render_cache:
+         self.render_cache.move_to_end(key)
+      else:
+         self.render(wav, params, None, is_cancelled, progress)
+         self.render_cache[key] = wav.detach()
+         while len(self.render_cache) > RENDER_CACHE_SIZE:
+            self.render_cache.popitem(last = False)
+      return self.render_cache[key]
+
+   def isStreamed(self, params):
+      # Long sounds are streamed through files instead of being rendered into memory.
+      return SoundInfo(params['Sound']).num_samples > STREAM_MIN_SAMPLES
+
+   def getPlayPosition(self):
+      # Relative position within the whole sound which is played at the moment.
+      if (self.play_started is None) or (self.play_duration_s <= 0.0):
+         return 0.0
+      pos = ((time.perf_counter() - self.play_started) % self.play_duration_s) / self.play_duration_s
+      return self.play_span[0] + pos * (self.play_span[1] - self.play_span[0])
+
+   def planPreview(self, params, budget_s, wav):
+      # Returns parameters and range of samples of a preview which can be rendered within the budget.
+      # Sampling rate is reduced first, then only a window of samples after the play position is rendered.
+      if self.cost_per_sample_s is None:
+         # Only the first block of a long sound is rendered, until the cost is known.
+         if self.isStreamed(params):
+            return (params, (0, STREAM_BLOCK_SAMPLES))
+         return (params, None)
+      sampling_rate_hz = params['Sound']['Sampling rate [Hz]']
+      for divisor in PREVIEW_RATE_DIVISORS:
+         rate_hz = sampling_rate_hz // divisor
+         if (rate_hz < PREVIEW_MIN_RATE_HZ) and (divisor > 1):
+            break
+         preview_params = dict(params, Sound = dict(params['Sound'], **{'Sampling rate [Hz]': rate_hz}))
+         num_samples = SoundInfo(preview_params['Sound']).num_samples
+         cost_s = self.cost_per_sample_s * num_samples * wav.countChangedWaves(preview_params)
+         if cost_s <= budget_s:
+            return (preview_params, None)
+      # Render as many samples as fit into the budget, assuming that all waves are changed.
+      window = max(int(budget_s / (self.cost_per_sample_s * max(len(params['Waves']), 1))), 2)
+      start = min(int(self.getPlayPosition() * num_samples), max(num_samples - window, 0))
+      return (preview_params, (start, min(start + window, num_samples)))
+
+   def startPlaying(self, wav, sample_range = None):
+      PlaySound = ctypes.windll.winmm.PlaySound
+      PlaySound(wav.buffer, 0, winsound.SND_ASYNC | winsound.SND_LOOP | winsound.SND_MEMORY | winsound.SND_NODEFAULT)
+      self.play_buffer = wav.buffer
+      num_samples = wav.sound_info.num_samples
+      if sample_range is None:
+         sample_range = (0, num_samples)
+      self.play_started = time.perf_counter()
+      self.play_duration_s = wav.num_samples / wav.sound_info.sampling_rate_hz
+      self.play_span = (sample_range[0] / num_samples, sample_range[1] / num_samples)
+      self.removePlayFile()
+
+   def startPlayingStream(self, stream, is_cancelled = None, progress = None):
+      # Sound is rendered into a temporary file, which is played when complete.
+      fd, path = tempfile.mkstemp(suffix = '.wav')
+      os.close(fd)
+      stream.writeToFile(path, is_cancelled, progress)
+      winsound.PlaySound(path, winsound.SND_ASYNC | winsound.SND_LOOP | winsound.SND_FILENAME | winsound.SND_NODEFAULT)
+      self.play_buffer = None
+      self.play_started = time.perf_counter()
+      self.play_duration_s = stream.num_samples / stream.sound_info.sampling_rate_hz
+      self.play_span = (0.0, 1.0)
+      self.removePlayFile()
+      self.play_path = path
+
+   def removePlayFile(self):
+      # File of the previous sound can be removed once another sound is played.
+      if self.play_path is not None:
+         try:
+            os.remove(self.play_path)
+         except OSError:
+            pass
+         self.play_path = None
 
    def waveGenThread(self):
       PlaySound = ctypes.windll.winmm.PlaySound
-      play_wav = WavFile()
-      prep_wav = None
+      pool = RenderPool(self.process_count) if (self.process_count > 0) else None
+      play_wav = WavFile(self.disk_cache, self.memory_cache, pool = pool)
+      preview_wav = WavFile(None, self.memory_cache)
+      # Sounds prepared for writing, keyed by ID of the PREPARE request.
+      prepared_wavs = {}
       while True:
          cmd = self.port.get()
+         request_id = cmd[1]
          # QUIT command: Stop playing and exit from function.
          if cmd[0] == 'QUIT':
             PlaySound(0, 0, 0)
+            self.play_buffer = None
+            self.removePlayFile()
+            if pool is not None:
+               pool.close()
             return
-         # STOP command: Stop playing.
-         elif cmd[0] == 'STOP':
-            PlaySound(0, 0, 0)
-         # PLAY command: Generate WAV and play it from memory.
-         elif cmd[0] == 'PLAY':
-            play_wav.generate(cmd[1])
-            PlaySound(play_wav.buffer, 0, winsound.SND_ASYNC | winsound.SND_LOOP | winsound.SND_MEMORY | winsound.SND_NODEFAULT)
-         # PREPARE command: Generate WAV and save it for later.
-         elif cmd[0] == 'PREPARE':
-            prep_wav =  WavFile()
-            prep_wav.generate(cmd[1])
-         # WRITE command: Write the previously generated WAV to the given file.
-         elif cmd[0] == 'WRITE':
-            prep_wav.writeToFile(cmd[1])
-            prep_wav = None
-         # DROP command: Drop the previously generated WAV.
-         elif cmd[0] == 'DROP':
-            prep_wav = None
+         if self.isCancelled(request_id):
+            self.finish(request_id, 'CANCELLED')
+            continue
+         is_cancelled = lambda: self.isCancelled(request_id)
+         progress = lambda fraction: self.notify('PROGRESS', request_id, fraction)
+         try:
+            # STOP command: Stop playing.
+            if cmd[0] == 'STOP':
+               if self.port.getOwner(request_id) == self.play_owner:
+                  PlaySound(0, 0, 0)
+                  self.play_buffer = None
+            # PLAY command: Generate WAV and play it from memory, or from a file if it is streamed.
+            elif (cmd[0] == 'PLAY') and self.isStreamed(cmd[2]):
+               self.startPlayingStream(Stream(cmd[2], pool = pool), is_cancelled, progress)
+               self.play_owner = self.port.getOwner(request_id)
+            elif cmd[0] == 'PLAY':
+               wav = self.renderCached(play_wav, cmd[2], is_cancelled, progress)
+               self.startPlaying(wav)
+               self.play_owner = self.port.getOwner(request_id)
+               self.notify('RENDER', request_id, wav)
+            # PREVIEW command: Generate WAV within the time budget and play it from memory.
+            # Preview is rendered into its own WAV, so that waves rendered for PLAY stay cached.
+            # Previous preview is stopped before its buffer is replaced.
+            elif cmd[0] == 'PREVIEW':
+               if (self.play_buffer is not None) and (self.play_buffer is preview_wav.buffer):
+                  PlaySound(0, 0, 0)
+                  self.play_buffer = None
+               params, sample_range = self.planPreview(cmd[2], cmd[3], preview_wav)
+               self.render(preview_wav, params, sample_range, is_cancelled)
+               self.startPlaying(preview_wav, sample_range)
+               self.play_owner = self.port.getOwner(request_id)
+            # SPECULATE command: Generate WAV into the cache, unless there is a newer command.
+            # Streamed sounds are not rendered in advance.
+            elif cmd[0] == 'SPECULATE':
+               if (cmd[2] is not None) and not self.isStreamed(cmd[2]):
+                  count = self.port.count
+                  wav = self.renderCached(play_wav, cmd[2], lambda: is_cancelled() or (self.port.count != count), progress)
+                  self.notify('RENDER', request_id, wav)
+            # PREPARE command: Generate WAV and save it for later. Streamed sounds are rendered when written.
+            elif (cmd[0] == 'PREPARE') and self.isStreamed(cmd[2]):
+               prepared_wavs[request_id] = Stream(cmd[2], pool = pool)
+            elif cmd[0] == 'PREPARE':
+               prepared_wavs[request_id] = self.renderCached(play_wav, cmd[2], is_cancelled, progress)
+               self.notify('RENDER', request_id, prepared_wavs[request_id])
+            # WRITE command: Write the previously generated WAV to the given file.
+            elif cmd[0] == 'WRITE':
+               if cmd[2] not in prepared_wavs:
+                  raise ValueError('Sound was not prepared')
+               wav = prepared_wavs.pop(cmd[2])
+               if isinstance(wav, Stream):
+                  wav.writeToFile(cmd[3], is_cancelled, progress)
+               else:
+                  wav.writeToFile(cmd[3])
+            # DROP command: Drop the previously generated WAV.
+            elif cmd[0] == 'DROP':
+               prepared_wavs.pop(cmd[2], None)
+            # EXPORT command: Stream the sound at the highest sampling rate, and write it to the files at all rates.
+            elif cmd[0] == 'EXPORT':
+               rate_hz = max(output_rate_hz for path,output_rate_hz in cmd[3])
+               params = dict(cmd[2], Sound = dict(cmd[2]['Sound'], **{'Sampling rate [Hz]': rate_hz}))
+               Stream(params, pool = pool).writeToFiles(cmd[3], is_cancelled, progress)
+         except Cancelled:
+            self.finish(request_id, 'CANCELLED')
+         except Exception as e:
+            self.finish(request_id, 'ERROR', str(e))
+         else:
+            self.finish(request_id, 'DONE')
@@ -1,5 +1,6 @@
-
 from src import main
 
-app = main.WaveformEditor()
-app.run()
+# Editor is started only when this module is run as a script.
+if __name__ == '__main__':
+   app = main.WaveformEditor()
+   app.run()